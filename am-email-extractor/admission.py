@@ -0,0 +1,288 @@
+"""
+Admission control for the extraction endpoints
+
+At most ADMISSION_MAX_CONCURRENT extractions run at once per process, and
+at most ADMISSION_MAX_PER_USER of them for one user. Requests beyond that
+wait in a bounded queue (ADMISSION_QUEUE_SIZE per priority class, and no
+more than ADMISSION_MAX_PER_USER waiting per user) for up to
+ADMISSION_QUEUE_TIMEOUT seconds. A request that finds the queue full, or
+times out in it, is rejected at once with Overloaded, which the API turns
+into 429 with a Retry-After estimated from recent service times and the
+queue length.
+Under overload, latency is bounded by the queue timeout plus one
+extraction instead of growing with the backlog.
+
+Freed slots are handed to the waiter chosen by the fair scheduler
+(fair_scheduler.py: interactive before refresh before backfill, users
+served in turn within a class), so waiters are never woken just to lose a
+race. Requests are interactive unless the X-Priority header or a
+`priority` JWT claim names a less urgent class. Both serving modes share
+one controller: Flask request threads block in acquire(), ASGI tasks
+await acquire_async().
+
+A queued request may have been abandoned by its client by the time it is
+admitted; check_client() (WSGI) lets the endpoints stop before each
+expensive stage instead of parsing a statement nobody will read.
+"""
+import os
+import time
+import math
+import select
+import socket
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+import fair_scheduler
+import metrics
+
+
+class Overloaded(Exception):
+    """The request was not admitted; retry after `retry_after` seconds"""
+
+    def __init__(self, message, reason, retry_after):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ClientDisconnected(Exception):
+    """The client went away while its request was queued or running"""
+
+
+class Ticket:
+    """An admitted request; hand it back to release()"""
+    __slots__ = ('user_id', 'priority', 'admitted_at', 'wake', 'admitted')
+
+    def __init__(self, user_id, priority, wake=None):
+        self.user_id = user_id
+        self.priority = priority
+        self.wake = wake
+        self.admitted = False
+        self.admitted_at = None
+
+
+class Admission:
+    def __init__(self, max_concurrent=None, max_per_user=None, queue_size=None, queue_timeout=None):
+        self.enabled = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+        self.max_concurrent = max_concurrent or int(os.environ.get('ADMISSION_MAX_CONCURRENT', 8))
+        self.max_per_user = max_per_user or int(os.environ.get('ADMISSION_MAX_PER_USER', 2))
+        self.queue_size = queue_size if queue_size is not None else int(os.environ.get('ADMISSION_QUEUE_SIZE', 32))
+        self.queue_timeout = queue_timeout or float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 15))
+        self.max_retry_after = int(os.environ.get('ADMISSION_MAX_RETRY_AFTER', 60))
+
+        self._lock = threading.Lock()
+        self._waiters = fair_scheduler.FairScheduler(self.max_concurrent)
+        self._active = 0
+        self._active_by_user = {}
+        self._waiting_by_user = {}
+        # Exponentially weighted mean service time, seeded with a typical PDF extraction
+        self._service_seconds = 5.0
+        self._rejected = {}
+
+    def _user_eligible(self, user_id):
+        return self._active_by_user.get(user_id, 0) < self.max_per_user
+
+    def _eligible(self, user_id, priority):
+        return self._active < self.max_concurrent and self._waiters.has_room(priority) \
+            and self._user_eligible(user_id)
+
+    def _admit(self, ticket):
+        self._active += 1
+        self._waiters.started(ticket.priority)
+        self._active_by_user[ticket.user_id] = self._active_by_user.get(ticket.user_id, 0) + 1
+        ticket.admitted = True
+        ticket.admitted_at = time.monotonic()
+
+    def _retry_after(self):
+        waves = (len(self._waiters) + self._active) / self.max_concurrent
+        return max(1, min(self.max_retry_after, math.ceil(self._service_seconds * waves)))
+
+    def _reject(self, reason, message):
+        self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        metrics.add_rejection(reason)
+        return Overloaded(message, reason, self._retry_after())
+
+    def _enqueue(self, user_id, priority, wake):
+        """Admit now (ticket.admitted) or queue; raises Overloaded when the queue is full"""
+        ticket = Ticket(user_id, priority, wake)
+        if not self.enabled or self._eligible(user_id, priority):
+            self._admit(ticket)
+            return ticket
+        if self._waiters.waiting(priority) >= self.queue_size:
+            raise self._reject('queue_full', 'Server busy, try again later')
+        if self._waiting_by_user.get(user_id, 0) >= self.max_per_user:
+            raise self._reject('user_limit', 'Too many extractions in progress for this user, try again later')
+        self._waiters.push(ticket, user_id, priority)
+        self._waiting_by_user[user_id] = self._waiting_by_user.get(user_id, 0) + 1
+        return ticket
+
+    def _dequeue(self, ticket):
+        self._waiters.remove(ticket, ticket.user_id, ticket.priority)
+        self._unwait(ticket)
+
+    def _unwait(self, ticket):
+        remaining = self._waiting_by_user[ticket.user_id] - 1
+        if remaining:
+            self._waiting_by_user[ticket.user_id] = remaining
+        else:
+            del self._waiting_by_user[ticket.user_id]
+
+    def _dispatch(self):
+        """Hand free slots to the waiters the scheduler picks"""
+        while self._active < self.max_concurrent:
+            picked = self._waiters.pop(self._user_eligible)
+            if picked is None:
+                break
+            ticket = picked[0]
+            self._unwait(ticket)
+            self._admit(ticket)
+            ticket.wake()
+
+    def _timed_out(self, ticket):
+        """Called by a waiter whose wait ended; True if it was admitted after all"""
+        with self._lock:
+            if ticket.admitted:
+                return True
+            self._dequeue(ticket)
+            raise self._reject('timeout', 'Server busy, try again later')
+
+    def acquire(self, user_id, priority=fair_scheduler.DEFAULT_PRIORITY):
+        """
+        Wait for a slot (blocking the calling thread)
+
+        Args:
+            priority: interactive, refresh or backfill
+
+        Returns:
+            Ticket to pass to release()
+
+        Raises:
+            Overloaded when the queue is full or the wait times out
+        """
+        event = threading.Event()
+        with self._lock:
+            ticket = self._enqueue(user_id, priority, event.set)
+        if not ticket.admitted:
+            with metrics.stage('admission_wait'):
+                event.wait(self.queue_timeout)
+                self._timed_out(ticket)
+        return ticket
+
+    async def acquire_async(self, user_id, priority=fair_scheduler.DEFAULT_PRIORITY):
+        """acquire() for asyncio tasks; the wait holds no thread"""
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: admitted.done() or admitted.set_result(None))
+
+        with self._lock:
+            ticket = self._enqueue(user_id, priority, wake)
+        if ticket.admitted:
+            return ticket
+        try:
+            with metrics.stage('admission_wait'):
+                try:
+                    await asyncio.wait_for(asyncio.shield(admitted), self.queue_timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._timed_out(ticket)
+        except asyncio.CancelledError:
+            # Cancelled while queued: give the slot back if it was just handed over
+            with self._lock:
+                if not ticket.admitted:
+                    self._dequeue(ticket)
+                    raise
+            self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket):
+        with self._lock:
+            self._active -= 1
+            self._waiters.finished(ticket.priority)
+            remaining = self._active_by_user[ticket.user_id] - 1
+            if remaining:
+                self._active_by_user[ticket.user_id] = remaining
+            else:
+                del self._active_by_user[ticket.user_id]
+            elapsed = time.monotonic() - ticket.admitted_at
+            self._service_seconds = 0.9 * self._service_seconds + 0.1 * elapsed
+            self._dispatch()
+
+    @contextmanager
+    def admit(self, user_id, priority=fair_scheduler.DEFAULT_PRIORITY):
+        ticket = self.acquire(user_id, priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def state(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'active': self._active,
+                'queued': len(self._waiters),
+                'max_concurrent': self.max_concurrent,
+                'max_per_user': self.max_per_user,
+                'queue_size': self.queue_size,
+                'service_seconds': round(self._service_seconds, 2),
+                'classes': self._waiters.state(),
+                'rejected': dict(self._rejected)
+            }
+
+
+def request_priority(headers, jwt_payload):
+    """
+    Priority class of a request: the less urgent of the X-Priority header and
+    the `priority` JWT claim, interactive when neither is set. Clients can
+    only lower their own priority.
+    """
+    named = [fair_scheduler.parse_priority(value, None)
+             for value in (headers.get('X-Priority'), (jwt_payload or {}).get('priority'))]
+    named = [priority for priority in named if priority]
+    return max(named, key=fair_scheduler.PRIORITIES.index) if named else fair_scheduler.DEFAULT_PRIORITY
+
+
+def client_disconnected(environ):
+    """
+    Whether the client of a WSGI request has closed its connection
+
+    Peeks at the request socket (Werkzeug and gunicorn expose it in the
+    environ): readable with nothing to read means the peer sent FIN. Servers
+    that don't expose the socket, and TLS sockets, report False.
+    """
+    sock = environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except ValueError:
+        # Peeking isn't supported (TLS) or the descriptor is already closed
+        return sock.fileno() == -1
+    except OSError:
+        return True
+
+
+def check_client(environ):
+    """Raise ClientDisconnected before an expensive stage if the client is gone"""
+    if client_disconnected(environ):
+        metrics.add_rejection('client_gone')
+        logging.info("Client disconnected, abandoning request")
+        raise ClientDisconnected('Client disconnected')
+
+
+# Global instance, created on first use
+admission_instance = None
+_instance_lock = threading.Lock()
+
+def get_admission():
+    global admission_instance
+    if admission_instance is None:
+        with _instance_lock:
+            if admission_instance is None:
+                admission_instance = Admission()
+    return admission_instance
@@ -2,23 +2,85 @@
 Gmail Extractor API - Microservice for extracting broker portfolio holdings
 API-only version with JWT authentication and CORS support
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, make_response, send_file, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import os
 import jwt
 from functools import wraps
-import tempfile
 from dotenv import load_dotenv
 import gmail_integration
 import database
 import kafka_producer
+import outbox_relay
+import portfolio_view
+import brokers
+import pipeline
+import statement_archive
+import isin_master
+import snapshot_writer
+import metrics
+import tracing
+import profiling
+import cost_stats
+import admission
+import result_cache
+import upload_stream
+import batch_upload
+import fast_json
+import compression
 import logging
+import json
+import base64
+import hashlib
+from bson import ObjectId
+from datetime import datetime
 
 # Load environment variables
 load_dotenv()
+tracing.configure_logging()
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify/request.json through fast_json (orjson when installed)"""
+    
+    def dumps(self, obj, **kwargs):
+        return fast_json.dumps(obj).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return fast_json.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Straight to bytes, skipping the str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(fast_json.dumps(obj) + b'\n', mimetype=self.mimetype)
+
+
+class ExtractorRequest(Request):
+    """Uploaded files stream into upload_stream.UploadSink instead of Werkzeug's spooled temp files"""
+    
+    @property
+    def is_batch(self):
+        return self.endpoint == 'extract_batch'
+    
+    @property
+    def max_content_length(self):
+        # A batch may carry many statements, each within the usual limit
+        return batch_upload.MAX_BYTES if self.is_batch else super().max_content_length
+    
+    @property
+    def max_form_parts(self):
+        # file_<id>, broker_<id> and password_<id> per statement, plus a shared broker
+        return 3 * batch_upload.MAX_FILES + 1 if self.is_batch else super().max_form_parts
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # A bad file in a batch is reported in its own result instead of failing the request
+        return upload_stream.UploadSink(filename, app.config['MAX_CONTENT_LENGTH'], strict=not self.is_batch)
+
 
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = ExtractorRequest
+app.json = FastJSONProvider(app)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # CORS Configuration
@@ -27,72 +89,186 @@ CORS(app, resources={
     r"/api/*": {
         "origins": [origin.strip() for origin in allowed_origins],
         "methods": ["GET", "POST", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
-        "expose_headers": ["Content-Type"],
+        "allow_headers": ["Content-Type", "Authorization", "If-None-Match", "X-Request-ID", "X-Profile", "X-Priority"],
+        "expose_headers": ["Content-Type", "ETag", "X-Request-ID", "X-Profile-Id", "Retry-After"],
         "supports_credentials": True
     }
 })
 
+def broker_label(broker):
+    """
+    Metrics label for a request's <broker> path segment, bound before
+    authentication: unsupported names share 'invalid', so arbitrary paths
+    can't create new time series
+    """
+    if broker is None or broker in brokers.SUPPORTED_BROKERS:
+        return broker
+    return 'invalid'
+
+@app.before_request
+def bind_request_context():
+    # Label this request's stage metrics with its broker and bind its
+    # request id; reset for every request since worker threads are reused
+    broker = (request.view_args or {}).get('broker')
+    metrics.bind_broker(broker_label(broker))
+    metrics.start_costs()
+    route = request.url_rule.rule if request.url_rule else request.path
+    g.trace_root = tracing.begin_request(
+        f"{request.method} {route}", request.headers.get('X-Request-ID'),
+        **({'broker': broker} if broker else {})
+    )
+
 @app.after_request
 def add_cors_headers(response):
     if request.method == 'OPTIONS':
         response.headers['Access-Control-Allow-Private-Network'] = 'true'
+    response.headers['X-Request-ID'] = tracing.request_id()
+    if g.get('trace_root') is not None:
+        g.trace_root.set(status_code=response.status_code)
+    return response
+
+@app.after_request
+def compress_response(response):
+    if response.direct_passthrough or response.is_streamed:
+        return response
+    data = response.get_data()
+    if not compression.should_compress(response.mimetype, len(data), response.status_code,
+                                       response.content_encoding):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = compression.choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    response.set_data(compression.compress(data, encoding))
+    response.content_encoding = encoding
+    if 'ETag' in response.headers:
+        response.headers['ETag'] = compression.weak_etag(response.headers['ETag'])
     return response
 
+@app.teardown_request
+def end_request_trace(error=None):
+    tracing.end_request(g.pop('trace_root', None), error)
+
 # Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET')
 JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
 API_VERSION = os.environ.get('API_VERSION', 'v1')
 PORT = int(os.environ.get('PORT', 8080))
+OUTBOX_ENABLED = os.environ.get('OUTBOX_ENABLED', 'true').lower() == 'true'
+
+SUPPORTED_BROKERS = brokers.SUPPORTED_BROKERS
 
-ALLOWED_EXTENSIONS = {'pdf', 'xlsx'}
-SUPPORTED_BROKERS = ['groww', 'zerodha', 'angleone', 'dhan', 'mstock']
 
+class AuthError(Exception):
+    def __init__(self, message, status=401):
+        super().__init__(message)
+        self.status = status
 
-def allowed_file(filename):
-    """Check if file has allowed extension"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def authenticate(auth_header):
+    """
+    Verify a "Bearer <token>" Authorization header
+    
+    Returns:
+        (user_id, JWT payload)
+    
+    Raises:
+        AuthError with the message and HTTP status to return
+    """
+    if not auth_header:
+        raise AuthError('Authorization header missing')
+    
+    # Expected format: "Bearer <token>"
+    token_parts = auth_header.split()
+    if len(token_parts) != 2 or token_parts[0].lower() != 'bearer':
+        raise AuthError('Invalid authorization header format')
+    
+    # Decode and verify JWT
+    if not JWT_SECRET:
+        raise AuthError('JWT_SECRET not configured', 500)
+    
+    try:
+        with metrics.stage('jwt_decode'):
+            payload = jwt.decode(token_parts[1], JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise AuthError('Token has expired')
+    except jwt.InvalidTokenError as e:
+        raise AuthError(f'Invalid token: {str(e)}')
+    
+    user_id = payload.get('user_id') or payload.get('sub') or payload.get('id')
+    if not user_id:
+        raise AuthError('User ID not found in token')
+    return user_id, payload
 
 
 def require_jwt(f):
     """Decorator to require JWT authentication"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # Get JWT token from Authorization header
-        auth_header = request.headers.get('Authorization')
+        try:
+            # Add user_id and the full payload (for additional claims) to request context
+            request.user_id, request.jwt_payload = authenticate(request.headers.get('Authorization'))
+        except AuthError as e:
+            return jsonify({'error': str(e)}), e.status
         
-        if not auth_header:
-            return jsonify({'error': 'Authorization header missing'}), 401
+        return f(*args, **kwargs)
+    
+    return decorated_function
+
+
+def require_admin(f):
+    """Decorator to require an admin JWT; apply below require_jwt"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not profiling.is_admin(request.jwt_payload):
+            return jsonify({'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    
+    return decorated_function
+
+
+def admitted(f):
+    """Decorator to run a request under admission control (429 when overloaded); apply below require_jwt"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        controller = admission.get_admission()
+        try:
+            ticket = controller.acquire(request.user_id,
+                                        admission.request_priority(request.headers, request.jwt_payload))
+        except admission.Overloaded as e:
+            return too_many_requests(e)
         
         try:
-            # Expected format: "Bearer <token>"
-            token_parts = auth_header.split()
-            if len(token_parts) != 2 or token_parts[0].lower() != 'bearer':
-                return jsonify({'error': 'Invalid authorization header format'}), 401
-            
-            token = token_parts[1]
-            
-            # Decode and verify JWT
-            if not JWT_SECRET:
-                return jsonify({'error': 'JWT_SECRET not configured'}), 500
-            
-            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-            
-            # Add user_id to request context
-            request.user_id = payload.get('user_id') or payload.get('sub') or payload.get('id')
-            
-            if not request.user_id:
-                return jsonify({'error': 'User ID not found in token'}), 401
-            
-            # Store full payload for additional claims if needed
-            request.jwt_payload = payload
-            
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error': 'Token has expired'}), 401
-        except jwt.InvalidTokenError as e:
-            return jsonify({'error': f'Invalid token: {str(e)}'}), 401
+            # The client may have given up while the request was queued
+            admission.check_client(request.environ)
+            return f(*args, **kwargs)
+        except admission.ClientDisconnected as e:
+            return client_gone(e)
+        finally:
+            controller.release(ticket)
+    
+    return decorated_function
+
+
+def profiled(f):
+    """Decorator to run a request under the profiler when an admin asks for it; apply below require_jwt"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        profiler = profiling.get_profiler()
+        mode = profiler.enabled and profiling.requested_mode(request.headers, request.jwt_payload)
+        if not mode:
+            return f(*args, **kwargs)
         
-        return f(*args, **kwargs)
+        context = {
+            'route': request.url_rule.rule,
+            'broker': kwargs.get('broker'),
+            'user': profiling.anonymize_user(request.user_id),
+            'request_id': tracing.request_id()
+        }
+        response, profile_id = profiler.run(mode, lambda: make_response(f(*args, **kwargs)), context)
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+        return response
     
     return decorated_function
 
@@ -101,16 +277,59 @@ def require_jwt(f):
 # Health & Info Endpoints
 # ============================================================================
 
+def dependency_status():
+    """Report each external dependency and whether readiness depends on it"""
+    mongo = database.get_db().state()
+    mongo['required'] = True
+    
+    kafka = kafka_producer.get_producer().state()
+    # Outbox and async publishing buffer events, so Kafka being down
+    # doesn't stop the API from serving extractions
+    kafka['required'] = not (OUTBOX_ENABLED or kafka['async'])
+    
+    return {'mongodb': mongo, 'kafka': kafka}
+
+
 @app.route(f'/api/{API_VERSION}/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
+    dependencies = dependency_status()
+    ready = all(d['state'] == 'connected' for d in dependencies.values() if d['required'])
     return jsonify({
         'status': 'healthy',
+        'ready': ready,
         'version': '1.0.0',
-        'service': 'gmail-extractor-api'
+        'service': 'gmail-extractor-api',
+        'dependencies': dependencies,
+        'admission': admission.get_admission().state()
     })
 
 
+@app.route(f'/api/{API_VERSION}/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness: the process is up and serving (no dependency checks)"""
+    return jsonify({'status': 'alive'})
+
+
+@app.route(f'/api/{API_VERSION}/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: required dependencies are connected"""
+    dependencies = dependency_status()
+    ready = all(d['state'] == 'connected' for d in dependencies.values() if d['required'])
+    return jsonify({
+        'status': 'ready' if ready else 'not_ready',
+        'dependencies': dependencies
+    }), 200 if ready else 503
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms and volume counters"""
+    response = make_response(metrics.render())
+    response.headers['Content-Type'] = metrics.CONTENT_TYPE
+    return response
+
+
 @app.route(f'/api/{API_VERSION}/brokers', methods=['GET'])
 def list_brokers():
     """List supported brokers"""
@@ -213,8 +432,7 @@ def gmail_callback():
             # We must pass the same redirect_uri to fetch_token if it's not handled by the flow
             flow.fetch_token(code=code)
         except Exception as e:
-            import traceback
-            traceback.print_exc()
+            logging.exception("OAuth token exchange failed")
             return jsonify({'error': f'Auth failed: {str(e)}'}), 401
         
         # Save credentials
@@ -234,8 +452,7 @@ def gmail_callback():
         })
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logging.exception("Gmail OAuth callback failed")
         return jsonify({'error': str(e)}), 500
 
 
@@ -288,6 +505,8 @@ def gmail_disconnect():
 
 @app.route(f'/api/{API_VERSION}/extract/gmail/<broker>', methods=['GET'])
 @require_jwt
+@admitted
+@profiled
 def extract_from_gmail(broker):
     """Fetch statement from Gmail and extract holdings"""
     try:
@@ -297,36 +516,35 @@ def extract_from_gmail(broker):
         # Get PAN from query parameter
         pan_number = request.args.get('pan', '').strip().upper()
         
-        # Debug Log
-        import sys
-        sys.stderr.write(f"DEBUG: Starting extraction for broker: {broker}\n")
+        logging.debug("Starting extraction for broker %s", broker)
         
         if not pan_number and broker != 'angleone':
-            sys.stderr.write("DEBUG: Missing PAN number\n")
+            logging.debug("Missing PAN number")
             return jsonify({'error': 'PAN number is required'}), 400
         
         # Get Gmail service
         user_id = request.user_id
-        sys.stderr.write(f"DEBUG: Getting Gmail service for user: {user_id}\n")
-        service, _, _ = gmail_integration.get_gmail_service(user_id)
+        logging.debug("Getting Gmail service for user %s", user_id)
+        with tracing.span('gmail.service'):
+            service, _, _ = gmail_integration.get_gmail_service(user_id)
         
         if not service:
-            sys.stderr.write("DEBUG: Gmail not connected\n")
+            logging.debug("Gmail not connected")
             return jsonify({'error': 'Gmail not connected. Please connect Gmail first.'}), 401
         
         # Fetch latest statement
-        sys.stderr.write(f"DEBUG: Fetching latest email from {broker}...\n")
-        result = gmail_integration.get_latest_statement(service, broker)
+        logging.debug("Fetching latest email from %s", broker)
+        with tracing.span('gmail.latest_statement', broker=broker):
+            result = gmail_integration.get_latest_statement(service, broker)
         
         if not result:
-            sys.stderr.write(f"DEBUG: No emails found for {broker}\n")
+            logging.debug("No emails found for %s", broker)
             return jsonify({'error': f'No recent emails found from {broker.upper()}'}), 404
         
         # Extract holdings
         attachment_path = result['attachment']['path']
         temp_dir = result.get('temp_dir')
-        sys.stderr.write(f"DEBUG: Email found. Subject: {result['email']['subject']}\n")
-        sys.stderr.write(f"DEBUG: Attachment saved to: {attachment_path}\n")
+        logging.debug("Email found. Subject: %s, attachment saved to %s", result['email']['subject'], attachment_path)
         
         # Determine password
         if broker == 'angleone':
@@ -335,136 +553,360 @@ def extract_from_gmail(broker):
             password = pan_number
         
         # Import and run extractor
-        sys.stderr.write(f"DEBUG: Extracting holdings with password length: {len(password) if password else 0}\n")
-        holdings = extract_broker_holdings(broker, attachment_path, password)
-        sys.stderr.write(f"DEBUG: Extracted {len(holdings)} holdings\n")
+        try:
+            admission.check_client(request.environ)
+            holdings = extract_broker_holdings(broker, attachment_path, password)
+        except Exception:
+            cleanup_temp_files(attachment_path, temp_dir)
+            raise
+        logging.debug("Extracted %d holdings", len(holdings))
         
         # Save to MongoDB
         metadata = {
             'email_subject': result['email']['subject'],
             'email_date': result['email']['date'],
             'filename': result['attachment']['filename'],
-            'source': 'gmail'
+            'source': 'gmail',
+            **metrics.costs()
         }
         
-        sys.stderr.write("DEBUG: Saving to MongoDB...\n")
-        doc_id = database.get_db().save_holdings(user_id, broker, holdings, metadata)
-        sys.stderr.write(f"DEBUG: Saved to MongoDB. Doc ID: {doc_id}\n")
-        
-        # Prepare Kafka Payload
-        import uuid
-        process_id = str(uuid.uuid4())
-        
-        equities = []
-        mutual_funds = []
-        
-        for holding in holdings:
-            # Simple ISIN check: INF usually Mutual Fund, INE usually Equity
-            isin = holding.get('isin_code', '')
-            if isin.startswith('INF'):
-                mutual_funds.append(holding)
-            else:
-                equities.append(holding)
-        
-        # Send notification to Kafka
-        sys.stderr.write("DEBUG: Sending Kafka event...\n")
-        kafka_producer.get_producer().send_update_event(
-            process_id=process_id,
-            user_id=user_id,
-            broker=broker,
-            portfolio_id=doc_id,
-            equities=equities,
-            mutual_funds=mutual_funds
+        doc_id, pending = save_extraction(user_id, broker, holdings, metadata)
+        logging.debug("Saved to MongoDB. Doc ID: %s", doc_id)
+        statement_archive.archive_in_background(
+            user_id, broker, attachment_path, password, result['attachment']['filename'], 'gmail', doc_id
         )
-        sys.stderr.write("DEBUG: Kafka event sent.\n")
         
         # Clean up
         cleanup_temp_files(attachment_path, temp_dir)
         
-        return jsonify({
+        return extraction_response({
             'success': True,
             'broker': broker,
             'count': len(holdings),
             'holdings': holdings,
             'metadata': metadata,
             'db_id': doc_id
-        })
+        }, pending)
         
+    except admission.ClientDisconnected as e:
+        return client_gone(e)
+    except snapshot_writer.WriteQueueFull as e:
+        return storage_busy(e)
     except Exception as e:
-        import sys
-        import traceback
-        sys.stderr.write(f"ERROR CRASH: {str(e)}\n")
-        traceback.print_exc()
+        logging.exception(f"Gmail extraction failed for {broker}")
         return jsonify({'error': str(e)}), 500
 
 
 @app.route(f'/api/{API_VERSION}/extract/upload/<broker>', methods=['POST'])
 @require_jwt
+@admitted
+@profiled
 def extract_from_upload(broker):
     """Upload file and extract holdings"""
     try:
         if broker not in SUPPORTED_BROKERS:
             return jsonify({'error': f'Invalid broker. Supported: {SUPPORTED_BROKERS}'}), 400
         
+        # The file streams into an UploadSink (hashed, type-checked, size-bounded)
+        # while the body is parsed; a bad upload raises UploadRejected early
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
         
         file = request.files['file']
         password = request.form.get('password', '').strip()
         
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
-        
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Only PDF and Excel files are allowed'}), 400
-        
-        # Save to temporary file
-        filename = file.filename or ''
-        file_ext = '.pdf' if filename.endswith('.pdf') else '.xlsx'
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp_file:
-            file.save(tmp_file.name)
-            tmp_path = tmp_file.name
-        
         try:
-            # Extract holdings
+            upload = file.stream.finish()
+            metrics.add_bytes(upload.size, 'upload')
             pwd = password if password else None
-            holdings = extract_broker_holdings(broker, tmp_path, pwd)
+            
+            # Same statement extracted before by the current parser?
+            cache = result_cache.get_cache()
+            holdings = cache.lookup(upload.sha256, broker, pwd)
+            cached = holdings is not None
+            if not cached:
+                admission.check_client(request.environ)
+                holdings = extract_broker_holdings(broker, upload.path, pwd)
+                cache.store(upload.sha256, broker, pwd, holdings)
             
             # Save to MongoDB
             metadata = {
                 'source': 'upload',
-                'filename': filename
+                'filename': file.filename,
+                'statement_sha256': upload.sha256,
+                **({'cached': True} if cached else {}),
+                **metrics.costs()
             }
-            doc_id = database.get_db().save_holdings(request.user_id, broker, holdings, metadata)
-            
-            # Send notification to Kafka
-            kafka_producer.get_producer().send_update_event(
-                user_id=request.user_id,
-                status="SUCCESS",
-                db_id=doc_id,
-                broker=broker
-            )
-            
-            # Clean up
-            os.unlink(tmp_path)
-            
-            return jsonify({
-                'success': True,
-                'broker': broker,
-                'count': len(holdings),
-                'holdings': holdings,
-                'db_id': doc_id
-            })
-            
-        except Exception as e:
-            # Clean up on error
-            if os.path.exists(tmp_path):
-                os.unlink(tmp_path)
-            raise e
+            doc_id, pending = save_extraction(request.user_id, broker, holdings, metadata)
+            statement_archive.archive_in_background(request.user_id, broker, upload.path, pwd, file.filename,
+                                                    'upload', doc_id)
+        finally:
+            # Deletes the temp file
+            file.close()
+        
+        return extraction_response({
+            'success': True,
+            'broker': broker,
+            'count': len(holdings),
+            'holdings': holdings,
+            'cached': cached,
+            'db_id': doc_id
+        }, pending)
             
+    except upload_stream.UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status
+    except admission.ClientDisconnected as e:
+        return client_gone(e)
+    except snapshot_writer.WriteQueueFull as e:
+        return storage_busy(e)
+    except Exception as e:
+        logging.exception(f"Upload extraction failed for {broker}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route(f'/api/{API_VERSION}/extract/batch', methods=['POST'])
+@require_jwt
+@admitted
+def extract_batch():
+    """Upload many statements (file_<id> with broker_<id>, password_<id>) and extract them together"""
+    uploads = []
+    try:
+        files = {name: file.stream for name, file in request.files.items(multi=True)}
+        uploads = [file.stream for _, file in request.files.items(multi=True)]
+        batch = batch_upload.statements(files, request.form)
+        admission.check_client(request.environ)
+        batch_id = batch_upload.extract(request.user_id, batch)
+        include_holdings = request.args.get('holdings', 'false').lower() == 'true'
+        return jsonify(batch_upload.response(batch, batch_id, include_holdings))
+    
+    except upload_stream.UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status
+    except admission.ClientDisconnected as e:
+        return client_gone(e)
+    except Exception as e:
+        logging.exception("Batch extraction failed")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Deletes the temp files
+        for upload in uploads:
+            upload.close()
+
+
+# ============================================================================
+# Admin Profiling Endpoints
+# ============================================================================
+
+@app.route(f'/api/{API_VERSION}/admin/profiles', methods=['GET'])
+@require_jwt
+@require_admin
+def list_profiles():
+    """Stored request profiles, newest first, without per-page detail"""
+    profiles = [
+        {k: v for k, v in meta.items() if k not in ('pages', 'top_functions')}
+        for meta in profiling.get_profiler().store.list()
+    ]
+    return jsonify({'count': len(profiles), 'profiles': profiles})
+
+
+@app.route(f'/api/{API_VERSION}/admin/profiles/<profile_id>', methods=['GET'])
+@require_jwt
+@require_admin
+def get_profile(profile_id):
+    """Profile metadata: per-page layout stats and top functions"""
+    found = profiling.get_profiler().store.get(profile_id)
+    if not found:
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(found[0])
+
+
+@app.route(f'/api/{API_VERSION}/admin/profiles/<profile_id>/download', methods=['GET'])
+@require_jwt
+@require_admin
+def download_profile(profile_id):
+    """Raw profile: pstats file (cprofile) or folded stacks (sample)"""
+    found = profiling.get_profiler().store.get(profile_id)
+    if not found:
+        return jsonify({'error': 'Profile not found'}), 404
+    meta, path = found
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=f"{profile_id}{meta['suffix']}",
+                     mimetype='application/octet-stream')
+
+
+# ============================================================================
+# Holdings Endpoints
+# ============================================================================
+
+@app.route(f'/api/{API_VERSION}/holdings', methods=['GET'])
+@require_jwt
+def latest_holdings():
+    """Latest stored holdings per broker (no re-extraction), with ETag"""
+    try:
+        broker = request.args.get('broker')
+        if broker and broker not in SUPPORTED_BROKERS:
+            return jsonify({'error': f'Invalid broker. Supported: {SUPPORTED_BROKERS}'}), 400
+        
+        db = database.get_db()
+        refs = db.get_latest_snapshot_refs(request.user_id, broker)
+        if not refs:
+            return jsonify({'error': 'No holdings found. Extract holdings from a broker first.'}), 404
+        
+        etag = make_etag(snapshot_tag(ref['_id'], ref['reparsed_at']) for ref in refs)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        
+        snapshots = [serialize_snapshot(doc) for doc in db.get_snapshots([ref['_id'] for ref in refs])]
+        response = jsonify({
+            'count': sum(snapshot['count'] for snapshot in snapshots),
+            'snapshots': snapshots
+        })
+        return with_etag(response, etag)
+        
+    except Exception as e:
+        logging.exception("Failed to read latest holdings")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route(f'/api/{API_VERSION}/holdings/history', methods=['GET'])
+@require_jwt
+def holdings_history():
+    """Stored snapshots, newest first, paginated with an opaque cursor"""
+    try:
+        broker = request.args.get('broker')
+        if broker and broker not in SUPPORTED_BROKERS:
+            return jsonify({'error': f'Invalid broker. Supported: {SUPPORTED_BROKERS}'}), 400
+        
+        try:
+            limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+            before = decode_cursor(request.args.get('cursor'))
+        except ValueError:
+            return jsonify({'error': 'Invalid limit or cursor'}), 400
+        include_holdings = request.args.get('include_holdings', 'false').lower() == 'true'
+        
+        # One extra row tells whether another page exists
+        docs = database.get_db().get_holdings_history(
+            request.user_id, broker=broker, before=before, limit=limit + 1, include_holdings=include_holdings
+        )
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        
+        etag = make_etag([snapshot_tag(doc['_id'], (doc.get('metadata') or {}).get('reparsed_at')) for doc in docs]
+                         + [str(include_holdings), str(has_more)])
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        
+        response = jsonify({
+            'count': len(docs),
+            'snapshots': [serialize_snapshot(doc) for doc in docs],
+            'next_cursor': encode_cursor(docs[-1]) if has_more else None
+        })
+        return with_etag(response, etag)
+        
+    except Exception as e:
+        logging.exception("Failed to read holdings history")
+        return jsonify({'error': str(e)}), 500
+
+
+# ============================================================================
+# Portfolio Endpoints
+# ============================================================================
+
+@app.route(f'/api/{API_VERSION}/portfolio/consolidated', methods=['GET'])
+@require_jwt
+def consolidated_portfolio():
+    """Combined holdings across all brokers, maintained on every save"""
+    try:
+        view = database.get_db().get_consolidated_view(request.user_id)
+        if not view:
+            return jsonify({'error': 'No holdings found. Extract holdings from a broker first.'}), 404
+        
+        return jsonify(portfolio_view.render(view))
+        
+    except Exception as e:
+        logging.exception("Failed to build consolidated portfolio")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route(f'/api/{API_VERSION}/portfolio/history', methods=['GET'])
+@require_jwt
+def portfolio_history():
+    """Portfolio value over time from the position time series"""
+    try:
+        broker = request.args.get('broker')
+        isin = request.args.get('isin', '').strip().upper() or None
+        interval = request.args.get('interval', 'day')
+        
+        if broker and broker not in SUPPORTED_BROKERS:
+            return jsonify({'error': f'Invalid broker. Supported: {SUPPORTED_BROKERS}'}), 400
+        if interval not in database.HISTORY_INTERVALS:
+            return jsonify({'error': f'Invalid interval. Supported: {list(database.HISTORY_INTERVALS)}'}), 400
+        
+        try:
+            start = parse_date_arg('from')
+            end = parse_date_arg('to')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        series = database.get_db().get_value_history(
+            request.user_id, broker=broker, isin=isin, interval=interval, start=start, end=end
+        )
+        for point in series:
+            point['date'] = point['date'].isoformat()
+        
+        return jsonify({
+            'broker': broker,
+            'isin': isin,
+            'interval': interval,
+            'count': len(series),
+            'series': series
+        })
+        
+    except Exception as e:
+        logging.exception("Failed to read portfolio history")
+        return jsonify({'error': str(e)}), 500
+
+
+# ============================================================================
+# Capacity Stats Endpoints
+# ============================================================================
+
+@app.route(f'/api/{API_VERSION}/stats', methods=['GET'])
+@require_jwt
+@require_admin
+def extraction_stats():
+    """Per-broker and per-day extraction cost percentiles from the rollup collection"""
+    try:
+        broker = request.args.get('broker')
+        if broker and broker not in SUPPORTED_BROKERS:
+            return jsonify({'error': f'Invalid broker. Supported: {SUPPORTED_BROKERS}'}), 400
+        
+        try:
+            start = parse_date_arg('from')
+            end = parse_date_arg('to')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        rollups = database.get_db().get_extraction_stats(
+            broker,
+            cost_stats.day_of(start) if start else None,
+            cost_stats.day_of(end) if end else None
+        )
+        
+        by_broker = {}
+        for rollup in rollups:
+            by_broker.setdefault(rollup['broker'], []).append(rollup)
+        
+        return jsonify({
+            'from': request.args.get('from'),
+            'to': request.args.get('to'),
+            'brokers': {name: cost_stats.summarize(docs) for name, docs in by_broker.items()},
+            'days': [
+                {'broker': rollup['broker'], 'day': rollup['day'], **cost_stats.summarize([rollup])}
+                for rollup in rollups
+            ]
+        })
+        
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logging.exception("Failed to read extraction stats")
         return jsonify({'error': str(e)}), 500
 
 
@@ -474,20 +916,114 @@ def extract_from_upload(broker):
 
 def extract_broker_holdings(broker, file_path, password=None):
     """Import and run the appropriate broker extractor"""
-    if broker == 'groww':
-        from brokers.groww.extractor import extract_holdings
-    elif broker == 'zerodha':
-        from brokers.zerodha.extractor import extract_holdings
-    elif broker == 'angleone':
-        from brokers.angleone.extractor import extract_holdings
-    elif broker == 'dhan':
-        from brokers.dhan.extractor import extract_holdings
-    elif broker == 'mstock':
-        from brokers.mstock.extractor import extract_holdings
+    return brokers.extract_holdings(broker, file_path, password)
+
+
+def save_extraction(user_id, broker, holdings, metadata):
+    """
+    pipeline.save_and_publish for an endpoint
+
+    Returns:
+        (doc_id, pending): pending when the write-behind ack timed out and
+        the snapshot is still queued under doc_id
+    """
+    try:
+        return pipeline.save_and_publish(user_id, broker, holdings, metadata), False
+    except snapshot_writer.WriteAckTimeout as e:
+        logging.warning(f"{e}, still queued")
+        return e.doc_id, True
+
+
+def extraction_response(body, pending=False):
+    """200 with the stored snapshot, or 202 when it is still queued (don't retry; it will be written)"""
+    if not pending:
+        return jsonify(body)
+    return jsonify({**body, 'pending': True}), 202
+
+
+def storage_busy(error):
+    """503 when the write-behind queue is full; the client should retry"""
+    response = jsonify({'error': str(error)})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+
+def too_many_requests(error):
+    """429 when admission control turns a request away; Retry-After says when to come back"""
+    response = jsonify({'error': str(error), 'reason': error.reason})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
+
+def client_gone(error):
+    """499 (client closed request) for an abandoned extraction; nobody reads it, but logs do"""
+    return jsonify({'error': str(error)}), 499
+
+
+def serialize_snapshot(doc):
+    """JSON-safe form of a stored snapshot document"""
+    snapshot = {
+        'id': str(doc['_id']),
+        'broker': doc['broker'],
+        'extracted_at': doc['extracted_at'].isoformat(),
+        'snapshot_version': doc.get('snapshot_version'),
+        'metadata': doc.get('metadata', {})
+    }
+    if 'holdings' in doc:
+        snapshot['holdings'] = doc['holdings']
+        snapshot['count'] = len(doc['holdings'])
     else:
-        raise ValueError(f"Unsupported broker: {broker}")
-    
-    return extract_holdings(file_path, password)
+        snapshot['count'] = doc.get('holdings_count')
+    return snapshot
+
+
+def snapshot_tag(snapshot_id, reparsed_at):
+    """ETag part for a stored snapshot: its id, and when a reparse last corrected it in place"""
+    return f"{snapshot_id}@{reparsed_at.isoformat()}" if reparsed_at else str(snapshot_id)
+
+
+def make_etag(parts):
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    # Clients may cache but must revalidate, which is a cheap 304
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(etag):
+    response = make_response('', 304)
+    return with_etag(response, etag)
+
+
+def encode_cursor(doc):
+    """Opaque pagination cursor for the position after `doc`"""
+    raw = json.dumps([doc['extracted_at'].isoformat(), str(doc['_id'])])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on a malformed cursor"""
+    if not cursor:
+        return None
+    try:
+        extracted_at, snapshot_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(extracted_at), ObjectId(snapshot_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def parse_date_arg(name):
+    """Parse an optional YYYY-MM-DD query parameter"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"Invalid '{name}' date, expected YYYY-MM-DD")
 
 
 def cleanup_temp_files(file_path, temp_dir=None):
@@ -513,6 +1049,21 @@ def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
 
+def start_background_services():
+    """Connect to dependencies in the background; never blocks startup"""
+    database.get_db().start_background_connect()
+    kafka_producer.get_producer()
+    # Load the ISIN master now rather than on the first extraction
+    isin_master.get_master()
+    
+    # Deliver outbox events from this process unless a standalone relay runs
+    if OUTBOX_ENABLED and os.environ.get('OUTBOX_RELAY_IN_PROCESS', 'true').lower() == 'true':
+        outbox_relay.get_relay().start()
+
+
+start_background_services()
+
+
 # ============================================================================
 # Main
 # ============================================================================
@@ -0,0 +1,487 @@
+"""
+ASGI serving mode for the extraction API
+
+    uvicorn app_asgi:app --host 0.0.0.0 --port 8080
+
+Serves the same /api/v1 routes as app_api.py. The extraction endpoints
+(Gmail, upload and batch upload) run natively async: Gmail over httpx,
+MongoDB through motor (async_database.py), Kafka through aiokafka when the
+outbox is disabled, and statement parsing -- the only CPU-bound step -- in
+the parse pool of PARSE_WORKERS processes (parse_pool.py). An extraction
+waiting on Gmail, MongoDB or Kafka holds no thread, so one process keeps
+hundreds of them in flight; parsing throughput is bounded by the pool.
+
+All other routes (health, metrics, OAuth, reads, admin) are the Flask app
+itself, mounted as WSGI and run in a thread pool; they are short and keep
+a single implementation. Per-request profiling (X-Profile) is only
+available in the Flask mode, since parsing here runs in other processes.
+"""
+import os
+import uuid
+import asyncio
+import logging
+from collections import Counter
+from contextlib import asynccontextmanager
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from aiokafka import AIOKafkaProducer
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route, Mount
+
+import admission
+import app_api
+import async_database
+import async_gmail
+import batch_upload
+import brokers
+import compression
+import event_codec
+import fast_json
+import kafka_producer
+import metrics
+import parse_pool
+import pipeline
+import result_cache
+import statement_archive
+import tracing
+import upload_stream
+
+API_VERSION = app_api.API_VERSION
+SUPPORTED_BROKERS = app_api.SUPPORTED_BROKERS
+MAX_UPLOAD_BYTES = app_api.app.config['MAX_CONTENT_LENGTH']
+ALLOWED_ORIGINS = {origin.strip() for origin in app_api.allowed_origins}
+
+GMAIL_TIMEOUT = float(os.environ.get('GMAIL_HTTP_TIMEOUT', 30))
+WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 32))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    parse_pool.get_pool()
+    app.state.http = httpx.AsyncClient(timeout=GMAIL_TIMEOUT)
+    app.state.kafka = await start_kafka()
+    try:
+        yield
+    finally:
+        if app.state.kafka is not None:
+            await app.state.kafka.stop()
+        await app.state.http.aclose()
+        parse_pool.shutdown()
+        async_database.get_async_db().close()
+
+
+async def start_kafka():
+    """aiokafka producer for direct publishing; None when events go through the outbox"""
+    outbox_enabled, _, _ = pipeline.event_settings()
+    if outbox_enabled:
+        return None
+    settings = kafka_producer.get_producer()
+    producer = AIOKafkaProducer(
+        bootstrap_servers=settings.bootstrap_servers,
+        value_serializer=lambda v: event_codec.encode(v, settings.encoding),
+        key_serializer=lambda k: k.encode('utf-8') if k else None,
+        compression_type=settings.compression_type,
+        linger_ms=settings.linger_ms,
+        max_batch_size=settings.batch_size
+    )
+    try:
+        await producer.start()
+    except Exception as e:
+        # Fall back to the buffered sync producer, which reconnects in the background
+        logging.warning(f"aiokafka producer not started, using the sync producer: {e}")
+        return None
+    return producer
+
+
+async def publish(record):
+    producer = app.state.kafka
+    if producer is None:
+        # Unbuffered (KAFKA_ASYNC_PUBLISH=false) this blocks on the broker's ack
+        await asyncio.to_thread(kafka_producer.get_producer().publish_record, record)
+        return
+    broker = (record['value'].get('brokerType') or '').lower() or None
+    with tracing.span('kafka.send', broker=broker), metrics.stage('kafka_send', broker):
+        await producer.send_and_wait(kafka_producer.get_producer().topic, key=record['key'],
+                                     value=record['value'], headers=record['headers'])
+
+
+async def save_and_publish(user_id, broker, holdings, metadata):
+    """Async pipeline.save_and_publish"""
+    outbox_enabled, event_mode, full_every = pipeline.event_settings()
+    pipeline.prepare_holdings(holdings)
+
+    adb = async_database.get_async_db()
+    snapshot_version = None
+    previous = None
+    if event_mode == 'delta':
+        previous = await adb.get_latest_holdings(user_id, broker, projection={'holdings': 1, 'snapshot_version': 1})
+        snapshot_version = await adb.allocate_snapshot_versions(user_id, broker, 1,
+                                                                (previous or {}).get('snapshot_version'))
+
+    event_factory = pipeline.make_event_factory(
+        kafka_producer.get_producer(), user_id, broker, holdings, previous, snapshot_version, full_every
+    )
+
+    if outbox_enabled:
+        return await adb.save_holdings(user_id, broker, holdings, metadata, event_factory=event_factory,
+                                       snapshot_version=snapshot_version)
+
+    # Publish only once the snapshot is stored, so consumers can read it
+    doc_id = await adb.save_holdings(user_id, broker, holdings, metadata, snapshot_version=snapshot_version)
+    record = event_factory(doc_id)
+    if record is not None:
+        await publish(record)
+    return doc_id
+
+
+async def save_and_publish_batch(user_id, extractions):
+    """Async pipeline.save_and_publish_batch"""
+    outbox_enabled, event_mode, _ = pipeline.event_settings()
+    adb = async_database.get_async_db()
+
+    latest = {}
+    versions = {}
+    if event_mode == 'delta':
+        for broker, count in Counter(broker for broker, _, _ in extractions).items():
+            latest[broker] = await adb.get_latest_holdings(user_id, broker,
+                                                           projection={'holdings': 1, 'snapshot_version': 1})
+            versions[broker] = await adb.allocate_snapshot_versions(user_id, broker, count,
+                                                                    (latest[broker] or {}).get('snapshot_version'))
+
+    items, event_factories = pipeline.build_batch(adb.config, user_id, extractions, latest, versions)
+    await adb.write_batch(items)
+    doc_ids = [str(document['_id']) for document, _ in items]
+
+    if not outbox_enabled:
+        records = [event_factory(doc_id) for doc_id, event_factory in zip(doc_ids, event_factories)]
+        # Sent together, so the producer batches them
+        await asyncio.gather(*(publish(record) for record in records if record is not None))
+    return doc_ids
+
+
+async def parse(broker, file_path, password):
+    """Run the broker's extractor in the process pool, folding its costs into this request's"""
+    loop = asyncio.get_running_loop()
+    with tracing.span('extractor.extract_holdings', broker=broker), metrics.stage('parse_pool', broker):
+        holdings, costs = await loop.run_in_executor(
+            parse_pool.get_pool(), brokers.extract_with_costs, broker, file_path, password
+        )
+    metrics.add_costs(costs)
+    return holdings
+
+
+def add_cors_headers(request, response):
+    """CORS headers as flask-cors sets them; preflight requests fall through to the Flask app"""
+    origin = request.headers.get('origin')
+    if origin and origin in ALLOWED_ORIGINS:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Access-Control-Allow-Credentials'] = 'true'
+        response.headers['Access-Control-Expose-Headers'] = 'Content-Type, ETag, X-Request-ID, Retry-After'
+        response.headers['Vary'] = 'Origin'
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return fast_json.dumps(content)
+
+
+def compress_response(request, response):
+    """Negotiated compression, as app_api.compress_response"""
+    if not compression.should_compress(response.media_type, len(response.body), response.status_code,
+                                       response.headers.get('content-encoding')):
+        return
+    response.headers.append('Vary', 'Accept-Encoding')
+    encoding = compression.choose_encoding(request.headers.get('accept-encoding'))
+    if encoding is None:
+        return
+    response.body = compression.compress(response.body, encoding)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Content-Length'] = str(len(response.body))
+
+
+def error(message, status):
+    return FastJSONResponse({'error': message}, status_code=status)
+
+
+async def check_client(request):
+    """Raise ClientDisconnected before an expensive stage if the client is gone"""
+    if await request.is_disconnected():
+        metrics.add_rejection('client_gone')
+        raise admission.ClientDisconnected('Client disconnected')
+
+
+async def admitted(request, handler, user_id, jwt_payload, broker):
+    """Run a handler under admission control (app_api.admitted)"""
+    controller = admission.get_admission()
+    try:
+        ticket = await controller.acquire_async(user_id, admission.request_priority(request.headers, jwt_payload))
+    except admission.Overloaded as e:
+        response = FastJSONResponse({'error': str(e), 'reason': e.reason}, status_code=429)
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    try:
+        # is_disconnected() takes a message off `receive`, which for an upload
+        # is its first body chunk; upload handlers check once the body is read
+        if request.method == 'GET':
+            await check_client(request)
+        return await handler(request, user_id, broker)
+    except admission.ClientDisconnected as e:
+        logging.info("Client disconnected, abandoning request")
+        return error(str(e), 499)
+    finally:
+        controller.release(ticket)
+
+
+def extraction_endpoint(handler):
+    """Authentication, broker validation, metrics and tracing context around an extraction handler"""
+    async def endpoint(request):
+        broker = request.path_params.get('broker')
+        metrics.bind_broker(app_api.broker_label(broker))
+        metrics.start_costs()
+        root = tracing.begin_request(f"{request.method} {request.url.path}", request.headers.get('X-Request-ID'),
+                                     broker=broker)
+        failure = None
+        try:
+            try:
+                user_id, jwt_payload = app_api.authenticate(request.headers.get('Authorization'))
+            except app_api.AuthError as e:
+                response = error(str(e), e.status)
+            else:
+                if broker is not None and broker not in SUPPORTED_BROKERS:
+                    response = error(f'Invalid broker. Supported: {SUPPORTED_BROKERS}', 400)
+                else:
+                    response = await admitted(request, handler, user_id, jwt_payload, broker)
+        except Exception as e:
+            failure = e
+            logging.exception(f"Extraction failed for {broker}")
+            response = error(str(e), 500)
+        response.headers['X-Request-ID'] = tracing.request_id()
+        add_cors_headers(request, response)
+        compress_response(request, response)
+        tracing.end_request(root, failure, status_code=response.status_code)
+        return response
+    return endpoint
+
+
+async def extract_from_gmail(request, user_id, broker):
+    """Fetch statement from Gmail and extract holdings"""
+    pan_number = request.query_params.get('pan', '').strip().upper()
+    if not pan_number and broker != 'angleone':
+        return error('PAN number is required', 400)
+
+    http = request.app.state.http
+    try:
+        with tracing.span('gmail.service'):
+            access_token = await async_gmail.get_access_token(http, user_id)
+    except async_gmail.GmailNotConnected:
+        return error('Gmail not connected. Please connect Gmail first.', 401)
+
+    with tracing.span('gmail.latest_statement', broker=broker):
+        result = await async_gmail.get_latest_statement(http, access_token, broker)
+    if not result:
+        return error(f'No recent emails found from {broker.upper()}', 404)
+
+    attachment_path = result['attachment']['path']
+    # Excel files typically don't have password
+    password = None if broker == 'angleone' else pan_number
+    try:
+        await check_client(request)
+        holdings = await parse(broker, attachment_path, password)
+        metadata = {
+            'email_subject': result['email']['subject'],
+            'email_date': result['email']['date'],
+            'filename': result['attachment']['filename'],
+            'source': 'gmail',
+            **metrics.costs()
+        }
+        doc_id = await save_and_publish(user_id, broker, holdings, metadata)
+        await asyncio.to_thread(
+            statement_archive.archive_in_background,
+            user_id, broker, attachment_path, password, result['attachment']['filename'], 'gmail', doc_id
+        )
+    finally:
+        await asyncio.to_thread(app_api.cleanup_temp_files, attachment_path, result.get('temp_dir'))
+
+    return FastJSONResponse({
+        'success': True,
+        'broker': broker,
+        'count': len(holdings),
+        'holdings': holdings,
+        'metadata': metadata,
+        'db_id': doc_id
+    })
+
+
+async def extract_from_upload(request, user_id, broker):
+    """Upload file and extract holdings"""
+    if int(request.headers.get('content-length') or 0) > MAX_UPLOAD_BYTES:
+        return error('File too large', 413)
+
+    # Stream the body into an UploadSink: hashed, type-checked and size-bounded
+    # as it arrives, so a bad upload is rejected without reading the rest
+    try:
+        fields, files = await upload_stream.parse_multipart(
+            request.stream(), request.headers.get('content-type', ''),
+            lambda filename: upload_stream.UploadSink(filename, MAX_UPLOAD_BYTES),
+            max_bytes=MAX_UPLOAD_BYTES
+        )
+    except upload_stream.UploadRejected as e:
+        return error(str(e), e.status)
+
+    try:
+        upload = files.get('file')
+        if upload is None:
+            return error('No file provided', 400)
+        try:
+            upload.finish()
+        except upload_stream.UploadRejected as e:
+            return error(str(e), e.status)
+        metrics.add_bytes(upload.size, 'upload')
+        password = (fields.get('password') or '').strip() or None
+
+        cache = result_cache.get_cache()
+        holdings = None
+        if cache.enabled:
+            adb = async_database.get_async_db()
+            try:
+                with metrics.stage('cache_lookup', broker):
+                    entry = await adb.get_cached_result(cache.key(upload.sha256, broker))
+                holdings = cache.holdings_from(entry, upload.sha256, broker, password)
+            except Exception as e:
+                logging.warning(f"Result cache lookup failed: {e}")
+        cached = holdings is not None
+        if not cached:
+            await check_client(request)
+            holdings = await parse(broker, upload.path, password)
+            if cache.enabled:
+                try:
+                    await adb.put_cached_result(cache.entry(upload.sha256, broker, password, holdings))
+                except Exception as e:
+                    logging.warning(f"Result cache store failed: {e}")
+
+        metadata = {
+            'source': 'upload',
+            'filename': upload.filename,
+            'statement_sha256': upload.sha256,
+            **({'cached': True} if cached else {}),
+            **metrics.costs()
+        }
+        doc_id = await save_and_publish(user_id, broker, holdings, metadata)
+        await asyncio.to_thread(
+            statement_archive.archive_in_background,
+            user_id, broker, upload.path, password, upload.filename, 'upload', doc_id
+        )
+    finally:
+        # Closing a sink deletes its temp file
+        for sink in files.values():
+            sink.close()
+
+    return FastJSONResponse({
+        'success': True,
+        'broker': broker,
+        'count': len(holdings),
+        'holdings': holdings,
+        'cached': cached,
+        'db_id': doc_id
+    })
+
+
+async def extract_batch(request, user_id, _broker):
+    """Upload many statements and extract them together (see batch_upload.py)"""
+    if int(request.headers.get('content-length') or 0) > batch_upload.MAX_BYTES:
+        return error('Batch too large', 413)
+
+    # Lenient sinks: a bad file is reported in its own result. The batch
+    # limits are enforced while streaming, so a chunked body stays bounded
+    try:
+        fields, files = await upload_stream.parse_multipart(
+            request.stream(), request.headers.get('content-type', ''),
+            lambda filename: upload_stream.UploadSink(filename, MAX_UPLOAD_BYTES, strict=False),
+            max_bytes=batch_upload.MAX_BYTES, max_files=batch_upload.MAX_FILES
+        )
+    except upload_stream.UploadRejected as e:
+        return error(str(e), e.status)
+
+    try:
+        try:
+            batch = batch_upload.statements(files, fields)
+        except upload_stream.UploadRejected as e:
+            return error(str(e), e.status)
+        await check_client(request)
+        batch_id = await extract_statements(user_id, batch)
+    finally:
+        for sink in files.values():
+            sink.close()
+
+    include_holdings = request.query_params.get('holdings', 'false').lower() == 'true'
+    return FastJSONResponse(batch_upload.response(batch, batch_id, include_holdings))
+
+
+async def extract_statements(user_id, batch):
+    """Async batch_upload.extract"""
+    batch_id = str(uuid.uuid4())
+    cache = result_cache.get_cache()
+    adb = async_database.get_async_db()
+
+    pending = batch_upload.pending(batch)
+    if cache.enabled and pending:
+        try:
+            with metrics.stage('cache_lookup'):
+                entries = await adb.get_cached_results({cache.key(s.upload.sha256, s.broker) for s in pending})
+            for statement in pending:
+                sha256 = statement.upload.sha256
+                holdings = cache.holdings_from(entries.get(cache.key(sha256, statement.broker)), sha256,
+                                               statement.broker, statement.password)
+                if holdings is not None:
+                    statement.holdings = holdings
+                    statement.cached = True
+        except Exception as e:
+            logging.warning(f"Result cache lookup failed: {e}")
+
+    misses = [statement for statement in pending if not statement.cached]
+    if misses:
+        loop = asyncio.get_running_loop()
+        pool = parse_pool.get_pool()
+        with tracing.span('parse_pool.batch', statements=len(misses)):
+            outcomes = await asyncio.gather(*(
+                loop.run_in_executor(pool, brokers.extract_with_costs, s.broker, s.upload.path, s.password)
+                for s in misses
+            ), return_exceptions=True)
+        for statement, outcome in zip(misses, outcomes):
+            batch_upload.parsed(statement, outcome)
+        if cache.enabled:
+            try:
+                await adb.put_cached_results([cache.entry(s.upload.sha256, s.broker, s.password, s.holdings)
+                                              for s in misses if s.error is None])
+            except Exception as e:
+                logging.warning(f"Result cache store failed: {e}")
+
+    extracted = batch_upload.pending(batch)
+    if extracted:
+        doc_ids = await save_and_publish_batch(user_id, batch_upload.snapshots(extracted, batch_id))
+        for statement, doc_id in zip(extracted, doc_ids):
+            statement.doc_id = doc_id
+        await asyncio.to_thread(batch_upload.archive, user_id, batch)
+    return batch_id
+
+
+app = Starlette(
+    routes=[
+        Route(f'/api/{API_VERSION}/extract/gmail/{{broker}}', extraction_endpoint(extract_from_gmail), methods=['GET']),
+        Route(f'/api/{API_VERSION}/extract/upload/{{broker}}', extraction_endpoint(extract_from_upload),
+              methods=['POST']),
+        Route(f'/api/{API_VERSION}/extract/batch', extraction_endpoint(extract_batch), methods=['POST']),
+        # Everything else is served by the Flask app
+        Mount('/', app=WSGIMiddleware(app_api.app, workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    os.makedirs('user_tokens', exist_ok=True)
+    os.makedirs('logs', exist_ok=True)
+    uvicorn.run(app, host='0.0.0.0', port=app_api.PORT, log_config=None)
@@ -0,0 +1,185 @@
+"""
+Async MongoDB access for the ASGI app (app_asgi.py), using motor
+
+Mirrors the extraction write path of database.Database -- snapshot,
+normalised positions, consolidated view and outbox row in one transaction,
+then position history and the cost rollup -- sharing its document and
+update builders, so both serving modes store identical data. Settings
+(layout, transactions, history, pool sizes) come from the same environment
+variables. Reads other than the delta-mode latest snapshot stay on the
+sync Database used by the mounted Flask routes.
+"""
+import time
+import logging
+import threading
+from pymongo import UpdateOne, ReplaceOne, ReturnDocument
+from pymongo.errors import OperationFailure, DuplicateKeyError
+from motor.motor_asyncio import AsyncIOMotorClient
+import cost_stats
+import database
+import metrics
+import portfolio_view
+import tracing
+
+
+class AsyncDatabase:
+    def __init__(self, config=None):
+        # Share configuration (and its parsing) with the sync client
+        self.config = config or database.get_db()
+        self.client = AsyncIOMotorClient(
+            self.config.mongo_uri,
+            serverSelectionTimeoutMS=self.config.server_selection_timeout_ms,
+            connectTimeoutMS=self.config.connect_timeout_ms,
+            **self.config.pool_options
+        )
+        self.db = self.client[self.config.db_name]
+        self.use_transactions = self.config.use_transactions
+
+    def close(self):
+        self.client.close()
+
+    async def get_latest_holdings(self, user_id, broker, projection=None):
+        """Latest snapshot for a user and broker (see Database.get_latest_holdings)"""
+        normalised = self.config.holdings_layout == 'normalised'
+        collection = self.db[database.SNAPSHOTS_COLLECTION if normalised else 'portfolio_holdings']
+        latest = await collection.find_one({'user_id': user_id, 'broker': broker}, projection,
+                                           sort=[('extracted_at', -1)])
+        if normalised and latest and (projection is None or 'holdings' in projection):
+            positions = self.db[database.POSITIONS_COLLECTION].find({'user_id': user_id, 'broker': broker})
+            latest['holdings'] = [database._position_to_holding(p) async for p in positions]
+        return latest
+
+    async def allocate_snapshot_versions(self, user_id, broker, count=1, floor=0):
+        """Async Database.allocate_snapshot_versions"""
+        counter = await self.db[database.VERSIONS_COLLECTION].find_one_and_update(
+            database.version_key(user_id, broker), database.version_update(count, floor),
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return counter['version'] - count + 1
+
+    async def get_cached_result(self, key):
+        return await self.db[database.RESULTS_COLLECTION].find_one({'_id': key})
+
+    async def put_cached_result(self, entry):
+        await self.db[database.RESULTS_COLLECTION].replace_one({'_id': entry['_id']}, entry, upsert=True)
+
+    async def get_cached_results(self, keys):
+        cursor = self.db[database.RESULTS_COLLECTION].find({'_id': {'$in': list(keys)}})
+        return {entry['_id']: entry async for entry in cursor}
+
+    async def put_cached_results(self, entries):
+        if entries:
+            operations = [ReplaceOne({'_id': entry['_id']}, entry, upsert=True) for entry in entries]
+            await self.db[database.RESULTS_COLLECTION].bulk_write(operations, ordered=False)
+
+    async def save_holdings(self, user_id, broker, holdings, metadata=None, event_factory=None,
+                            snapshot_version=None):
+        """Async Database.save_holdings (no write-behind: the event loop already overlaps requests)"""
+        item = self.config.build_snapshot(user_id, broker, holdings, metadata, event_factory, snapshot_version)
+        await self.write_batch([item])
+        return str(item[0]['_id'])
+
+    async def write_batch(self, items):
+        """Async Database.write_batch"""
+        broker_names = {document['broker'] for document, _ in items}
+        broker = broker_names.pop() if len(broker_names) == 1 else 'mixed'
+        t0 = time.perf_counter()
+        with tracing.span('mongo.write_batch', broker=broker, snapshots=len(items)), \
+                metrics.stage('mongo_write', broker):
+            await self._run_writes(items)
+        db_ms = round((time.perf_counter() - t0) * 1000, 1)
+
+        documents = [document for document, _ in items]
+        if self.config.history_enabled:
+            try:
+                rows = database.history_rows(documents)
+                if rows:
+                    await self.db[database.HISTORY_COLLECTION].insert_many(rows, ordered=False)
+            except Exception as e:
+                logging.error(f"Failed to write position history for {len(items)} snapshots: {e}")
+
+        costed = [document for document in documents if 'parse_ms' in document['metadata']]
+        if costed:
+            try:
+                await self._record_costs(costed, db_ms)
+            except Exception as e:
+                logging.error(f"Failed to record extraction costs for {len(costed)} snapshots: {e}")
+
+    async def _run_writes(self, items):
+        if self.use_transactions:
+            try:
+                async with await self.client.start_session() as session:
+                    # Retries TransientTransactionError (e.g. a WriteConflict on a
+                    # shared portfolio_views document) and unknown commit results
+                    await session.with_transaction(lambda s: self._write_snapshots(items, s))
+                return
+            except OperationFailure as e:
+                # Standalone servers reject transactions (IllegalOperation)
+                if e.code != 20:
+                    raise
+                logging.warning(f"MongoDB transactions unavailable, writing without transaction: {e}")
+                self.use_transactions = False
+
+        await self._write_snapshots(items, None)
+
+    async def _write_snapshots(self, items, session):
+        db = self.db
+        layout = self.config.holdings_layout
+        documents = [document for document, _ in items]
+        outbox_rows = [row for _, row in items if row is not None]
+        if layout in ('embedded', 'both'):
+            await db['portfolio_holdings'].insert_many(documents, session=session)
+        # Positions and views build on the previous snapshot, so apply in order
+        for document in documents:
+            if layout in ('normalised', 'both'):
+                key = {'user_id': document['user_id'], 'broker': document['broker']}
+                previous = [database._position_to_holding(p)
+                            async for p in db[database.POSITIONS_COLLECTION].find(key, session=session)]
+                operations, header = database.position_writes(document, previous)
+                if operations:
+                    await db[database.POSITIONS_COLLECTION].bulk_write(operations, ordered=False, session=session)
+                await db[database.SNAPSHOTS_COLLECTION].insert_one(header, session=session)
+            if self.config.consolidated_view:
+                await self._apply_view(document, session)
+        if outbox_rows:
+            await db[database.OUTBOX_COLLECTION].insert_many(outbox_rows, session=session)
+
+    async def _apply_view(self, document, session):
+        """Async portfolio_view.apply_snapshot"""
+        views = self.db[portfolio_view.VIEWS_COLLECTION]
+        for _ in range(portfolio_view.MAX_ATTEMPTS):
+            existing = await views.find_one({'_id': document['user_id']},
+                                            portfolio_view.contribution_projection(document), session=session)
+            try:
+                result = await views.update_one(portfolio_view.contribution_filter(document, existing),
+                                                portfolio_view.snapshot_update(document, existing),
+                                                upsert=existing is None, session=session)
+            except DuplicateKeyError:
+                if session is not None:
+                    raise
+                continue
+            if portfolio_view.applied(existing, result):
+                return
+        raise portfolio_view.conflict(document)
+
+    async def _record_costs(self, documents, db_ms):
+        for document in documents:
+            document['metadata']['db_ms'] = db_ms
+        ids = [document['_id'] for document in documents]
+        for name in self.config.snapshot_collection_names():
+            await self.db[name].update_many({'_id': {'$in': ids}}, {'$set': {'metadata.db_ms': db_ms}})
+        operations = [UpdateOne(query, update, upsert=True) for query, update in cost_stats.rollup_updates(documents)]
+        await self.db[database.STATS_COLLECTION].bulk_write(operations, ordered=False)
+
+
+# Global instance, created on first use (inside the running event loop)
+async_db_instance = None
+_instance_lock = threading.Lock()
+
+def get_async_db():
+    global async_db_instance
+    if async_db_instance is None:
+        with _instance_lock:
+            if async_db_instance is None:
+                async_db_instance = AsyncDatabase()
+    return async_db_instance
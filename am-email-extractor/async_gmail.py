@@ -0,0 +1,155 @@
+"""
+Async Gmail access for the ASGI app (app_asgi.py), using httpx
+
+Calls the Gmail REST API directly with the stored OAuth token instead of
+googleapiclient, whose requests block a thread each. Token files, search
+queries and attachment selection are shared with gmail_integration, so
+both serving modes find the same statement.
+"""
+import os
+import base64
+import pickle
+import asyncio
+import logging
+import tempfile
+from datetime import datetime, timedelta
+import gmail_integration
+import metrics
+import tracing
+
+GMAIL_API = 'https://gmail.googleapis.com/gmail/v1/users/me'
+USERINFO_URL = 'https://www.googleapis.com/oauth2/v2/userinfo'
+TOKEN_URL = 'https://oauth2.googleapis.com/token'
+
+
+class GmailNotConnected(Exception):
+    pass
+
+
+def _token_file(user_id):
+    if user_id:
+        return os.path.join('user_tokens', f'token_{user_id}.pickle')
+    return 'token.pickle'
+
+
+def _load(token_file):
+    with open(token_file, 'rb') as token:
+        return pickle.load(token)
+
+
+def _save(token_file, creds):
+    with open(token_file, 'wb') as token:
+        pickle.dump(creds, token)
+
+
+async def get_access_token(client, user_id):
+    """
+    A valid access token for the user's stored Gmail credentials, refreshing
+    (and saving) it when expired
+
+    Raises:
+        GmailNotConnected when the user hasn't completed the OAuth flow
+    """
+    token_file = _token_file(user_id)
+    if not os.path.exists(token_file):
+        raise GmailNotConnected()
+    with tracing.span('gmail.credential_load'), metrics.stage('credential_load'):
+        creds = await asyncio.to_thread(_load, token_file)
+    if creds.valid:
+        return creds.token
+    if not (creds.expired and creds.refresh_token):
+        raise GmailNotConnected()
+
+    with tracing.span('gmail.credential_refresh'), metrics.stage('credential_refresh'):
+        response = await client.post(creds.token_uri or TOKEN_URL, data={
+            'grant_type': 'refresh_token',
+            'refresh_token': creds.refresh_token,
+            'client_id': creds.client_id,
+            'client_secret': creds.client_secret
+        })
+        response.raise_for_status()
+        refreshed = response.json()
+    # google-auth keeps expiry as naive UTC
+    creds.token = refreshed['access_token']
+    creds.expiry = datetime.utcnow() + timedelta(seconds=refreshed.get('expires_in', 3600))
+    await asyncio.to_thread(_save, token_file, creds)
+    return creds.token
+
+
+async def get_user_info(client, access_token):
+    """Get user information from Google"""
+    try:
+        response = await client.get(USERINFO_URL, headers={'Authorization': f'Bearer {access_token}'})
+        return response.json() if response.status_code == 200 else None
+    except Exception as e:
+        logging.error(f"Error fetching user info: {e}")
+        return None
+
+
+async def _get(client, access_token, path, **params):
+    response = await client.get(f'{GMAIL_API}/{path}', params=params,
+                                headers={'Authorization': f'Bearer {access_token}'})
+    response.raise_for_status()
+    return response.json()
+
+
+async def search_emails(client, access_token, broker, days_back=180):
+    """Latest messages from a broker, retrying without the subject filter"""
+    query = gmail_integration.build_search_query(broker, days_back)
+    if not query:
+        return []
+    logging.debug("Gmail search for %s: %s", broker.upper(), query)
+
+    with tracing.span('gmail.search', broker=broker), metrics.stage('gmail_search'):
+        messages = (await _get(client, access_token, 'messages', q=query, maxResults=10)).get('messages', [])
+
+    if not messages and gmail_integration.BROKER_PATTERNS[broker.lower()]['subject']:
+        query = gmail_integration.build_search_query(broker, days_back, with_subject=False)
+        logging.debug("No results with subject filter, retrying: %s", query)
+        with tracing.span('gmail.search', broker=broker), metrics.stage('gmail_search'):
+            messages = (await _get(client, access_token, 'messages', q=query, maxResults=10)).get('messages', [])
+    return messages
+
+
+async def get_latest_statement(client, access_token, broker):
+    """
+    Download the latest statement attachment for a broker
+
+    Returns:
+        The same dict as gmail_integration.get_latest_statement, or None
+    """
+    messages = await search_emails(client, access_token, broker)
+    if not messages:
+        return None
+
+    msg_id = messages[0]['id']
+    with tracing.span('gmail.message_fetch'), metrics.stage('message_fetch'):
+        message = await _get(client, access_token, f'messages/{msg_id}', format='full')
+    details = gmail_integration.message_summary(msg_id, message)
+
+    part = next(gmail_integration.statement_parts(message['payload'], broker), None)
+    if part is None:
+        return None
+
+    if 'data' in part['body']:
+        data = part['body']['data']
+    else:
+        with tracing.span('gmail.attachment_download'), metrics.stage('attachment_download'):
+            attachment = await _get(client, access_token, f"messages/{msg_id}/attachments/{part['body']['attachmentId']}")
+        data = attachment['data']
+    file_data = base64.urlsafe_b64decode(data.encode('UTF-8'))
+    metrics.add_bytes(len(file_data), 'gmail')
+
+    temp_dir = tempfile.mkdtemp()
+    filepath = os.path.join(temp_dir, os.path.basename(part['filename']))
+    await asyncio.to_thread(_write, filepath, file_data)
+    return {
+        'email': details,
+        'attachment': {'filename': part['filename'], 'path': filepath, 'size': len(file_data)},
+        'temp_dir': temp_dir
+    }
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
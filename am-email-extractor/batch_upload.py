@@ -0,0 +1,190 @@
+"""
+Batch statement uploads
+
+POST /extract/batch takes many statements in one multipart request, for
+back-office imports: a file part `file_<id>` per statement, its broker in
+a `broker_<id>` field (or one `broker` field for every file) and an
+optional `password_<id>`. For the whole batch there is one JWT check, one
+admission slot, one result cache query, one bulk write and one batch of
+events:
+
+  1. every file streams into a lenient UploadSink; a bad file is reported
+     in its own result instead of failing the request
+  2. cache hits are looked up with one query (result_cache.lookup_many)
+  3. the misses are parsed concurrently in the parse pool (parse_pool.py),
+     so a batch's parsing scales with PARSE_WORKERS
+  4. the snapshots are stored and announced by
+     pipeline.save_and_publish_batch
+
+Used by the Flask app; the ASGI app runs the same steps asynchronously.
+"""
+import os
+import uuid
+import logging
+from concurrent.futures import as_completed
+import brokers
+import metrics
+import parse_pool
+import pipeline
+import result_cache
+import statement_archive
+import tracing
+import upload_stream
+
+MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 50))
+MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', 128 * 1024 * 1024))
+
+FILE_PREFIX = 'file_'
+
+
+class Statement:
+    """One statement of a batch: its upload and how its extraction went"""
+
+    def __init__(self, name, upload, broker, password):
+        self.name = name
+        self.upload = upload
+        self.broker = broker
+        self.password = password
+        self.holdings = None
+        self.costs = {}
+        self.cached = False
+        self.doc_id = None
+        self.error = None
+        self.status = None
+
+    def fail(self, message, status=400):
+        self.error = message
+        self.status = status
+
+    def metadata(self, batch_id):
+        return {
+            'source': 'upload',
+            'filename': self.upload.filename,
+            'statement_sha256': self.upload.sha256,
+            'batch_id': batch_id,
+            **({'cached': True} if self.cached else {}),
+            'bytes': self.upload.size,
+            **self.costs
+        }
+
+    def result(self, include_holdings=False):
+        result = {'file': self.name, 'filename': self.upload.filename, 'broker': self.broker}
+        if self.error is not None:
+            result.update(success=False, error=self.error, status=self.status)
+            return result
+        result.update(success=True, count=len(self.holdings), cached=self.cached, db_id=self.doc_id)
+        if include_holdings:
+            result['holdings'] = self.holdings
+        return result
+
+
+def statements(files, fields):
+    """
+    The statements of a batch, validated; invalid ones are already failed
+
+    Args:
+        files: {part name: UploadSink}, in upload order
+        fields: {field name: value}
+
+    Raises:
+        UploadRejected: No files, or more than BATCH_MAX_FILES
+    """
+    if not files:
+        raise upload_stream.UploadRejected('No files provided')
+    if len(files) > MAX_FILES:
+        raise upload_stream.UploadRejected(f'At most {MAX_FILES} files per batch', 413)
+
+    batch = []
+    for name, upload in files.items():
+        key = name[len(FILE_PREFIX):] if name.startswith(FILE_PREFIX) else None
+        broker = (fields.get(f'broker_{key}') or fields.get('broker') or '').strip().lower()
+        password = (fields.get(f'password_{key}') or '').strip() or None
+        statement = Statement(name, upload, broker, password)
+        batch.append(statement)
+
+        if key is None:
+            statement.fail(f'Expected a file part named {FILE_PREFIX}<id>')
+        elif broker not in brokers.SUPPORTED_BROKERS:
+            statement.fail(f'Invalid broker. Supported: {brokers.SUPPORTED_BROKERS}')
+        else:
+            try:
+                upload.finish()
+                metrics.add_bytes(upload.size, 'upload', broker)
+            except upload_stream.UploadRejected as e:
+                statement.fail(str(e), e.status)
+    return batch
+
+
+def pending(batch):
+    return [statement for statement in batch if statement.error is None]
+
+
+def extract(user_id, batch):
+    """
+    Extract, store and publish a batch's valid statements
+
+    Returns:
+        The batch ID recorded in each snapshot's metadata
+    """
+    batch_id = str(uuid.uuid4())
+    cache = result_cache.get_cache()
+    lookups = [(s.upload.sha256, s.broker, s.password) for s in pending(batch)]
+    for statement, holdings in zip(pending(batch), cache.lookup_many(lookups)):
+        if holdings is not None:
+            statement.holdings = holdings
+            statement.cached = True
+
+    misses = [statement for statement in pending(batch) if not statement.cached]
+    if misses:
+        pool = parse_pool.get_pool()
+        with tracing.span('parse_pool.batch', statements=len(misses)):
+            futures = {
+                pool.submit(brokers.extract_with_costs, s.broker, s.upload.path, s.password): s
+                for s in misses
+            }
+            for future in as_completed(futures):
+                parsed(futures[future], future.exception() or future.result())
+        cache.store_many([(s.upload.sha256, s.broker, s.password, s.holdings)
+                          for s in misses if s.error is None])
+
+    extracted = pending(batch)
+    if extracted:
+        doc_ids = pipeline.save_and_publish_batch(user_id, snapshots(extracted, batch_id))
+        for statement, doc_id in zip(extracted, doc_ids):
+            statement.doc_id = doc_id
+        archive(user_id, batch)
+    return batch_id
+
+
+def parsed(statement, outcome):
+    """Record a parse outcome on its statement: extract_with_costs' result, or the exception it raised"""
+    if isinstance(outcome, BaseException):
+        logging.warning(f"Batch extraction failed for {statement.name} ({statement.broker}): {outcome}")
+        statement.fail(str(outcome), 422)
+        return
+    statement.holdings, statement.costs = outcome
+
+
+def snapshots(extracted, batch_id):
+    """(broker, holdings, metadata) of extracted statements, for save_and_publish_batch"""
+    return [(s.broker, s.holdings, s.metadata(batch_id)) for s in extracted]
+
+
+def archive(user_id, batch):
+    """Archive the stored statements in the background (best effort, see statement_archive)"""
+    for statement in pending(batch):
+        statement_archive.archive_in_background(user_id, statement.broker, statement.upload.path,
+                                                statement.password, statement.upload.filename, 'upload',
+                                                statement.doc_id)
+
+
+def response(batch, batch_id, include_holdings=False):
+    succeeded = len(pending(batch))
+    return {
+        'success': succeeded > 0,
+        'batch_id': batch_id,
+        'count': len(batch),
+        'succeeded': succeeded,
+        'failed': len(batch) - succeeded,
+        'results': [statement.result(include_holdings) for statement in batch]
+    }
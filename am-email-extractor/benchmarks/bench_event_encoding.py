@@ -0,0 +1,108 @@
+"""
+Benchmark: bytes per event and encode throughput for each event encoding
+
+Builds synthetic portfolio update events with N holdings and reports, per
+encoding, the raw size, the size after each available compression codec
+(gzip always; lz4 / zstd when installed) and encoded events per second.
+
+    python benchmarks/bench_event_encoding.py [--holdings 10,100,500] [--iterations 2000]
+"""
+import os
+import sys
+import gzip
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import event_codec
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def make_holding(i):
+    qty = random.randint(1, 5000)
+    rate = round(random.uniform(5, 5000), 2)
+    return {
+        'isin_code': f'INE{i:06d}01{i % 10}',
+        'company_name': f'COMPANY {i} LIMITED - EQUITY SHARES',
+        'current_bal': f'{qty:.2f}',
+        'rate': f'{rate:.2f}',
+        'value': f'{qty * rate:.2f}'
+    }
+
+
+def make_event(n_holdings):
+    holdings = [make_holding(i) for i in range(n_holdings)]
+    split = int(n_holdings * 0.8)
+    return {
+        'id': '3f0c9a52-7d0e-4c1e-9f7a-1b2c3d4e5f60',
+        'userId': 'user-123456',
+        'brokerType': 'ZERODHA',
+        'portfolioId': '65f1c2d3e4f5a6b7c8d9e0f1',
+        'timestamp': '2025-10-01T10:00:00.000000',
+        'equities': holdings[:split],
+        'mutualFunds': holdings[split:]
+    }
+
+
+def compressors():
+    codecs = [('gzip', lambda b: gzip.compress(b, compresslevel=6))]
+    if lz4_frame:
+        codecs.append(('lz4', lz4_frame.compress))
+    if zstandard:
+        cctx = zstandard.ZstdCompressor(level=3)
+        codecs.append(('zstd', cctx.compress))
+    return codecs
+
+
+def bench(n_holdings, iterations):
+    event = make_event(n_holdings)
+    encodings = ['json'] + (['msgpack'] if event_codec.msgpack else [])
+
+    print(f"\n=== {n_holdings} holdings ===")
+    header = f"{'encoding':<10}{'raw bytes':>12}"
+    codecs = compressors()
+    for name, _ in codecs:
+        header += f"{name + ' bytes':>14}"
+    header += f"{'events/sec':>14}"
+    print(header)
+
+    for encoding in encodings:
+        encoded = event_codec.encode(event, encoding)
+        row = f"{encoding:<10}{len(encoded):>12}"
+        for _, compress in codecs:
+            row += f"{len(compress(encoded)):>14}"
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            event_codec.encode(event, encoding)
+        elapsed = time.perf_counter() - start
+        row += f"{iterations / elapsed:>14.0f}"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--holdings', default='10,100,500')
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    random.seed(42)
+    if not event_codec.msgpack:
+        print("msgpack not installed - only json will be measured")
+    for n in [int(x) for x in args.holdings.split(',')]:
+        bench(n, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
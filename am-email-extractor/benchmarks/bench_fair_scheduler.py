@@ -0,0 +1,156 @@
+"""
+Simulation: interactive latency while a backfill saturates the extraction pool
+
+Discrete-event simulation of the admission queue in front of WORKERS
+extraction slots. One power user queues a large backfill at t=0, scheduled
+refreshes trickle in, and interactive users arrive at random. Reports
+interactive latency (queue wait + extraction) and when the backfill
+finishes, first with first-come-first-served dispatch, then with
+fair_scheduler.FairScheduler as admission.Admission uses it.
+
+    python benchmarks/bench_fair_scheduler.py [--workers 8] [--backfill 400]
+        [--interactive-rate 0.5] [--duration 600] [--seed 1]
+"""
+import os
+import sys
+import heapq
+import random
+import argparse
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fair_scheduler
+
+# Mean extraction seconds per class: backfill is mostly multi-year PDFs
+SERVICE_SECONDS = {'interactive': 2.0, 'refresh': 3.0, 'backfill': 4.0}
+
+
+class FifoQueue:
+    """First-come-first-served baseline with the FairScheduler interface"""
+
+    def __init__(self):
+        self._queue = deque()
+
+    def push(self, item, user_id, priority):
+        self._queue.append((item, user_id, priority))
+
+    def pop(self, eligible):
+        for entry in self._queue:
+            if eligible(entry[1]):
+                self._queue.remove(entry)
+                return entry
+        return None
+
+    def has_room(self, priority):
+        return True
+
+    def started(self, priority):
+        pass
+
+    def finished(self, priority):
+        pass
+
+
+def make_jobs(args):
+    rng = random.Random(args.seed)
+    jobs = []
+
+    def job(arrival, user_id, priority):
+        service = SERVICE_SECONDS[priority] * rng.lognormvariate(0, 0.5)
+        jobs.append({'arrival': arrival, 'user': user_id, 'priority': priority, 'service': service})
+
+    for _ in range(args.backfill):
+        job(0.0, 'power-user', 'backfill')
+    for i in range(args.refresh_users):
+        job(rng.uniform(0, args.duration), f'refresh-{i}', 'refresh')
+    t = 0.0
+    while True:
+        t += rng.expovariate(args.interactive_rate)
+        if t > args.duration:
+            break
+        job(t, f'user-{rng.randrange(args.interactive_users)}', 'interactive')
+    return jobs
+
+
+def simulate(jobs, queue, workers, per_user):
+    events = [(job['arrival'], i, 'arrive', job) for i, job in enumerate(jobs)]
+    heapq.heapify(events)
+    seq = len(events)
+    active = 0
+    active_by_user = {}
+
+    def eligible(user_id):
+        return active_by_user.get(user_id, 0) < per_user
+
+    def start(now, job):
+        nonlocal active, seq
+        active += 1
+        active_by_user[job['user']] = active_by_user.get(job['user'], 0) + 1
+        queue.started(job['priority'])
+        job['start'] = now
+        seq += 1
+        heapq.heappush(events, (now + job['service'], seq, 'finish', job))
+
+    while events:
+        now, _, kind, job = heapq.heappop(events)
+        if kind == 'arrive':
+            if active < workers and queue.has_room(job['priority']) and eligible(job['user']):
+                start(now, job)
+            else:
+                queue.push(job, job['user'], job['priority'])
+            continue
+        job['end'] = now
+        active -= 1
+        active_by_user[job['user']] -= 1
+        queue.finished(job['priority'])
+        # Same dispatch loop as admission.Admission._dispatch
+        while active < workers:
+            picked = queue.pop(eligible)
+            if picked is None:
+                break
+            start(now, picked[0])
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+def report(label, jobs):
+    print(label)
+    for priority in fair_scheduler.PRIORITIES:
+        latencies = [job['end'] - job['arrival'] for job in jobs if job['priority'] == priority]
+        if not latencies:
+            continue
+        waits = [job['start'] - job['arrival'] for job in jobs if job['priority'] == priority]
+        print(f"    {priority:<12} n={len(latencies):>4}  latency p50={percentile(latencies, 50):7.1f}s  "
+              f"p95={percentile(latencies, 95):7.1f}s  max={max(latencies):7.1f}s  "
+              f"wait p95={percentile(waits, 95):7.1f}s")
+    backfill_done = max(job['end'] for job in jobs if job['priority'] == 'backfill')
+    print(f"    backfill finished at {backfill_done:.0f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--per-user', type=int, default=8,
+                        help='Per-user concurrency limit; the default lets one user saturate the pool')
+    parser.add_argument('--backfill', type=int, default=400, help='Statements queued by the power user at t=0')
+    parser.add_argument('--refresh-users', type=int, default=40)
+    parser.add_argument('--interactive-users', type=int, default=50)
+    parser.add_argument('--interactive-rate', type=float, default=0.5, help='Interactive arrivals per second')
+    parser.add_argument('--duration', type=float, default=600, help='Seconds over which requests arrive')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers, backfill of {args.backfill}, {args.interactive_rate}/s interactive "
+          f"over {args.duration:.0f}s\n")
+    for label, queue in (('FIFO', FifoQueue()), ('fair scheduler', fair_scheduler.FairScheduler(args.workers))):
+        jobs = make_jobs(args)
+        simulate(jobs, queue, args.workers, args.per_user)
+        report(label, jobs)
+
+
+if __name__ == '__main__':
+    main()
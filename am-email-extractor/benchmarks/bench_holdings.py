@@ -0,0 +1,96 @@
+"""
+Benchmark: memory and serialization cost of dict holdings vs Holding records
+
+For batches of N synthetic extractor holdings (dicts of strings), reports
+retained memory per holding as dicts and as Holding records, and the time
+to serialize the batch as JSON and as compact msgpack rows through each
+path (event_codec's per-field parsing vs pre-parsed records).
+
+    python benchmarks/bench_holdings.py [--sizes 10000,100000] [--repeat 5]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import event_codec
+import holding
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def make_dicts(n):
+    random.seed(n)
+    rows = []
+    for i in range(n):
+        qty = random.randint(1, 5000)
+        rate = round(random.uniform(5, 5000), 2)
+        rows.append({
+            'isin_code': f'INE{i:06d}01{i % 10}',
+            'company_name': f'COMPANY {i % 5000} LIMITED',
+            'current_bal': f'{qty:,.2f}',
+            'rate': f'{rate:.2f}' if i % 7 else 'N/A',
+            'value': f'{qty * rate:,.2f}' if i % 7 else 'N/A'
+        })
+    return rows
+
+
+def retained_bytes(build):
+    tracemalloc.start()
+    obj = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size
+
+
+def best_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return min(times)
+
+
+def run(n, repeat):
+    dicts, dict_bytes = retained_bytes(lambda: make_dicts(n))
+    # Built from a throwaway copy so the records own their strings too
+    records, record_bytes = retained_bytes(lambda: holding.from_dicts(make_dicts(n)))
+    parse_ms = best_ms(lambda: holding.from_dicts(dicts), repeat)
+
+    print(f"{n:>8,} holdings  memory/holding: dict={dict_bytes / n:6.0f}B  Holding={record_bytes / n:6.0f}B  "
+          f"(parse once: {parse_ms:.1f}ms)")
+
+    results = [
+        ('json   dicts', best_ms(lambda: json.dumps(dicts).encode('utf-8'), repeat)),
+        ('json   records', best_ms(lambda: holding.dumps_json(records), repeat)),
+    ]
+    if msgpack is not None:
+        results += [
+            ('msgpack dicts', best_ms(
+                lambda: msgpack.packb([event_codec._pack_holding(h) for h in dicts], use_bin_type=True), repeat)),
+            ('msgpack records', best_ms(lambda: holding.packb(records), repeat)),
+        ]
+    for label, ms in results:
+        print(f"    {label:<16} {ms:8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for n in (int(size) for size in args.sizes.split(',')):
+        run(n, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
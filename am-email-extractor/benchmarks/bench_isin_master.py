@@ -0,0 +1,96 @@
+"""
+Benchmark: ISIN master load time, memory and lookup cost
+
+Writes a synthetic master with N rows (about 60k covers all Indian listed
+instruments and mutual fund schemes), then reports IsinMaster.load() time
+and retained memory, lookup throughput for the dict index against a sorted
+array searched with bisect, and the cost of enriching one statement.
+
+    python benchmarks/bench_isin_master.py [--rows 60000,500000] [--lookups 200000]
+"""
+import os
+import sys
+import csv
+import time
+import random
+import bisect
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import isin_master
+
+
+def write_master(path, rows):
+    kinds = isin_master.INSTRUMENT_TYPES
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(isin_master.CSV_FIELDS)
+        isins = []
+        for i in range(rows):
+            isin = f'IN{"EF"[i % 2]}{i:08d}{i % 10}'
+            isins.append(isin)
+            writer.writerow([isin, kinds[i % len(kinds)], f'SYM{i // 4}', f'ISSUER {i // 4} LIMITED'])
+    return isins
+
+
+def time_lookups(lookup, keys):
+    t0 = time.perf_counter()
+    for key in keys:
+        lookup(key)
+    return (time.perf_counter() - t0) / len(keys) * 1e9
+
+
+def run(rows, lookups):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'isin_master.csv')
+        isins = write_master(path, rows)
+        size_mb = os.path.getsize(path) / 1e6
+
+        master = isin_master.IsinMaster(path)
+        t0 = time.perf_counter()
+        master.load()
+        load_s = time.perf_counter() - t0
+
+        # Separate pass: tracemalloc slows the load itself several times over
+        tracemalloc.start()
+        measured = isin_master.IsinMaster(path)
+        measured.load()
+        retained_mb = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+        del measured
+
+    keys = [random.choice(isins) for _ in range(lookups)]
+    dict_ns = time_lookups(master.instrument_type, keys)
+
+    ordered = sorted(isins)
+    def bisect_lookup(isin):
+        i = bisect.bisect_left(ordered, isin)
+        return i < len(ordered) and ordered[i] == isin
+    bisect_ns = time_lookups(bisect_lookup, keys)
+
+    statement = [{'isin_code': random.choice(isins)} for _ in range(500)]
+    t0 = time.perf_counter()
+    for _ in range(100):
+        master.enrich(statement)
+    enrich_us = (time.perf_counter() - t0) / 100 * 1e6
+
+    print(f"{rows:>9,} rows  file={size_mb:6.1f}MB  load={load_s * 1000:8.1f}ms  mem={retained_mb:6.1f}MB  "
+          f"dict={dict_ns:6.0f}ns  bisect={bisect_ns:6.0f}ns  enrich(500)={enrich_us:7.0f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='60000,500000')
+    parser.add_argument('--lookups', type=int, default=200000)
+    args = parser.parse_args()
+
+    random.seed(7)
+    for rows in (int(n) for n in args.rows.split(',')):
+        run(rows, args.lookups)
+
+
+if __name__ == '__main__':
+    main()
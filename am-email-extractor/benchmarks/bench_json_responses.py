@@ -0,0 +1,104 @@
+"""
+Benchmark: extraction response serialization and compression
+
+For an extraction response with N holdings (normalised and enriched, as
+the API returns them), reports the time to serialize it with Flask's
+default provider settings (stdlib, sorted keys, ASCII), fast_json's stdlib
+fallback and orjson, and the response size raw, gzip-compressed and
+brotli-compressed at the levels compression.py uses, with the time each
+compression takes.
+
+    python benchmarks/bench_json_responses.py [--sizes 10,500,5000] [--repeat 20]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compression
+import fast_json
+import holding
+
+TYPES = ('EQUITY', 'ETF', 'MUTUAL_FUND', 'SGB')
+
+
+def make_response(n):
+    random.seed(n)
+    rows = []
+    for i in range(n):
+        qty = random.randint(1, 5000)
+        rate = round(random.uniform(5, 5000), 2)
+        rows.append({
+            'isin_code': f'INE{i:06d}01{i % 10}',
+            'company_name': f'COMPANY {i % 5000} LIMITED',
+            'current_bal': f'{qty:,.2f}',
+            'rate': f'{rate:.2f}',
+            'value': f'{qty * rate:,.2f}'
+        })
+    holdings = holding.normalise(rows)
+    for i, h in enumerate(holdings):
+        h.update(instrument_type=TYPES[i % len(TYPES)], symbol=f'SYM{i}', canonical_name=h['company_name'].title())
+    return {
+        'success': True,
+        'broker': 'zerodha',
+        'count': n,
+        'holdings': holdings,
+        'metadata': {'source': 'upload', 'filename': 'holdings.pdf', 'bytes': 183211, 'pages': 4,
+                     'pages_parsed': 4, 'holdings': n, 'parse_ms': 812.4},
+        'db_id': '65f0c2a1e4b0a1b2c3d4e5f6'
+    }
+
+
+def flask_default(obj):
+    # DefaultJSONProvider.response outside debug mode
+    return (json.dumps(obj, ensure_ascii=True, sort_keys=True, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def stdlib_fast(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def best_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return min(times)
+
+
+def run(n, repeat):
+    response = make_response(n)
+    print(f"=== {n:,} holdings ===")
+    serializers = [('flask default', flask_default), ('fast_json stdlib', stdlib_fast)]
+    if fast_json.BACKEND == 'orjson':
+        serializers.append(('fast_json orjson', fast_json.dumps))
+    for label, dumps in serializers:
+        print(f"    serialize {label:<18} {best_ms(lambda: dumps(response), repeat):8.3f}ms")
+
+    body = fast_json.dumps(response)
+    print(f"    {'raw':<12} {len(body):>10,} bytes")
+    encodings = ['gzip'] + (['br'] if compression.brotli is not None else [])
+    for encoding in encodings:
+        size = len(compression.compress(body, encoding))
+        ms = best_ms(lambda: compression.compress(body, encoding), repeat)
+        print(f"    {encoding:<12} {size:>10,} bytes  ({len(body) / size:4.1f}x)  compress {ms:8.3f}ms")
+    if compression.brotli is None:
+        print("    br           (brotli not installed)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,500,5000')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    for n in (int(size) for size in args.sizes.split(',')):
+        run(n, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark: latest-snapshot lookup latency with and without indexes
+
+Seeds a scratch database with synthetic portfolio_holdings snapshots, then
+times Database.get_latest_holdings-style lookups for random users, first
+with no secondary indexes and then after Database.ensure_indexes(). Also
+reports documents examined per lookup from explain().
+
+Needs a running MongoDB (MONGODB_URL). Seeding 10M documents takes a while
+and several GB of disk; use --docs for a smaller run, and --skip-seed to
+reuse an already seeded database.
+
+    python benchmarks/bench_mongo_lookup.py --docs 10000000 --users 100000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+BROKERS = ['groww', 'zerodha', 'angleone', 'dhan', 'mstock']
+
+
+def seed(collection, n_docs, n_users, batch_size=10000):
+    collection.drop()
+    start = datetime(2020, 1, 1)
+    holdings = [{'isin_code': f'INE{i:07d}01', 'company_name': f'CO {i}', 'current_bal': '10.00',
+                 'rate': '100.00', 'value': '1000.00'} for i in range(20)]
+    t0 = time.perf_counter()
+    for offset in range(0, n_docs, batch_size):
+        batch = []
+        for i in range(offset, min(offset + batch_size, n_docs)):
+            batch.append({
+                'user_id': f'user-{i % n_users}',
+                'broker': BROKERS[i % len(BROKERS)],
+                'holdings': holdings,
+                'extracted_at': start + timedelta(minutes=i),
+                'source': 'benchmark',
+                'metadata': {}
+            })
+        collection.insert_many(batch, ordered=False)
+        print(f"\rSeeded {offset + len(batch):,}/{n_docs:,}", end='', flush=True)
+    print(f"\nSeeding took {time.perf_counter() - t0:.1f}s")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_lookups(collection, n_users, lookups, label):
+    latencies = []
+    for _ in range(lookups):
+        query = {'user_id': f'user-{random.randrange(n_users)}', 'broker': random.choice(BROKERS)}
+        t0 = time.perf_counter()
+        collection.find_one(query, {'holdings': 1}, sort=[('extracted_at', -1)])
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    plan = collection.find(
+        {'user_id': 'user-0', 'broker': 'groww'}, {'holdings': 1}
+    ).sort('extracted_at', -1).limit(1).explain()
+    examined = plan.get('executionStats', {}).get('totalDocsExamined')
+
+    print(f"{label:<12} p50={percentile(latencies, 50):9.2f}ms  p95={percentile(latencies, 95):9.2f}ms  "
+          f"p99={percentile(latencies, 99):9.2f}ms  docsExamined={examined}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=10_000_000)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--lookups', type=int, default=50)
+    parser.add_argument('--database', default='portfolio_benchmark')
+    parser.add_argument('--skip-seed', action='store_true')
+    args = parser.parse_args()
+
+    db = database.Database()
+    db.db_name = args.database
+    collection = db.get_db()['portfolio_holdings']
+
+    if not args.skip_seed:
+        seed(collection, args.docs, args.users)
+
+    random.seed(7)
+    collection.drop_indexes()
+    # Collection scans are slow at this size; keep the unindexed sample small
+    run_lookups(collection, args.users, min(args.lookups, 10), 'no index')
+
+    t0 = time.perf_counter()
+    db.ensure_indexes()
+    print(f"Index build took {time.perf_counter() - t0:.1f}s")
+    run_lookups(collection, args.users, args.lookups, 'indexed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Broker statement extractors
+
+Each brokers/<broker>/extractor.py exposes extract_holdings(path, password)
+and a PARSER_VERSION. Bump PARSER_VERSION when a fix changes what the
+extractor returns; archived statements parsed by an older version are then
+picked up by reparse_statements.py.
+"""
+import importlib
+import metrics
+import tracing
+
+SUPPORTED_BROKERS = ['groww', 'zerodha', 'angleone', 'dhan', 'mstock']
+
+# Any Indian ISIN: equities (INE), funds and ETFs (INF), government
+# securities and SGBs (IN0..IN9); the last character is a check digit
+ISIN_PATTERN = r'IN[A-Z0-9]{9}[0-9]'
+
+
+def get_extractor(broker):
+    """Import the extractor module for a broker"""
+    if broker not in SUPPORTED_BROKERS:
+        raise ValueError(f"Unsupported broker: {broker}")
+    return importlib.import_module(f'brokers.{broker}.extractor')
+
+
+def parser_version(broker):
+    """Current PARSER_VERSION of a broker's extractor"""
+    return getattr(get_extractor(broker), 'PARSER_VERSION', 1)
+
+
+def extract_holdings(broker, file_path, password=None):
+    """Run the broker's extractor on a statement file"""
+    metrics.bind_broker(broker)
+    with tracing.span('extractor.extract_holdings', broker=broker):
+        holdings = get_extractor(broker).extract_holdings(file_path, password)
+    metrics.add_holdings(len(holdings), broker)
+    return holdings
+
+
+def extract_with_costs(broker, file_path, password=None):
+    """
+    Process-pool entry point: holdings plus the costs measured in the worker
+
+    Returns:
+        (holdings, metrics.costs() of this extraction)
+    """
+    metrics.start_costs()
+    holdings = extract_holdings(broker, file_path, password)
+    return holdings, metrics.costs()
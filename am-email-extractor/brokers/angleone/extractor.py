@@ -1,6 +1,12 @@
 import pandas as pd
 import json
 import os
+import re
+from brokers import ISIN_PATTERN
+import metrics
+
+# Bump when a fix changes extracted holdings; archived statements are re-parsed
+PARSER_VERSION = 2
 
 def extract_holdings(file_path, password=None):
     """
@@ -17,7 +23,8 @@ def extract_holdings(file_path, password=None):
     
     try:
         # Read Excel file - the header row is at row 9 (0-indexed)
-        df = pd.read_excel(file_path, header=9)
+        with metrics.stage('excel_read'):
+            df = pd.read_excel(file_path, header=9)
         
         # The first row after header contains column names, skip it
         # Data starts from row 1 onwards
@@ -31,33 +38,34 @@ def extract_holdings(file_path, password=None):
         # Column 7: Avg Trading Price (rate)
         # Column 10: Market Value as of last trading day
         
-        for idx, row in df.iterrows():
-            # Skip empty rows
-            if pd.isna(row.iloc[2]) or str(row.iloc[2]).strip() == '':
-                continue
+        with metrics.stage('line_parsing'):
+            for idx, row in df.iterrows():
+                # Skip empty rows
+                if pd.isna(row.iloc[2]) or str(row.iloc[2]).strip() == '':
+                    continue
             
-            isin_code = str(row.iloc[2]).strip()
-            company_name = str(row.iloc[1]).strip() if not pd.isna(row.iloc[1]) else ''
+                isin_code = str(row.iloc[2]).strip()
+                company_name = str(row.iloc[1]).strip() if not pd.isna(row.iloc[1]) else ''
             
-            # Get quantity (current balance)
-            current_bal = str(row.iloc[5]) if not pd.isna(row.iloc[5]) else '0'
+                # Get quantity (current balance)
+                current_bal = str(row.iloc[5]) if not pd.isna(row.iloc[5]) else '0'
             
-            # Get average trading price (rate)
-            rate = str(row.iloc[7]) if not pd.isna(row.iloc[7]) else '0'
+                # Get average trading price (rate)
+                rate = str(row.iloc[7]) if not pd.isna(row.iloc[7]) else '0'
             
-            # Get market value
-            value = str(row.iloc[10]) if not pd.isna(row.iloc[10]) else '0'
+                # Get market value
+                value = str(row.iloc[10]) if not pd.isna(row.iloc[10]) else '0'
             
-            # Only add if we have valid data
-            if isin_code and isin_code.startswith('INE'):
-                holding = {
-                    'isin_code': isin_code,
-                    'company_name': company_name,
-                    'current_bal': current_bal,
-                    'rate': rate,
-                    'value': value
-                }
-                holdings.append(holding)
+                # Only add if we have valid data
+                if isin_code and re.fullmatch(ISIN_PATTERN, isin_code):
+                    holding = {
+                        'isin_code': isin_code,
+                        'company_name': company_name,
+                        'current_bal': current_bal,
+                        'rate': rate,
+                        'value': value
+                    }
+                    holdings.append(holding)
         
         return holdings
     
@@ -0,0 +1,39 @@
+"""
+Helpers shared by the broker extractors
+"""
+import time
+import pdfplumber
+import metrics
+import profiling
+import tracing
+
+
+def read_pdf_text(pdf_path, password=None):
+    """
+    Open (and decrypt) a statement PDF and return the text of all pages
+
+    Timed as the pdf_open and text_extraction stages, with pages counted.
+    """
+    with tracing.span('pdf.open'), metrics.stage('pdf_open'):
+        pdf = pdfplumber.open(pdf_path, password=password)
+    with pdf:
+        with tracing.span('pdf.extract_text', pages=len(pdf.pages)), metrics.stage('text_extraction'):
+            collector = profiling.page_collector()
+            if collector is None:
+                # Pages without a text layer return None
+                text = "\n".join(page.extract_text() or "" for page in pdf.pages) + "\n"
+            else:
+                text = _extract_with_stats(pdf, collector)
+        metrics.add_pages(len(pdf.pages))
+    return text
+
+
+def _extract_with_stats(pdf, collector):
+    """Page-by-page extraction that records layout stats for a profiled request"""
+    parts = []
+    for page in pdf.pages:
+        t0 = time.perf_counter()
+        page_text = page.extract_text() or ""
+        collector.add_page(page, time.perf_counter() - t0, len(page_text))
+        parts.append(page_text)
+    return "\n".join(parts) + "\n"
@@ -1,10 +1,15 @@
-import pdfplumber
 import pandas as pd
 import re
 import json
 from pdfminer.pdfdocument import PDFPasswordIncorrect
+from brokers import ISIN_PATTERN
+from brokers.common import read_pdf_text
+import metrics
 # PdfminerException moved in recent pdfplumber versions, catching general exception instead
 
+# Bump when a fix changes extracted holdings; archived statements are re-parsed
+PARSER_VERSION = 2
+
 def extract_holdings(file_path, password=None):
     """
     Extract portfolio holdings from Dhan broker document
@@ -20,12 +25,8 @@ def extract_holdings(file_path, password=None):
     
     try:
         # PDF file processing
-        with pdfplumber.open(file_path, password=password) as pdf:
-            full_text = ""
-            
-            # Extract text from all pages
-            for page in pdf.pages:
-                full_text += page.extract_text() + "\n"
+        full_text = read_pdf_text(file_path, password)
+        with metrics.stage('line_parsing'):
             
             # Find the "Holding as on" section
             holding_match = re.search(r'Holding as on.*?\n(.*)', full_text, re.DOTALL)
@@ -58,8 +59,8 @@ def extract_holdings(file_path, password=None):
                 # Example: 1 INE748C01038 3I INFOTECH-EQ10/- 500.00 21.55 10775.00
                 # Example: 4 INE885A01032 AMARA RAJA EQ 1/- 30.00 989.25 29677.50
                 
-                # Match lines starting with number followed by ISIN code (INE...)
-                match = re.match(r'^\s*(\d+)\s+(INE[A-Z0-9]+)\s+(.+?)\s+([\d,]+\.?\d*)\s+.*?([\d,]+\.?\d*)\s+([\d,]+\.?\d*)$', line.strip())
+                # Match lines starting with number followed by ISIN code
+                match = re.match(rf'^\s*(\d+)\s+({ISIN_PATTERN})\s+(.+?)\s+([\d,]+\.?\d*)\s+.*?([\d,]+\.?\d*)\s+([\d,]+\.?\d*)$', line.strip())
                 
                 if match:
                     sr_no = match.group(1)
@@ -1,9 +1,14 @@
-import pdfplumber
 import re
 import json
 from pdfminer.pdfdocument import PDFPasswordIncorrect
+from brokers import ISIN_PATTERN
+from brokers.common import read_pdf_text
+import metrics
 # PdfminerException moved in recent pdfplumber versions, catching general exception instead
 
+# Bump when a fix changes extracted holdings; archived statements are re-parsed
+PARSER_VERSION = 2
+
 def extract_holdings(pdf_path, password=None):
     """
     Extract portfolio holdings from Groww broker PDF document
@@ -18,12 +23,8 @@ def extract_holdings(pdf_path, password=None):
     holdings = []
     
     try:
-        with pdfplumber.open(pdf_path, password=password) as pdf:
-            full_text = ""
-            
-            # Extract text from all pages
-            for page in pdf.pages:
-                full_text += page.extract_text() + "\n"
+        full_text = read_pdf_text(pdf_path, password)
+        with metrics.stage('line_parsing'):
             
             # Find the HOLDINGS BALANCE section
             holdings_match = re.search(r'HOLDINGS BALANCE\s+As on.*?\n(.*?)(?:Total|$)', 
@@ -44,8 +45,8 @@ def extract_holdings(pdf_path, password=None):
                     if not line:
                         continue
                     
-                    # Check if line starts with ISIN code (INE followed by alphanumeric)
-                    isin_match = re.match(r'^(INE[A-Z0-9]+)\s+(.+)', line)
+                    # Check if line starts with an ISIN code
+                    isin_match = re.match(rf'^({ISIN_PATTERN})\s+(.+)', line)
                     
                     if isin_match:
                         # If we have a previous holding being built, save it
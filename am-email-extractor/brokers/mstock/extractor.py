@@ -1,10 +1,15 @@
-import pdfplumber
 import pandas as pd
 import re
 import json
 from pdfminer.pdfdocument import PDFPasswordIncorrect
+from brokers import ISIN_PATTERN
+from brokers.common import read_pdf_text
+import metrics
 # PdfminerException moved in recent pdfplumber versions, catching general exception instead
 
+# Bump when a fix changes extracted holdings; archived statements are re-parsed
+PARSER_VERSION = 2
+
 def extract_holdings(file_path, password=None):
     """
     Extract portfolio holdings from MSTOCK broker document
@@ -20,12 +25,8 @@ def extract_holdings(file_path, password=None):
     
     try:
         # PDF file processing
-        with pdfplumber.open(file_path, password=password) as pdf:
-            full_text = ""
-            
-            # Extract text from all pages
-            for page in pdf.pages:
-                full_text += page.extract_text() + "\n"
+        full_text = read_pdf_text(file_path, password)
+        with metrics.stage('line_parsing'):
             
             # Find the "STATEMENT OF HOLDINGS" section
             holding_match = re.search(r'STATEMENT OF HOLDINGS.*?FROM.*?TO.*?\n(.*)', full_text, re.DOTALL | re.IGNORECASE)
@@ -66,8 +67,8 @@ def extract_holdings(file_path, password=None):
                 # Line 2: FREE_BAL LOCKED_IN_BAL EARMARKED_BAL
                 # Line 3: LENT_BAL AVL_BAL BORROWED_BAL
                 
-                # Match first line with ISIN code (INE...)
-                match = re.match(r'^\s*(INE[A-Z0-9]+)\s+(.+?)\s+([\d,]+\.?\d*)\s+([\d,]+\.?\d*)\s+([\d,]+\.?\d*)$', line.strip())
+                # Match first line with ISIN code
+                match = re.match(rf'^\s*({ISIN_PATTERN})\s+(.+?)\s+([\d,]+\.?\d*)\s+([\d,]+\.?\d*)\s+([\d,]+\.?\d*)$', line.strip())
                 
                 if match:
                     current_isin = match.group(1)
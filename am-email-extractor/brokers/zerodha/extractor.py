@@ -1,9 +1,14 @@
-import pdfplumber
 import re
 import json
 from pdfminer.pdfdocument import PDFPasswordIncorrect
+from brokers import ISIN_PATTERN
+from brokers.common import read_pdf_text
+import metrics
 # PdfminerException moved in recent pdfplumber versions, catching general exception instead
 
+# Bump when a fix changes extracted holdings; archived statements are re-parsed
+PARSER_VERSION = 2
+
 def extract_holdings(pdf_path, password=None):
     """
     Extract portfolio holdings from Zerodha broker PDF document
@@ -18,12 +23,8 @@ def extract_holdings(pdf_path, password=None):
     holdings = []
     
     try:
-        with pdfplumber.open(pdf_path, password=password) as pdf:
-            full_text = ""
-            
-            # Extract text from all pages
-            for page in pdf.pages:
-                full_text += page.extract_text() + "\n"
+        full_text = read_pdf_text(pdf_path, password)
+        with metrics.stage('line_parsing'):
             
             # Find the Holdings section
             holdings_match = re.search(r'Holdings as on.*?:', full_text, re.IGNORECASE)
@@ -38,8 +39,8 @@ def extract_holdings(pdf_path, password=None):
             # Split into lines
             lines = holdings_text.split('\n')
             
-            # ISIN pattern: INE followed by alphanumerics
-            isin_pattern = re.compile(r'^(INE[A-Z0-9]+)')
+            # Lines starting with an ISIN begin a holding
+            isin_pattern = re.compile(rf'^({ISIN_PATTERN})')
             
             current_holding = None
             
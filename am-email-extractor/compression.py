@@ -0,0 +1,82 @@
+"""
+Negotiated response compression
+
+Responses of at least COMPRESS_MIN_BYTES with a compressible content type
+are compressed with the best encoding the client accepts: brotli (when the
+brotli package is installed) or gzip. Holdings JSON is highly repetitive
+and shrinks 7-10x from a few hundred holdings up, at the fast levels used
+here (COMPRESS_GZIP_LEVEL, COMPRESS_BROTLI_QUALITY) for about the CPU the
+stdlib encoder took to serialize it; see benchmarks/bench_json_responses.py.
+
+Used by the Flask app (after_request) and the ASGI extraction endpoints.
+"""
+import os
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENABLED = os.environ.get('COMPRESS_ENABLED', 'true').lower() == 'true'
+MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 5))
+BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+# Server preference when the client accepts several equally
+PREFERENCE = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def accepted_encodings(accept_encoding):
+    """{coding: q} from an Accept-Encoding header"""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding):
+    """Best supported coding the client accepts, or None"""
+    accepted = accepted_encodings(accept_encoding)
+    best = None
+    best_q = 0.0
+    for coding in PREFERENCE:
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def should_compress(content_type, size, status_code=200, content_encoding=None):
+    if not ENABLED or content_encoding or size < MIN_BYTES:
+        return False
+    if status_code < 200 or status_code >= 300 or status_code == 204:
+        return False
+    return (content_type or '').startswith(COMPRESSIBLE_TYPES)
+
+
+def weak_etag(etag):
+    """The compressed body differs byte for byte, so a strong ETag becomes weak"""
+    if etag and not etag.startswith('W/'):
+        return f'W/{etag}'
+    return etag
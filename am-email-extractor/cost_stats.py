@@ -0,0 +1,152 @@
+"""
+Per-extraction cost accounting and the capacity stats rollup
+
+Every extraction stores its costs in the snapshot's metadata:
+
+    bytes         statement size
+    pages         pages in the PDF (PDF statements only)
+    pages_parsed  pages text-extracted
+    holdings      holdings extracted
+    parse_ms      PDF/Excel open, text extraction and line parsing
+    gmail_ms      credential load/refresh, search, message fetch, download
+                  (Gmail extractions only)
+    db_ms         the MongoDB write batch that stored the snapshot
+
+and adds them to a rollup document per (broker, UTC day) in
+extraction_stats with $inc: a count, sums, min/max and fixed-bucket
+histogram counts per field. The stats endpoint reads a handful of rollup
+documents and derives percentiles from the merged histograms, never
+scanning snapshots. Percentiles are interpolated within a bucket, so they
+are estimates accurate to the bucket width.
+
+The first six are accumulated during the request by metrics.stage and
+friends (metrics.start_costs/costs); db_ms is set by the database once the
+write has completed.
+"""
+import bisect
+
+COST_FIELDS = ('bytes', 'pages', 'pages_parsed', 'holdings', 'parse_ms', 'gmail_ms', 'db_ms')
+
+_MS_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+_PAGE_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+# Upper bounds; values above the last bound go to an overflow bucket
+BUCKETS = {
+    'bytes': (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2),
+    'pages': _PAGE_BUCKETS,
+    'pages_parsed': _PAGE_BUCKETS,
+    'holdings': (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+    'parse_ms': _MS_BUCKETS,
+    'gmail_ms': _MS_BUCKETS,
+    'db_ms': _MS_BUCKETS,
+}
+
+PERCENTILES = (50, 90, 99)
+
+
+def bucket_index(field, value):
+    return bisect.bisect_left(BUCKETS[field], value)
+
+
+def day_of(moment):
+    return moment.strftime('%Y-%m-%d')
+
+
+def rollup_increments(metadata):
+    """$inc/$min/$max update adding one extraction's costs to a rollup document"""
+    inc = {'count': 1}
+    low = {}
+    high = {}
+    for field in COST_FIELDS:
+        value = metadata.get(field)
+        if value is None:
+            continue
+        inc[f'sum.{field}'] = value
+        inc[f'hist.{field}.{bucket_index(field, value)}'] = 1
+        low[f'min.{field}'] = value
+        high[f'max.{field}'] = value
+    return inc, low, high
+
+
+def merge_increments(updates):
+    """Combine several rollup_increments results for the same document"""
+    inc, low, high = {}, {}, {}
+    for u_inc, u_low, u_high in updates:
+        for key, value in u_inc.items():
+            inc[key] = inc.get(key, 0) + value
+        for key, value in u_low.items():
+            low[key] = min(low.get(key, value), value)
+        for key, value in u_high.items():
+            high[key] = max(high.get(key, value), value)
+    return inc, low, high
+
+
+def rollup_updates(documents):
+    """(query, update) upserts adding costed snapshot documents to their (broker, day) rollups"""
+    groups = {}
+    for document in documents:
+        key = (document['broker'], day_of(document['extracted_at']))
+        groups.setdefault(key, []).append(rollup_increments(document['metadata']))
+    updates = []
+    for (broker, day), increments in groups.items():
+        inc, low, high = merge_increments(increments)
+        update = {'$inc': inc}
+        if low:
+            update['$min'] = low
+            update['$max'] = high
+        updates.append(({'broker': broker, 'day': day}, update))
+    return updates
+
+
+def percentile(counts, bounds, q, minimum=None, maximum=None):
+    """Estimate the q-th percentile from bucket counts (index -> count)"""
+    total = sum(counts.values())
+    if not total:
+        return None
+    rank = total * q / 100
+    seen = 0
+    for index in range(len(bounds) + 1):
+        count = counts.get(index, 0)
+        if count and seen + count >= rank:
+            lower = bounds[index - 1] if index > 0 else 0
+            upper = bounds[index] if index < len(bounds) else (maximum if maximum is not None else lower)
+            if minimum is not None:
+                lower = max(lower, minimum)
+            if maximum is not None:
+                upper = min(upper, maximum)
+            return round(lower + (upper - lower) * (rank - seen) / count, 1)
+        seen += count
+    return maximum
+
+
+def summarize(rollups):
+    """
+    Merge rollup documents into count, mean, min, max and percentiles per field
+
+    Returns:
+        {'count': n, 'fields': {field: {...}}}
+    """
+    count = sum(doc.get('count', 0) for doc in rollups)
+    fields = {}
+    for field in COST_FIELDS:
+        counts = {}
+        total = 0
+        low = high = None
+        for doc in rollups:
+            for index, n in (doc.get('hist', {}).get(field) or {}).items():
+                counts[int(index)] = counts.get(int(index), 0) + n
+            total += doc.get('sum', {}).get(field, 0)
+            doc_low = doc.get('min', {}).get(field)
+            doc_high = doc.get('max', {}).get(field)
+            if doc_low is not None:
+                low = doc_low if low is None else min(low, doc_low)
+            if doc_high is not None:
+                high = doc_high if high is None else max(high, doc_high)
+        samples = sum(counts.values())
+        if not samples:
+            continue
+        summary = {'count': samples, 'mean': round(total / samples, 1), 'min': round(low, 1), 'max': round(high, 1)}
+        for q in PERCENTILES:
+            summary[f'p{q}'] = percentile(counts, BUCKETS[field], q, low, high)
+        fields[field] = summary
+    return {'count': count, 'fields': fields}
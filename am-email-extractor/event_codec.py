@@ -0,0 +1,120 @@
+"""
+Kafka event encodings for portfolio update events
+
+json     - the original payload, holdings as dicts of strings (default,
+           understood by the Java document processor)
+msgpack  - compact versioned schema (schemas/portfolio_update_v1.json):
+           numbers as doubles, holdings as positional arrays
+
+The encoding travels in the 'contentType' and 'schemaVersion' headers so
+consumers can decode either form.
+"""
+import os
+import json
+import fast_json
+from holding import Holding
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schemas')
+SCHEMA_VERSION = 1
+
+# Payload fields holding lists of holdings (full snapshots and deltas)
+HOLDING_LISTS = ('equities', 'mutualFunds', 'added', 'changed')
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'msgpack': 'application/x-msgpack',
+}
+
+
+def load_schema(version=SCHEMA_VERSION):
+    """Load a compact event schema from the local schema directory"""
+    with open(os.path.join(SCHEMA_DIR, f'portfolio_update_v{version}.json')) as f:
+        return json.load(f)
+
+
+_schema = load_schema()
+HOLDING_FIELDS = [field['name'] for field in _schema['holdingFields']]
+NUMERIC_FIELDS = {field['name'] for field in _schema['holdingFields'] if field['type'] == 'double'}
+
+
+def to_number(value):
+    """Parse an extractor string like '1,234.50' into a float, None if missing"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).replace(',', '').strip()
+    if not text or text.upper() in ('N/A', 'NA', '-', 'NAN'):
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _pack_holding(holding):
+    if isinstance(holding, Holding):
+        return holding.to_row()
+    return [
+        to_number(holding.get(name)) if name in NUMERIC_FIELDS else holding.get(name)
+        for name in HOLDING_FIELDS
+    ]
+
+
+def _unpack_holding(row):
+    return dict(zip(HOLDING_FIELDS, row))
+
+
+def to_compact(payload):
+    """Convert an event payload to the compact schema"""
+    compact = {key: value for key, value in payload.items() if key not in HOLDING_LISTS}
+    compact['v'] = SCHEMA_VERSION
+    for key in HOLDING_LISTS:
+        if key in payload:
+            compact[key] = [_pack_holding(h) for h in payload[key] or []]
+    return compact
+
+
+def from_compact(compact):
+    """Expand a compact event back to dict holdings (numbers stay numeric)"""
+    payload = {key: value for key, value in compact.items() if key != 'v'}
+    for key in HOLDING_LISTS:
+        if key in compact:
+            payload[key] = [_unpack_holding(row) for row in compact[key] or []]
+    return payload
+
+
+def check_encoding(encoding):
+    """Validate an encoding name, raising if it cannot be used here"""
+    if encoding not in CONTENT_TYPES:
+        raise ValueError(f"Unsupported event encoding: {encoding}. Supported: {list(CONTENT_TYPES)}")
+    if encoding == 'msgpack' and msgpack is None:
+        raise ValueError("msgpack encoding requires the msgpack package")
+    return encoding
+
+
+def encode(payload, encoding='json'):
+    """Serialize an event payload to bytes (holdings may be dicts or Holding records)"""
+    if encoding == 'msgpack':
+        return msgpack.packb(to_compact(payload), use_bin_type=True)
+    return fast_json.dumps(payload)
+
+
+def decode(value, content_type=None):
+    """Deserialize event bytes using the contentType header (JSON if absent)"""
+    if content_type == CONTENT_TYPES['msgpack']:
+        return from_compact(msgpack.unpackb(value, raw=False))
+    return fast_json.loads(value)
+
+
+def headers(encoding='json'):
+    """Kafka headers describing the encoding"""
+    return [
+        ('contentType', CONTENT_TYPES[encoding].encode('utf-8')),
+        ('schemaVersion', str(SCHEMA_VERSION if encoding == 'msgpack' else 0).encode('utf-8')),
+    ]
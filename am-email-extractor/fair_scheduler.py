@@ -0,0 +1,140 @@
+"""
+Weighted fair scheduling of queued extractions across users
+
+Waiting requests are kept in one FIFO queue per (priority class, user).
+When a slot frees, the scheduler serves:
+
+  1. the most urgent class with a waiter -- interactive, then refresh
+     (scheduled syncs), then backfill -- whose class is below its share of
+     the slots
+  2. within that class, the user with the smallest virtual time (start-time
+     fair queuing): every request served advances its user's virtual time by
+     1/weight, and a user who was idle joins at the class's current virtual
+     time, so nobody banks credit by waiting
+
+so a user with hundreds of queued backfill statements gets the same turn
+rate as one with a single statement, and background classes can never hold
+every slot: refresh is capped at SCHEDULER_REFRESH_SHARE of them and
+backfill at SCHEDULER_BACKFILL_SHARE, leaving room for interactive
+requests to start without waiting for a long backfill to finish.
+
+The scheduler is a plain data structure; admission.Admission holds the lock
+and decides when to pop.
+"""
+import os
+import math
+from collections import deque
+
+PRIORITIES = ('interactive', 'refresh', 'backfill')
+DEFAULT_PRIORITY = 'interactive'
+
+
+def parse_priority(value, default=DEFAULT_PRIORITY):
+    """Priority class named by a header or claim, or the default"""
+    value = str(value or '').strip().lower()
+    return value if value in PRIORITIES else default
+
+
+class FairScheduler:
+    def __init__(self, capacity, shares=None):
+        """
+        Args:
+            capacity: Slots being scheduled (the admission concurrency limit)
+            shares: Fraction of the slots each class may hold at once
+        """
+        shares = shares or {
+            'interactive': 1.0,
+            'refresh': float(os.environ.get('SCHEDULER_REFRESH_SHARE', 0.75)),
+            'backfill': float(os.environ.get('SCHEDULER_BACKFILL_SHARE', 0.5)),
+        }
+        self.limits = {cls: max(1, math.ceil(capacity * shares.get(cls, 1.0))) for cls in PRIORITIES}
+        self._queues = {cls: {} for cls in PRIORITIES}    # user -> deque of items
+        self._vtime = {cls: {} for cls in PRIORITIES}     # user -> virtual time
+        self._clock = {cls: 0.0 for cls in PRIORITIES}
+        self._weights = {}
+        self._active = {cls: 0 for cls in PRIORITIES}
+        self._waiting = {cls: 0 for cls in PRIORITIES}
+
+    def __len__(self):
+        return sum(self._waiting.values())
+
+    def waiting(self, priority):
+        return self._waiting[priority]
+
+    def active(self, priority):
+        return self._active[priority]
+
+    def has_room(self, priority):
+        """Whether the class is below its share of the slots"""
+        return self._active[priority] < self.limits[priority]
+
+    def push(self, item, user_id, priority, weight=1.0):
+        queues = self._queues[priority]
+        if user_id not in queues:
+            queues[user_id] = deque()
+            vtime = self._vtime[priority]
+            vtime[user_id] = max(vtime.get(user_id, 0.0), self._clock[priority])
+        queues[user_id].append(item)
+        self._weights[user_id] = weight
+        self._waiting[priority] += 1
+
+    def remove(self, item, user_id, priority):
+        """Withdraw a queued item (timed out or cancelled)"""
+        queue = self._queues[priority][user_id]
+        queue.remove(item)
+        self._waiting[priority] -= 1
+        if not queue:
+            self._drop_user(priority, user_id)
+
+    def pop(self, eligible):
+        """
+        Next item to run, or None
+
+        Args:
+            eligible: user_id -> bool, False for users at their own
+                concurrency limit (their items stay queued)
+
+        Returns:
+            (item, user_id, priority)
+        """
+        for priority in PRIORITIES:
+            queues = self._queues[priority]
+            if not queues or not self.has_room(priority):
+                continue
+            vtime = self._vtime[priority]
+            for user_id in sorted(queues, key=vtime.__getitem__):
+                if not eligible(user_id):
+                    continue
+                queue = queues[user_id]
+                item = queue.popleft()
+                self._waiting[priority] -= 1
+                self._clock[priority] = vtime[user_id]
+                vtime[user_id] += 1.0 / self._weights.get(user_id, 1.0)
+                if not queue:
+                    self._drop_user(priority, user_id)
+                return item, user_id, priority
+        return None
+
+    def started(self, priority):
+        self._active[priority] += 1
+
+    def finished(self, priority):
+        self._active[priority] -= 1
+
+    def _drop_user(self, priority, user_id):
+        del self._queues[priority][user_id]
+        # An idle user rejoins at the class clock, so an entry at or behind
+        # it carries no information
+        vtime = self._vtime[priority]
+        if vtime.get(user_id, 0.0) <= self._clock[priority]:
+            vtime.pop(user_id, None)
+        if len(vtime) > 2 * len(self._queues[priority]) + 1000:
+            clock = self._clock[priority]
+            for idle in [u for u, t in vtime.items() if t <= clock and u not in self._queues[priority]]:
+                del vtime[idle]
+        if not any(user_id in queues for queues in self._queues.values()):
+            self._weights.pop(user_id, None)
+
+    def state(self):
+        return {cls: {'active': self._active[cls], 'queued': self._waiting[cls], 'limit': self.limits[cls],
+                      'users': len(self._queues[cls])} for cls in PRIORITIES}
@@ -0,0 +1,59 @@
+"""
+Fast JSON serialization for API responses and Kafka events
+
+Uses orjson when installed (JSON_BACKEND=orjson, the default), else the
+stdlib encoder with compact separators. Both produce UTF-8 bytes directly,
+and understand the types our payloads carry that plain JSON doesn't:
+Holding records (as their dict form), Decimal (as a string) and dates
+(HTTP date format, as Flask's default provider writes them).
+
+Output is compact and keys keep insertion order; unlike Flask's default
+provider, keys are not sorted.
+"""
+import os
+import json
+from decimal import Decimal
+from datetime import date, datetime, timezone
+from email.utils import format_datetime
+from holding import Holding
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = os.environ.get('JSON_BACKEND', 'orjson').lower()
+if BACKEND == 'orjson' and orjson is None:
+    BACKEND = 'stdlib'
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def default(value):
+    """Serialize the non-JSON types found in our payloads"""
+    if isinstance(value, Holding):
+        return value.to_dict()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, date):
+        # HTTP date, naive values taken as UTC (werkzeug.http.http_date)
+        if not isinstance(value, datetime):
+            value = datetime(value.year, value.month, value.day)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """Serialize to UTF-8 JSON bytes"""
+    if BACKEND == 'orjson':
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    if BACKEND == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,12 +1,15 @@
 import os
 import base64
 import pickle
+import logging
 import tempfile
 from datetime import datetime, timedelta
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 from google.oauth2.credentials import Credentials
+import metrics
+import tracing
 
 # Allow OAuth over HTTP when behind a reverse proxy (like Replit)
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
@@ -65,13 +68,15 @@ def get_credentials(user_id=None):
     
     # Check if we have a token file for this user
     if os.path.exists(token_file):
-        with open(token_file, 'rb') as token:
-            creds = pickle.load(token)
+        with tracing.span('gmail.credential_load'), metrics.stage('credential_load'):
+            with open(token_file, 'rb') as token:
+                creds = pickle.load(token)
     
     # If credentials are invalid or don't exist
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            with tracing.span('gmail.credential_refresh'), metrics.stage('credential_refresh'):
+                creds.refresh(Request())
             # Save refreshed credentials
             with open(token_file, 'wb') as token:
                 pickle.dump(creds, token)
@@ -142,14 +147,14 @@ def get_user_info(creds):
             return response.json()
         return None
     except Exception as e:
-        print(f"Error fetching user info: {e}")
+        logging.error(f"Error fetching user info: {e}")
         return None
 
-def search_emails(service, broker, days_back=180):
-    """Search for emails from a specific broker"""
+def build_search_query(broker, days_back=180, with_subject=True):
+    """Gmail search query for a broker's statements, or None for an unknown broker"""
     pattern = BROKER_PATTERNS.get(broker.lower())
     if not pattern:
-        return []
+        return None
     
     # Calculate date for search
     date_from = (datetime.now() - timedelta(days=days_back)).strftime('%Y/%m/%d')
@@ -161,85 +166,91 @@ def search_emails(service, broker, days_back=180):
         f'after:{date_from}'
     ]
     
-    if pattern['subject']:
+    if with_subject and pattern['subject']:
         # Use quoted subject for partial match
         query_parts.append(f'subject:"{pattern["subject"]}"')
     
-    query = ' '.join(query_parts)
+    return ' '.join(query_parts)
+
+def search_emails(service, broker, days_back=180):
+    """Search for emails from a specific broker"""
+    query = build_search_query(broker, days_back)
+    if not query:
+        return []
+    pattern = BROKER_PATTERNS[broker.lower()]
     
-    print(f"=== Gmail Search Debug ===")
-    print(f"Broker: {broker.upper()}")
-    print(f"Search Query: {query}")
-    print(f"Searching emails from {date_from} onwards...")
+    logging.debug("Gmail search for %s: %s", broker.upper(), query)
     
     try:
-        results = service.users().messages().list(
-            userId='me',
-            q=query,
-            maxResults=10
-        ).execute()
+        with tracing.span('gmail.search', broker=broker), metrics.stage('gmail_search'):
+            results = service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=10
+            ).execute()
         
         messages = results.get('messages', [])
-        print(f"Found {len(messages)} messages matching query")
+        logging.debug("Found %d messages matching query", len(messages))
         
         # If no results with subject filter, try without it
         if not messages and pattern['subject']:
-            print(f"No results with subject filter, trying without subject...")
-            query_parts_no_subject = [
-                f'from:{pattern["from"]}',
-                'has:attachment',
-                f'after:{date_from}'
-            ]
-            query_no_subject = ' '.join(query_parts_no_subject)
-            print(f"Retry Query: {query_no_subject}")
+            query_no_subject = build_search_query(broker, days_back, with_subject=False)
+            logging.debug("No results with subject filter, retrying: %s", query_no_subject)
             
-            results = service.users().messages().list(
-                userId='me',
-                q=query_no_subject,
-                maxResults=10
-            ).execute()
+            with tracing.span('gmail.search', broker=broker), metrics.stage('gmail_search'):
+                results = service.users().messages().list(
+                    userId='me',
+                    q=query_no_subject,
+                    maxResults=10
+                ).execute()
             
             messages = results.get('messages', [])
-            print(f"Found {len(messages)} messages without subject filter")
+            logging.debug("Found %d messages without subject filter", len(messages))
         
         return messages
     except Exception as e:
-        print(f"Error searching emails: {e}")
+        logging.error(f"Error searching emails: {e}")
         return []
 
 def get_message_details(service, msg_id):
     """Get email message details"""
     try:
-        message = service.users().messages().get(
-            userId='me',
-            id=msg_id,
-            format='full'
-        ).execute()
-        
-        headers = message['payload'].get('headers', [])
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown')
+        with tracing.span('gmail.message_fetch'), metrics.stage('message_fetch'):
+            message = service.users().messages().get(
+                userId='me',
+                id=msg_id,
+                format='full'
+            ).execute()
         
-        return {
-            'id': msg_id,
-            'subject': subject,
-            'from': sender,
-            'date': date,
-            'payload': message['payload']
-        }
+        return message_summary(msg_id, message)
     except Exception as e:
-        print(f"Error getting message: {e}")
+        logging.error(f"Error getting message: {e}")
         return None
 
+def message_summary(msg_id, message):
+    """id, subject, from, date and payload of a Gmail API message resource"""
+    headers = message['payload'].get('headers', [])
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+    sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
+    date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown')
+    
+    return {
+        'id': msg_id,
+        'subject': subject,
+        'from': sender,
+        'date': date,
+        'payload': message['payload']
+    }
+
 def download_attachment(service, msg_id, attachment_id, filename, store_dir):
     """Download a specific attachment"""
     try:
-        attachment = service.users().messages().attachments().get(
-            userId='me',
-            messageId=msg_id,
-            id=attachment_id
-        ).execute()
+        with tracing.span('gmail.attachment_download'), metrics.stage('attachment_download'):
+            attachment = service.users().messages().attachments().get(
+                userId='me',
+                messageId=msg_id,
+                id=attachment_id
+            ).execute()
         
         file_data = base64.urlsafe_b64decode(attachment['data'].encode('UTF-8'))
         filepath = os.path.join(store_dir, filename)
@@ -249,62 +260,66 @@ def download_attachment(service, msg_id, attachment_id, filename, store_dir):
         
         return filepath
     except Exception as e:
-        print(f"Error downloading attachment: {e}")
+        logging.error(f"Error downloading attachment: {e}")
         return None
 
 def get_attachments(service, msg_id, broker, store_dir='temp_downloads'):
     """Get attachments from a message"""
     try:
-        message = service.users().messages().get(
-            userId='me',
-            id=msg_id
-        ).execute()
+        with tracing.span('gmail.message_fetch'), metrics.stage('message_fetch'):
+            message = service.users().messages().get(
+                userId='me',
+                id=msg_id
+            ).execute()
         
         if not os.path.exists(store_dir):
             os.makedirs(store_dir)
         
-        pattern = BROKER_PATTERNS.get(broker.lower())
-        file_ext = pattern['file_pattern'] if pattern else '.pdf'
-        
         attachments = []
-        parts = [message['payload']]
-        
-        while parts:
-            part = parts.pop()
+        for part in statement_parts(message['payload'], broker):
+            filename = part['filename']
             
-            if part.get('parts'):
-                parts.extend(part['parts'])
-            
-            if part.get('filename'):
-                filename = part['filename']
-                
-                # Filter by file extension
-                if not filename.lower().endswith(file_ext):
-                    continue
-                
-                if 'data' in part['body']:
-                    data = part['body']['data']
-                    file_data = base64.urlsafe_b64decode(data.encode('UTF-8'))
-                    filepath = os.path.join(store_dir, filename)
-                    
-                    with open(filepath, 'wb') as f:
-                        f.write(file_data)
-                else:
-                    att_id = part['body']['attachmentId']
-                    filepath = download_attachment(service, msg_id, att_id, filename, store_dir)
+            if 'data' in part['body']:
+                data = part['body']['data']
+                file_data = base64.urlsafe_b64decode(data.encode('UTF-8'))
+                filepath = os.path.join(store_dir, filename)
                 
-                if filepath:
-                    attachments.append({
-                        'filename': filename,
-                        'path': filepath,
-                        'size': os.path.getsize(filepath)
-                    })
+                with open(filepath, 'wb') as f:
+                    f.write(file_data)
+            else:
+                att_id = part['body']['attachmentId']
+                filepath = download_attachment(service, msg_id, att_id, filename, store_dir)
+            
+            if filepath:
+                size = os.path.getsize(filepath)
+                metrics.add_bytes(size, 'gmail')
+                attachments.append({
+                    'filename': filename,
+                    'path': filepath,
+                    'size': size
+                })
         
         return attachments
     except Exception as e:
-        print(f"Error getting attachments: {e}")
+        logging.error(f"Error getting attachments: {e}")
         return []
 
+def statement_parts(payload, broker):
+    """Message parts that are attachments with the broker's statement extension"""
+    pattern = BROKER_PATTERNS.get(broker.lower())
+    file_ext = pattern['file_pattern'] if pattern else '.pdf'
+    
+    parts = [payload]
+    while parts:
+        part = parts.pop()
+        
+        if part.get('parts'):
+            parts.extend(part['parts'])
+        
+        # Filter by file extension
+        if part.get('filename') and part['filename'].lower().endswith(file_ext):
+            yield part
+
 def get_latest_statement(service, broker):
     """Get the latest portfolio statement for a broker"""
     messages = search_emails(service, broker)
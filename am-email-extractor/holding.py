@@ -0,0 +1,208 @@
+"""
+Typed holding records
+
+Extractors return dicts of strings ('30.00', '1,234.50', 'N/A'). Holding
+parses those numbers once into integers scaled by SCALE (exact to four
+decimal places, None when missing) and keeps them in a __slots__ object,
+which is much smaller than the dict it replaces and needs no further string
+parsing downstream (benchmarks/bench_holdings.py).
+
+The stored and JSON-published form stays the original dict shape
+(to_dict), with numbers as canonical decimal strings ('1234.50') and None
+for missing values. Any other field an extractor returns (e.g. groww's
+`numbers` for a row it couldn't complete) is carried through unchanged.
+to_row gives the positional form of the compact event schema
+(schemas/portfolio_update_v1.json), which has no room for those.
+"""
+import json
+from json.encoder import encode_basestring_ascii
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Numbers are stored as int(round(number * SCALE))
+DECIMALS = 4
+SCALE = 10 ** DECIMALS
+# Below this, scaled / SCALE formatted to DECIMALS places is exact
+EXACT_FLOAT = 2 ** 53
+
+MISSING = ('', 'N/A', 'NA', '-', 'NAN', 'NONE')
+
+# Optional enrichment fields (see isin_master.enrich)
+ENRICHMENT_FIELDS = ('instrument_type', 'symbol', 'canonical_name')
+
+KNOWN_FIELDS = ('isin_code', 'company_name', 'current_bal', 'rate', 'value') + ENRICHMENT_FIELDS
+
+
+def to_scaled(value):
+    """Parse an extractor value like '1,234.50' into a scaled int, None if missing"""
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return value * SCALE
+    if isinstance(value, float):
+        value = repr(value)
+    text = str(value).replace(',', '').strip()
+    if text.upper() in MISSING:
+        return None
+
+    # Fast path for plain decimals, which is all the extractors produce
+    whole, _, fraction = text.partition('.')
+    negative = whole.startswith('-')
+    digits = whole.lstrip('+-')
+    if (digits or fraction) and (not digits or digits.isdigit()) and (not fraction or fraction.isdigit()) \
+            and len(fraction) <= DECIMALS:
+        scaled = int(digits or 0) * SCALE + int(fraction.ljust(DECIMALS, '0'))
+        return -scaled if negative else scaled
+
+    try:
+        number = Decimal(text)
+    except InvalidOperation:
+        return None
+    if not number.is_finite():
+        return None
+    return int((number * SCALE).quantize(Decimal(1), rounding=ROUND_HALF_EVEN))
+
+
+def to_text(scaled):
+    """Canonical decimal string for a scaled int: two to four decimals, '1234.50'"""
+    if scaled is None:
+        return None
+    if -EXACT_FLOAT < scaled < EXACT_FLOAT:
+        text = '%.4f' % (scaled / SCALE)
+    else:
+        whole, fraction = divmod(abs(scaled), SCALE)
+        text = f"{'-' if scaled < 0 else ''}{whole}.{fraction:04d}"
+    if text.endswith('00'):
+        return text[:-2]
+    if text.endswith('0'):
+        return text[:-1]
+    return text
+
+
+def to_float(scaled):
+    return None if scaled is None else scaled / SCALE
+
+
+class Holding:
+    __slots__ = KNOWN_FIELDS + ('extra',)
+
+    def __init__(self, isin_code, company_name='', current_bal=None, rate=None, value=None,
+                 instrument_type=None, symbol=None, canonical_name=None, extra=None):
+        self.isin_code = isin_code
+        self.company_name = company_name
+        self.current_bal = current_bal
+        self.rate = rate
+        self.value = value
+        self.instrument_type = instrument_type
+        self.symbol = symbol
+        self.canonical_name = canonical_name
+        # Other extractor fields, passed through as they are (None when there are none)
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data.get('isin_code') or '',
+            data.get('company_name') or '',
+            to_scaled(data.get('current_bal')),
+            to_scaled(data.get('rate')),
+            to_scaled(data.get('value')),
+            data.get('instrument_type'),
+            data.get('symbol'),
+            data.get('canonical_name'),
+            {key: value for key, value in data.items() if key not in KNOWN_FIELDS} or None
+        )
+
+    def to_dict(self):
+        """Stored/JSON form: the extractor dict shape with canonical number strings"""
+        data = {
+            'isin_code': self.isin_code,
+            'company_name': self.company_name,
+            'current_bal': to_text(self.current_bal),
+            'rate': to_text(self.rate),
+            'value': to_text(self.value)
+        }
+        for field in ENRICHMENT_FIELDS:
+            extra = getattr(self, field)
+            if extra is not None:
+                data[field] = extra
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def to_row(self):
+        """Positional compact-schema row: [isin, name, current_bal, rate, value] as doubles"""
+        return [self.isin_code, self.company_name,
+                to_float(self.current_bal), to_float(self.rate), to_float(self.value)]
+
+    def __eq__(self, other):
+        if not isinstance(other, Holding):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return (f"Holding({self.isin_code!r}, {self.company_name!r}, {to_text(self.current_bal)}, "
+                f"{to_text(self.rate)}, {to_text(self.value)})")
+
+
+def from_dicts(holdings):
+    return [Holding.from_dict(h) for h in holdings]
+
+
+def to_dicts(records):
+    return [record.to_dict() for record in records]
+
+
+def normalise(holdings):
+    """Extractor dicts -> canonical dicts (numbers parsed once, None when missing)"""
+    return [Holding.from_dict(h).to_dict() for h in holdings]
+
+
+def _json_text(scaled):
+    return 'null' if scaled is None else f'"{to_text(scaled)}"'
+
+
+def _json_record(record):
+    parts = [
+        '{"isin_code":', encode_basestring_ascii(record.isin_code),
+        ',"company_name":', encode_basestring_ascii(record.company_name),
+        ',"current_bal":', _json_text(record.current_bal),
+        ',"rate":', _json_text(record.rate),
+        ',"value":', _json_text(record.value)
+    ]
+    for field in ENRICHMENT_FIELDS:
+        extra = getattr(record, field)
+        if extra is not None:
+            parts += [',"', field, '":', encode_basestring_ascii(extra)]
+    for key, value in (record.extra or {}).items():
+        parts += [',', encode_basestring_ascii(key), ':', json.dumps(value)]
+    parts.append('}')
+    return ''.join(parts)
+
+
+def dumps_json(records):
+    """Serialize records as a JSON array of stored-form dicts"""
+    if orjson is not None:
+        return orjson.dumps(to_dicts(records))
+    # Records have a fixed shape, so emit the text directly instead of
+    # building a dict per record for json.dumps
+    return ('[' + ','.join(map(_json_record, records)) + ']').encode('utf-8')
+
+
+def packb(records):
+    """Serialize records as a msgpack array of compact-schema rows"""
+    return msgpack.packb([record.to_row() for record in records], use_bin_type=True)
+
+
+def unpackb(data):
+    """Inverse of packb"""
+    return [Holding(row[0], row[1], *(to_scaled(n) for n in row[2:5])) for row in msgpack.unpackb(data, raw=False)]
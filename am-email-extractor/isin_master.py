@@ -0,0 +1,140 @@
+"""
+ISIN reference index for instrument classification and enrichment
+
+The ISIN master (ISIN_MASTER_PATH, default data/isin_master.csv) is
+loaded once per process into a dict of ISIN -> (type code, symbol, name),
+so classifying a holding is one hash lookup. The repository ships only a
+small sample; deployments generate the full master offline from the NSE
+and AMFI lists with refresh_isin_master.py (~60k instruments, about 10 MB,
+loading in a few hundred ms: benchmarks/bench_isin_master.py). Nothing is
+fetched at runtime.
+
+ISINs missing from the master are classified from the ISIN structure
+(IN, issuer type, 4-character issuer code, 2-digit security type, serial,
+check digit) and the holding's name:
+
+  - INF (mutual fund issuer): an ETF when the name says so (ETF, BeES,
+    Exchange Traded), else a mutual fund
+  - IN + digit (government issuer): an SGB when the name says so (SGB,
+    Sovereign Gold Bond), else a government security
+  - INE (company issuer) by security type: 07/08 debentures and bonds,
+    23 InvIT units, 25 REIT units, anything else equity
+
+Names are only a hint for the master-less case; the master always wins.
+"""
+import os
+import re
+import csv
+import logging
+import threading
+
+ISIN_MASTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'isin_master.csv')
+
+INSTRUMENT_TYPES = ('equity', 'etf', 'mutual_fund', 'bond', 'sgb', 'government_security', 'reit', 'invit')
+_TYPE_CODES = {name: code for code, name in enumerate(INSTRUMENT_TYPES)}
+
+# Instruments published in the event's mutualFunds list; everything else is
+# exchange traded and goes to equities
+FUND_TYPES = {'mutual_fund'}
+
+CSV_FIELDS = ['isin', 'instrument_type', 'symbol', 'name']
+
+# Security type (ISIN characters 8-9) of company-issued instruments
+SECURITY_TYPES = {'07': 'bond', '08': 'bond', '23': 'invit', '25': 'reit'}
+
+ETF_NAME_RE = re.compile(r'\bETF\b|BEES\b|EXCHANGE TRADED', re.IGNORECASE)
+SGB_NAME_RE = re.compile(r'\bSGB|SOVEREIGN GOLD', re.IGNORECASE)
+
+
+def fallback_type(isin, name=None):
+    """Instrument type from the ISIN structure and name, for ISINs not in the master"""
+    name = name or ''
+    if isin.startswith('INF'):
+        return 'etf' if ETF_NAME_RE.search(name) else 'mutual_fund'
+    if len(isin) > 2 and isin[2].isdigit():
+        return 'sgb' if SGB_NAME_RE.search(name) else 'government_security'
+    return SECURITY_TYPES.get(isin[7:9], 'equity')
+
+
+class IsinMaster:
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('ISIN_MASTER_PATH', ISIN_MASTER_PATH)
+        self._index = {}
+
+    def load(self):
+        """Read the master file into the in-memory index; returns the row count"""
+        index = {}
+        strings = {}
+        with open(self.path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                code = _TYPE_CODES.get(row['instrument_type'])
+                if code is None or not row['isin']:
+                    continue
+                # Symbols and names repeat across ISINs of one issuer; share them
+                symbol = strings.setdefault(row['symbol'], row['symbol'])
+                name = strings.setdefault(row['name'], row['name'])
+                index[row['isin']] = (code, symbol, name)
+        self._index = index
+        return len(index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def lookup(self, isin):
+        """{'instrument_type', 'symbol', 'name'} for a known ISIN, else None"""
+        entry = self._index.get(isin)
+        if entry is None:
+            return None
+        return {'instrument_type': INSTRUMENT_TYPES[entry[0]], 'symbol': entry[1], 'name': entry[2]}
+
+    def instrument_type(self, isin, name=None):
+        entry = self._index.get(isin)
+        return INSTRUMENT_TYPES[entry[0]] if entry else fallback_type(isin, name)
+
+    def enrich(self, holdings):
+        """
+        Add instrument_type (always), symbol and canonical_name (when the
+        ISIN is in the master) to each holding, in place
+
+        Returns:
+            The same list
+        """
+        index = self._index
+        for holding in holdings:
+            isin = holding.get('isin_code') or ''
+            entry = index.get(isin)
+            if entry is None:
+                holding['instrument_type'] = fallback_type(isin, holding.get('company_name'))
+                continue
+            holding['instrument_type'] = INSTRUMENT_TYPES[entry[0]]
+            if entry[1]:
+                holding['symbol'] = entry[1]
+            holding['canonical_name'] = entry[2]
+        return holdings
+
+
+# Global instance, loaded on first use
+master_instance = None
+_instance_lock = threading.Lock()
+
+def get_master():
+    global master_instance
+    if master_instance is None:
+        with _instance_lock:
+            if master_instance is None:
+                master = IsinMaster()
+                try:
+                    count = master.load()
+                    logging.info(f"Loaded {count} ISINs from {master.path}")
+                except OSError as e:
+                    logging.warning(f"ISIN master not loaded, classifying by ISIN prefix: {e}")
+                master_instance = master
+    return master_instance
+
+
+def instrument_type(isin, name=None):
+    return get_master().instrument_type(isin, name)
+
+
+def enrich(holdings):
+    return get_master().enrich(holdings)
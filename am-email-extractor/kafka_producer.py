@@ -1,78 +1,394 @@
 import os
-import json
+import time
+import atexit
 import logging
+import threading
+from collections import deque
 from datetime import datetime
 from kafka import KafkaProducer
+import event_codec
+import metrics
+import tracing
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
 
 class NotificationProducer:
     def __init__(self):
         self.bootstrap_servers = os.environ.get('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092')
         self.topic = os.environ.get('KAFKA_TOPIC', 'am-portfolio')
         self.producer = None
-        self._setup_producer()
+
+        # Encoding and client-side batching
+        self.encoding = os.environ.get('KAFKA_EVENT_ENCODING', 'json').lower()
+        try:
+            event_codec.check_encoding(self.encoding)
+        except ValueError as e:
+            logging.warning(f"{e}, using json")
+            self.encoding = 'json'
+        compression = os.environ.get('KAFKA_COMPRESSION_TYPE', 'none').lower()
+        self.compression_type = None if compression in ('', 'none') else compression
+        self.linger_ms = int(os.environ.get('KAFKA_LINGER_MS', 5))
+        self.batch_size = int(os.environ.get('KAFKA_BATCH_SIZE', 16384))
+
+        # Async publish settings
+        self.async_mode = os.environ.get('KAFKA_ASYNC_PUBLISH', 'true').lower() == 'true'
+        self.buffer_size = int(os.environ.get('KAFKA_BUFFER_SIZE', 1000))
+        self.overflow_policy = os.environ.get('KAFKA_OVERFLOW_POLICY', 'drop_oldest').lower()
+        self.block_timeout = float(os.environ.get('KAFKA_BUFFER_BLOCK_TIMEOUT', 1.0))
+        self.flush_timeout = float(os.environ.get('KAFKA_FLUSH_TIMEOUT', 10))
+        self.reconnect_backoff = float(os.environ.get('KAFKA_RECONNECT_BACKOFF', 5))
+
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            logging.warning(f"Unknown KAFKA_OVERFLOW_POLICY '{self.overflow_policy}', using drop_oldest")
+            self.overflow_policy = 'drop_oldest'
+
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {'in_flight': 0, 'acked': 0, 'failed': 0, 'dropped': 0}
+        self._closed = False
+        self._shutdown = threading.Event()
+        self._worker = None
+        self._connect_lock = threading.Lock()
+        self.last_error = None
+
+        # Never connect on the caller's thread: the connector retries in the
+        # background so import and startup don't wait on the broker
+        threading.Thread(target=self._connect_loop, name='kafka-connect', daemon=True).start()
+
+        if self.async_mode:
+            self._worker = threading.Thread(target=self._run, name='kafka-publisher', daemon=True)
+            self._worker.start()
+        atexit.register(self.close)
+
+    def _connect_loop(self):
+        while not self._closed and not self.producer:
+            self._setup_producer()
+            if not self.producer:
+                self._shutdown.wait(self.reconnect_backoff)
 
     def _setup_producer(self):
+        with self._connect_lock:
+            if self.producer or self._closed:
+                return
+            self._connect()
+
+    def _connect(self):
         try:
             self.producer = KafkaProducer(
                 bootstrap_servers=self.bootstrap_servers,
-                value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+                value_serializer=lambda v: event_codec.encode(v, self.encoding),
                 key_serializer=lambda k: k.encode('utf-8') if k else None,
-                retries=3
+                retries=3,
+                compression_type=self.compression_type,
+                linger_ms=self.linger_ms,
+                batch_size=self.batch_size
             )
-            logging.info(f"Connected to Kafka at {self.bootstrap_servers}")
+            self.last_error = None
+            logging.info(f"Connected to Kafka at {self.bootstrap_servers} "
+                         f"(encoding={self.encoding}, compression={self.compression_type or 'none'})")
         except Exception as e:
             logging.error(f"Failed to connect to Kafka: {e}")
+            self.last_error = str(e)
             self.producer = None
 
-    def send_update_event(self, process_id, user_id, broker, portfolio_id, equities, mutual_funds):
+    def build_update_event(self, process_id, user_id, broker, portfolio_id, equities, mutual_funds,
+                           snapshot_version=None):
         """
-        Send a notification event to Kafka with strict schema and headers
+        Build the Kafka record for a portfolio update
+
+        Returns:
+            Dict with 'key', 'value' and 'headers' ready for publish_record
         """
-        if not self.producer:
-            logging.warning("Kafka producer not available, attempting to reconnect...")
-            self._setup_producer()
-            
-        if not self.producer:
-            logging.error("Could not send event: Kafka unavailable")
-            return False
+        payload = self._base_payload(process_id, user_id, broker, portfolio_id)
+        payload["equities"] = equities
+        payload["mutualFunds"] = mutual_funds
+
+        if snapshot_version is not None:
+            payload["eventType"] = "SNAPSHOT"
+            payload["snapshotVersion"] = snapshot_version
+
+        return self._record(payload)
+
+    def build_delta_event(self, process_id, user_id, broker, portfolio_id, delta, snapshot_version,
+                          base_snapshot_id):
+        """
+        Build a record carrying only the holdings that changed since the
+        snapshot `base_snapshot_id` (version snapshot_version - 1)
 
-        timestamp_str = datetime.utcnow().isoformat()
+        Args:
+            delta: Result of portfolio_delta.diff_holdings
+        """
+        payload = self._base_payload(process_id, user_id, broker, portfolio_id)
+        payload.update({
+            "eventType": "DELTA",
+            "snapshotVersion": snapshot_version,
+            "baseSnapshotId": base_snapshot_id,
+            "added": delta['added'],
+            "changed": delta['changed'],
+            "removed": delta['removed']
+        })
+        return self._record(payload)
 
-        # Construct specific payload
-        payload = {
+    def _base_payload(self, process_id, user_id, broker, portfolio_id):
+        return {
             "id": process_id,
             "userId": user_id,
             "brokerType": broker.upper(),
             "portfolioId": portfolio_id,
-            "timestamp": timestamp_str,
-            "equities": equities,
-            "mutualFunds": mutual_funds
+            "timestamp": datetime.utcnow().isoformat()
         }
 
+    def _record(self, payload):
         # Required headers (Byte arrays)
         headers = [
-            ('id', process_id.encode('utf-8')),
-            ('userId', user_id.encode('utf-8')),
-            ('timestamp', timestamp_str.encode('utf-8'))
-        ]
+            ('id', payload["id"].encode('utf-8')),
+            ('userId', payload["userId"].encode('utf-8')),
+            ('timestamp', payload["timestamp"].encode('utf-8'))
+        ] + event_codec.headers(self.encoding)
+
+        if "eventType" in payload:
+            headers.append(('eventType', payload["eventType"].encode('utf-8')))
+
+        return {'key': payload["id"], 'value': payload, 'headers': headers}
+
+    def send_update_event(self, process_id, user_id, broker, portfolio_id, equities, mutual_funds):
+        """
+        Send a notification event to Kafka with strict schema and headers
+
+        In async mode the event is buffered and True means it was accepted for
+        delivery; the outcome is recorded by the delivery callbacks.
+        """
+        record = self.build_update_event(process_id, user_id, broker, portfolio_id, equities, mutual_funds)
+        return self.publish_record(record)
+
+    def publish_record(self, record):
+        """Publish a record built by build_update_event"""
+        if self.async_mode:
+            return self._enqueue(record)
+
+        if not self._ensure_producer():
+            logging.error("Could not send event: Kafka unavailable")
+            return False
 
         try:
-            future = self.producer.send(
-                topic=self.topic, 
-                key=process_id, 
-                value=payload, 
-                headers=headers
-            )
+            future = self._send(record)
             # Block for result to ensure delivery
             record_metadata = future.get(timeout=10)
-            logging.info(f"Event sent to {record_metadata.topic}:{record_metadata.partition} with key {process_id}")
+            logging.info(f"Event sent to {record_metadata.topic}:{record_metadata.partition} with key {record['key']}")
             return True
         except Exception as e:
             logging.error(f"Failed to send Kafka event: {e}")
             return False
 
-# Global instance
-producer_instance = NotificationProducer()
+    def publish_batch(self, records, timeout=None):
+        """
+        Publish many records and wait for all acks (used by the outbox relay)
+
+        Records are handed to the client back to back so they share request
+        batches; the call then waits once for the whole set. Each record is
+        settled on its own: when the flush times out, the records acked so
+        far are still reported as delivered and only the rest as failed.
+
+        Returns:
+            List of booleans, one per record, True when the broker acked it
+        """
+        if not records:
+            return []
+
+        if not self._ensure_producer():
+            logging.error(f"Could not publish batch of {len(records)}: Kafka unavailable")
+            return [False] * len(records)
+
+        futures = []
+        for record in records:
+            try:
+                futures.append(self._send(record))
+            except Exception as e:
+                logging.error(f"Failed to send Kafka event {record['key']}: {e}")
+                futures.append(None)
+
+        try:
+            self.producer.flush(timeout=timeout or self.flush_timeout)
+        except Exception as e:
+            # KafkaTimeoutError: some records are still in flight
+            logging.error(f"Kafka flush of {len(records)} events incomplete: {e}")
+
+        results = []
+        for record, future in zip(records, futures):
+            if future is None:
+                results.append(False)
+            elif not future.is_done:
+                logging.error(f"Kafka event {record['key']} not acked before the flush timeout")
+                results.append(False)
+            elif future.failed():
+                logging.error(f"Failed to send Kafka event {record['key']}: {future.exception}")
+                results.append(False)
+            else:
+                results.append(True)
+        return results
+
+    def _ensure_producer(self):
+        if not self.producer:
+            logging.warning("Kafka producer not available, attempting to reconnect...")
+            self._setup_producer()
+        return self.producer is not None
+
+    def _send(self, record):
+        broker = (record['value'].get('brokerType') or '').lower() or None
+        t0 = time.perf_counter()
+        with tracing.span('kafka.send', broker=broker, topic=self.topic):
+            future = self.producer.send(
+                topic=self.topic,
+                key=record['key'],
+                value=record['value'],
+                headers=[(name, value) for name, value in record['headers']]
+            )
+        # kafka_send covers send to broker acknowledgement, recorded from the
+        # producer's I/O thread
+        future.add_callback(lambda _: metrics.registry.observe_stage(
+            'kafka_send', time.perf_counter() - t0, broker))
+        future.add_errback(lambda _: metrics.registry.observe_stage(
+            'kafka_send', time.perf_counter() - t0, broker, error=True))
+        return future
+
+    # ------------------------------------------------------------------
+    # Async mode
+    # ------------------------------------------------------------------
+
+    def _enqueue(self, record):
+        """Add a record to the bounded buffer, applying the overflow policy"""
+        with self._cond:
+            if self._closed:
+                logging.error("Could not send event: producer is shut down")
+                return False
+
+            if len(self._buffer) >= self.buffer_size:
+                if self.overflow_policy == 'drop_oldest':
+                    dropped = self._buffer.popleft()
+                    self._incr('dropped')
+                    logging.warning(f"Kafka buffer full, dropped oldest event {dropped['key']}")
+                elif self.overflow_policy == 'drop_newest':
+                    self._incr('dropped')
+                    logging.warning(f"Kafka buffer full, dropped event {record['key']}")
+                    return False
+                else:
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._buffer) >= self.buffer_size and not self._closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._incr('dropped')
+                            logging.warning(f"Kafka buffer full after {self.block_timeout}s, dropped event {record['key']}")
+                            return False
+                        self._cond.wait(remaining)
+
+            self._buffer.append(record)
+            self._cond.notify_all()
+            return True
+
+    def _run(self):
+        """Worker loop: connect, then hand buffered records to the Kafka client"""
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if not self._buffer and self._closed:
+                    return
+
+            if not self.producer:
+                # The connector thread owns (re)connection; keep buffering until it succeeds
+                if self._closed:
+                    return
+                self._shutdown.wait(0.5)
+                continue
+
+            with self._cond:
+                if not self._buffer:
+                    continue
+                record = self._buffer.popleft()
+                self._cond.notify_all()
+
+            key = record['key']
+            try:
+                self._incr('in_flight')
+                future = self._send(record)
+                future.add_callback(self._on_delivery, key)
+                future.add_errback(self._on_error, key)
+            except Exception as e:
+                self._on_error(key, e)
+
+    def _on_delivery(self, key, record_metadata):
+        self._incr('in_flight', -1)
+        self._incr('acked')
+        logging.info(f"Event sent to {record_metadata.topic}:{record_metadata.partition} with key {key}")
+
+    def _on_error(self, key, exc):
+        self._incr('in_flight', -1)
+        self._incr('failed')
+        logging.error(f"Failed to send Kafka event {key}: {exc}")
+
+    def _incr(self, name, amount=1):
+        with self._metrics_lock:
+            self._metrics[name] += amount
+
+    def metrics(self):
+        """Snapshot of publish counters"""
+        with self._metrics_lock:
+            stats = dict(self._metrics)
+        with self._cond:
+            stats['buffered'] = len(self._buffer)
+        stats['connected'] = self.producer is not None
+        return stats
+
+    def state(self):
+        """Connection state for health checks"""
+        if self._closed:
+            state = 'closed'
+        elif self.producer is not None:
+            state = 'connected'
+        else:
+            state = 'connecting'
+        return {
+            'state': state,
+            'bootstrap_servers': self.bootstrap_servers,
+            'async': self.async_mode,
+            'last_error': self.last_error,
+            'metrics': self.metrics()
+        }
+
+    def close(self):
+        """Drain the buffer, flush in-flight records and close the client"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._shutdown.set()
+
+        if self._worker:
+            self._worker.join(timeout=self.flush_timeout)
+            with self._cond:
+                if self._buffer:
+                    logging.error(f"Discarding {len(self._buffer)} unsent Kafka events on shutdown")
+                    self._incr('failed', len(self._buffer))
+                    self._buffer.clear()
+
+        if self.producer:
+            try:
+                self.producer.flush(timeout=self.flush_timeout)
+                self.producer.close(timeout=self.flush_timeout)
+            except Exception as e:
+                logging.error(f"Error closing Kafka producer: {e}")
+
+# Global instance, created on first use
+producer_instance = None
+_instance_lock = threading.Lock()
 
 def get_producer():
+    global producer_instance
+    if producer_instance is None:
+        with _instance_lock:
+            if producer_instance is None:
+                producer_instance = NotificationProducer()
     return producer_instance
@@ -1,38 +1,335 @@
+"""
+Kafka event consumer for portfolio update events
+
+Consumes the extraction event stream in batches as part of a consumer
+group, so more instances can be started to scale horizontally. Offsets are
+committed manually after each batch has been handled; a failing batch is
+rewound and retried. Events are decoded according to their contentType
+header (see event_codec.py).
+
+A poison record can't halt its partition: a record that doesn't decode,
+and, once a batch has failed --max-retries times, each event the handler
+still fails on when given alone, is sent to the dead-letter topic (with
+dlqReason and dlqSource headers) or, without one, logged and skipped.
+
+The handler is pluggable: any callable taking a list of event dicts
+({'topic', 'partition', 'offset', 'key', 'headers', 'value'}), given as
+'module:function'. The default prints each event.
+
+Per-partition lag and processing rate are logged periodically and, with
+--stats-port, served as JSON over HTTP.
+
+    python listen_for_events.py --topic am-portfolio --group am-portfolio-consumers \
+        --handler mypackage.handlers:handle_batch --stats-port 9102
+"""
 import os
 import json
-import sys
-from kafka import KafkaConsumer
+import time
+import logging
+import argparse
+import importlib
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from kafka import KafkaConsumer, KafkaProducer
+from dotenv import load_dotenv
+import event_codec
 
-# Configuration
-TOPIC = 'portfolio_updates'
-BOOTSTRAP_SERVERS = 'localhost:9092'
 
-def listen():
-    print(f"--- Kafka Event Listener ---")
-    print(f"Connecting to Kafka at {BOOTSTRAP_SERVERS}...")
-    
-    try:
-        consumer = KafkaConsumer(
-            TOPIC,
-            bootstrap_servers=BOOTSTRAP_SERVERS,
-            auto_offset_reset='latest',
-            value_deserializer=lambda x: json.loads(x.decode('utf-8'))
-        )
-        print(f"Listening for events on topic '{TOPIC}'...")
-        print("Waiting for API to send an event (Ctrl+C to stop)...")
+def print_events(events):
+    """Default handler: print each event as it arrives"""
+    for event in events:
+        print("\n[RECEIVED EVENT]")
+        print(f"{event['topic']}[{event['partition']}]@{event['offset']} key={event['key']}")
+        print(json.dumps(event['value'], indent=2, default=str))
         print("-" * 30)
 
-        for message in consumer:
-            event = message.value
-            print("\n[RECEIVED EVENT]")
-            print(json.dumps(event, indent=2))
-            print("-" * 30)
-            
+
+def load_handler(spec):
+    """Resolve a 'module:function' handler spec"""
+    if not spec:
+        return print_events
+    module_name, _, func_name = spec.partition(':')
+    if not func_name:
+        raise ValueError(f"Handler must be given as 'module:function', got '{spec}'")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+class EventConsumer:
+    def __init__(self, topic, group_id, bootstrap_servers, handler=print_events,
+                 max_poll_records=500, poll_timeout_ms=1000, auto_offset_reset='latest',
+                 stats_interval=30, retry_backoff=5, max_retries=3, dead_letter_topic=None):
+        self.topic = topic
+        self.group_id = group_id
+        self.bootstrap_servers = bootstrap_servers
+        self.handler = handler
+        self.max_poll_records = max_poll_records
+        self.poll_timeout_ms = poll_timeout_ms
+        self.auto_offset_reset = auto_offset_reset
+        self.stats_interval = stats_interval
+        self.retry_backoff = retry_backoff
+        self.max_retries = max_retries
+        self.dead_letter_topic = dead_letter_topic
+
+        self.consumer = None
+        self.dead_letter_producer = None
+        # Failed attempts at the batch starting at each (partition, offset)
+        self._attempts = {}
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._processed = 0
+        self._failed_batches = 0
+        self._dead_lettered = 0
+        # Per "topic-partition": events handled, this rate window's count, rate and lag
+        self._partition_processed = {}
+        self._window_start = time.monotonic()
+        self._window_counts = {}
+        self._rates = {}
+        self._lag = {}
+
+    def _connect(self):
+        self.consumer = KafkaConsumer(
+            self.topic,
+            bootstrap_servers=self.bootstrap_servers,
+            group_id=self.group_id,
+            enable_auto_commit=False,
+            auto_offset_reset=self.auto_offset_reset,
+            max_poll_records=self.max_poll_records
+        )
+
+    @staticmethod
+    def _decode(message):
+        headers = {name: value.decode('utf-8', 'replace') for name, value in message.headers or []}
+        return {
+            'topic': message.topic,
+            'partition': message.partition,
+            'offset': message.offset,
+            'key': message.key.decode('utf-8') if message.key else None,
+            'headers': headers,
+            'value': event_codec.decode(message.value, headers.get('contentType'))
+        }
+
+    def run(self):
+        """Poll, handle and commit batches until stop() is called"""
+        self._connect()
+        logging.info(f"Consuming '{self.topic}' as group '{self.group_id}' from {self.bootstrap_servers}")
+        last_stats = time.monotonic()
+
+        try:
+            while not self._stop.is_set():
+                records = self.consumer.poll(timeout_ms=self.poll_timeout_ms, max_records=self.max_poll_records)
+                if records:
+                    self._process(records)
+                else:
+                    # Let the rates fall to zero when traffic stops
+                    self._record_processed([])
+
+                if time.monotonic() - last_stats >= self.stats_interval:
+                    self._update_lag()
+                    logging.info(f"Consumer stats: {json.dumps(self.stats())}")
+                    last_stats = time.monotonic()
+        finally:
+            self.consumer.close()
+            if self.dead_letter_producer is not None:
+                self.dead_letter_producer.close()
+
+    def _process(self, records):
+        events = []
+        sources = []
+        poisoned = []
+        for messages in records.values():
+            for message in messages:
+                try:
+                    events.append(self._decode(message))
+                    sources.append(message)
+                except Exception as e:
+                    poisoned.append((message, f"decode failed: {e}"))
+
+        starts = [(tp, messages[0].offset) for tp, messages in records.items()]
+        try:
+            if events:
+                self.handler(events)
+        except Exception as e:
+            for start in starts:
+                self._attempts[start] = self._attempts.get(start, 0) + 1
+            attempts = max(self._attempts[start] for start in starts)
+            with self._stats_lock:
+                self._failed_batches += 1
+            if attempts < self.max_retries:
+                logging.error(f"Handler failed for batch of {len(events)} events (attempt {attempts}): {e}")
+                self._rewind(records)
+                return
+            logging.error(f"Handler failed {attempts} times for batch of {len(events)} events, "
+                          f"retrying its events one by one: {e}")
+            events, failed = self._handle_individually(events, sources)
+            poisoned.extend(failed)
+
+        try:
+            for message, reason in poisoned:
+                self._dead_letter(message, reason)
+        except Exception as e:
+            # The batch is redelivered, so nothing is skipped without a trace
+            logging.error(f"Could not dead-letter {len(poisoned)} events: {e}")
+            self._rewind(records)
+            return
+
+        for start in starts:
+            self._attempts.pop(start, None)
+        self.consumer.commit()
+        self._record_processed(events)
+
+    def _rewind(self, records):
+        """Seek back so the same batch is redelivered; nothing was committed"""
+        for tp, messages in records.items():
+            self.consumer.seek(tp, messages[0].offset)
+        self._stop.wait(self.retry_backoff)
+
+    def _handle_individually(self, events, sources):
+        """
+        Run the handler on each event alone
+
+        Returns:
+            (handled events, [(message, reason)] for the events that failed)
+        """
+        handled = []
+        failed = []
+        for event, message in zip(events, sources):
+            try:
+                self.handler([event])
+                handled.append(event)
+            except Exception as e:
+                failed.append((message, f"handler failed: {e}"))
+        return handled, failed
+
+    def _dead_letter(self, message, reason):
+        """Send a record that can't be handled to the dead-letter topic, or log and skip it"""
+        source = f"{message.topic}-{message.partition}@{message.offset}"
+        with self._stats_lock:
+            self._dead_lettered += 1
+        if not self.dead_letter_topic:
+            logging.error(f"Skipping event {source}: {reason}")
+            return
+
+        if self.dead_letter_producer is None:
+            self.dead_letter_producer = KafkaProducer(bootstrap_servers=self.bootstrap_servers)
+        headers = list(message.headers or []) + [
+            ('dlqReason', reason.encode('utf-8')),
+            ('dlqSource', source.encode('utf-8'))
+        ]
+        self.dead_letter_producer.send(self.dead_letter_topic, key=message.key, value=message.value,
+                                       headers=headers).get(timeout=10)
+        logging.error(f"Event {source} sent to {self.dead_letter_topic}: {reason}")
+
+    def _record_processed(self, events):
+        with self._stats_lock:
+            for event in events:
+                key = f"{event['topic']}-{event['partition']}"
+                self._partition_processed[key] = self._partition_processed.get(key, 0) + 1
+                self._window_counts[key] = self._window_counts.get(key, 0) + 1
+            self._processed += len(events)
+            elapsed = time.monotonic() - self._window_start
+            if elapsed >= 1.0:
+                # Assigned partitions without events in the window report zero
+                self._rates = {key: self._window_counts.get(key, 0) / elapsed
+                               for key in set(self._lag) | set(self._window_counts)}
+                self._window_start = time.monotonic()
+                self._window_counts = {}
+
+    def _update_lag(self):
+        assigned = list(self.consumer.assignment())
+        if not assigned:
+            return
+        end_offsets = self.consumer.end_offsets(assigned)
+        lag = {}
+        for tp in assigned:
+            position = self.consumer.position(tp)
+            lag[f"{tp.topic}-{tp.partition}"] = max(0, end_offsets.get(tp, position) - position)
+        with self._stats_lock:
+            self._lag = lag
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'topic': self.topic,
+                'group_id': self.group_id,
+                'processed': self._processed,
+                'failed_batches': self._failed_batches,
+                'dead_lettered': self._dead_lettered,
+                'events_per_sec': round(sum(self._rates.values()), 2),
+                'total_lag': sum(self._lag.values()),
+                'partitions': {
+                    key: {
+                        'lag': self._lag.get(key),
+                        'events_per_sec': round(self._rates.get(key, 0.0), 2),
+                        'processed': self._partition_processed.get(key, 0)
+                    }
+                    for key in sorted(set(self._lag) | set(self._rates) | set(self._partition_processed))
+                }
+            }
+
+    def stop(self):
+        self._stop.set()
+
+
+def serve_stats(consumer, port):
+    """Serve consumer.stats() as JSON on a background thread"""
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(consumer.stats()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(('0.0.0.0', port), StatsHandler)
+    threading.Thread(target=server.serve_forever, name='consumer-stats', daemon=True).start()
+    return server
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--topic', default=os.environ.get('KAFKA_TOPIC', 'am-portfolio'))
+    parser.add_argument('--group', default=os.environ.get('KAFKA_CONSUMER_GROUP_ID', 'am-portfolio-consumers'))
+    parser.add_argument('--bootstrap-servers', default=os.environ.get('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092'))
+    parser.add_argument('--handler', default=os.environ.get('KAFKA_EVENT_HANDLER'))
+    parser.add_argument('--max-poll-records', type=int, default=int(os.environ.get('KAFKA_MAX_POLL_RECORDS', 500)))
+    parser.add_argument('--offset-reset', default=os.environ.get('KAFKA_AUTO_OFFSET_RESET', 'latest'))
+    parser.add_argument('--max-retries', type=int, default=int(os.environ.get('KAFKA_CONSUMER_MAX_RETRIES', 3)),
+                        help='Attempts at a failing batch before its events are retried one by one')
+    parser.add_argument('--dead-letter-topic', default=os.environ.get('KAFKA_DEAD_LETTER_TOPIC'),
+                        help='Topic for events that cannot be handled (default: log and skip them)')
+    parser.add_argument('--stats-interval', type=float, default=30)
+    parser.add_argument('--stats-port', type=int, default=int(os.environ.get('KAFKA_CONSUMER_STATS_PORT', 0)))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+
+    consumer = EventConsumer(
+        topic=args.topic,
+        group_id=args.group,
+        bootstrap_servers=args.bootstrap_servers,
+        handler=load_handler(args.handler),
+        max_poll_records=args.max_poll_records,
+        auto_offset_reset=args.offset_reset,
+        stats_interval=args.stats_interval,
+        max_retries=args.max_retries,
+        dead_letter_topic=args.dead_letter_topic
+    )
+    if args.stats_port:
+        serve_stats(consumer, args.stats_port)
+
+    try:
+        consumer.run()
     except KeyboardInterrupt:
         print("\nStopping listener.")
     except Exception as e:
         print(f"\nError: {e}")
         print("Make sure Docker is running: docker-compose up")
 
+
 if __name__ == "__main__":
-    listen()
+    main()
@@ -0,0 +1,237 @@
+"""
+Per-stage latency and volume metrics in Prometheus format
+
+Stages of an extraction are timed with `stage()`:
+
+    jwt_decode, admission_wait, cache_lookup, credential_load,
+    credential_refresh, gmail_search, message_fetch, attachment_download,
+    pdf_open, excel_read, text_extraction, line_parsing, mongo_write, kafka_send,
+    parse_pool (the ASGI mode's wait for a parser process)
+
+and recorded in one histogram labelled by stage and broker, so
+histogram_quantile(0.99, ...) by (stage, broker) shows which stage dominates
+p99 for each broker. Failures are counted per stage, and statement bytes and
+PDF pages are counted per broker. Requests turned away by admission control
+are counted per reason, and result cache lookups per broker and outcome.
+
+The broker label comes from the `broker` argument or the current context
+(`bind_broker`, set by the API once the request's broker is known), so
+library code such as gmail_integration doesn't need to pass it around.
+
+Uses prometheus_client when installed; otherwise a minimal built-in
+registry renders the same text exposition format.
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; statement extraction spans milliseconds (JWT) to tens of seconds (large PDFs)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_broker = contextvars.ContextVar('metrics_broker', default=None)
+
+# Stage -> per-extraction cost field stored with the snapshot (cost_stats.py)
+COST_STAGES = {
+    'credential_load': 'gmail_ms',
+    'credential_refresh': 'gmail_ms',
+    'gmail_search': 'gmail_ms',
+    'message_fetch': 'gmail_ms',
+    'attachment_download': 'gmail_ms',
+    'pdf_open': 'parse_ms',
+    'excel_read': 'parse_ms',
+    'text_extraction': 'parse_ms',
+    'line_parsing': 'parse_ms',
+}
+_costs = contextvars.ContextVar('extraction_costs', default=None)
+
+
+class _Family:
+    """Fallback labelled counter/histogram with Prometheus text rendering"""
+
+    def __init__(self, name, documentation, labelnames, kind, buckets=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.kind = kind
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def observe(self, labels, value):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            for labels, value in items:
+                label_text = ','.join(f'{k}="{v}"' for k, v in zip(self.labelnames, labels))
+                if self.kind == 'counter':
+                    lines.append(f'{self.name}_total{{{label_text}}} {value}')
+                    continue
+                counts, total, count = value
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+                lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self._families = []
+        self.stage_seconds = self._histogram(
+            'extraction_stage_seconds', 'Latency of each extraction stage', ('stage', 'broker'))
+        self.stage_errors = self._counter(
+            'extraction_stage_errors', 'Failures per extraction stage', ('stage', 'broker'))
+        self.statement_bytes = self._counter(
+            'extraction_statement_bytes', 'Statement attachment bytes processed', ('broker', 'source'))
+        self.pdf_pages = self._counter(
+            'extraction_pdf_pages', 'PDF pages text-extracted', ('broker',))
+        self.holdings = self._counter(
+            'extraction_holdings', 'Holdings extracted', ('broker',))
+        self.rejections = self._counter(
+            'extraction_rejected', 'Extraction requests rejected or abandoned by admission control', ('reason',))
+        self.cache_lookups = self._counter(
+            'extraction_result_cache', 'Result cache lookups by outcome (hit, miss)', ('broker', 'outcome'))
+
+    def _histogram(self, name, documentation, labelnames):
+        if prometheus_client is not None:
+            return prometheus_client.Histogram(name, documentation, labelnames, buckets=BUCKETS)
+        family = _Family(name, documentation, labelnames, 'histogram', BUCKETS)
+        self._families.append(family)
+        return family
+
+    def _counter(self, name, documentation, labelnames):
+        if prometheus_client is not None:
+            return prometheus_client.Counter(name, documentation, labelnames)
+        family = _Family(name, documentation, labelnames, 'counter')
+        self._families.append(family)
+        return family
+
+    @staticmethod
+    def _inc(metric, labels, amount=1):
+        if prometheus_client is not None:
+            metric.labels(*labels).inc(amount)
+        else:
+            metric.inc(labels, amount)
+
+    def observe_stage(self, stage, seconds, broker=None, error=False):
+        labels = (stage, broker or _broker.get() or 'none')
+        if prometheus_client is not None:
+            self.stage_seconds.labels(*labels).observe(seconds)
+        else:
+            self.stage_seconds.observe(labels, seconds)
+        if error:
+            self._inc(self.stage_errors, labels)
+
+    def render(self):
+        """Prometheus text exposition of all metrics"""
+        if prometheus_client is not None:
+            return prometheus_client.generate_latest()
+        lines = []
+        for family in self._families:
+            lines.extend(family.render())
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+registry = Metrics()
+
+
+@contextmanager
+def stage(name, broker=None):
+    """Time a block as one extraction stage; exceptions are counted and re-raised"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        registry.observe_stage(name, time.perf_counter() - t0, broker, error=True)
+        raise
+    elapsed = time.perf_counter() - t0
+    registry.observe_stage(name, elapsed, broker)
+    if name in COST_STAGES:
+        _add_cost(COST_STAGES[name], elapsed * 1000)
+
+
+def bind_broker(broker):
+    """Label stages in the current context (request or task) with a broker"""
+    _broker.set(broker)
+
+
+def current_broker():
+    return _broker.get() or 'none'
+
+
+def start_costs():
+    """Start accumulating extraction costs in the current context (request or task)"""
+    _costs.set({})
+
+
+def costs():
+    """Costs accumulated since start_costs: bytes, pages, pages_parsed, holdings, parse_ms, gmail_ms"""
+    return {field: round(value, 1) if isinstance(value, float) else value
+            for field, value in (_costs.get() or {}).items()}
+
+
+def add_costs(values):
+    """Add costs measured elsewhere (e.g. in a parser process) to this context's"""
+    for field, value in values.items():
+        _add_cost(field, value)
+
+
+def _add_cost(field, amount):
+    accumulated = _costs.get()
+    if accumulated is not None:
+        accumulated[field] = accumulated.get(field, 0) + amount
+
+
+def add_bytes(count, source, broker=None):
+    registry._inc(registry.statement_bytes, (broker or current_broker(), source), count)
+    _add_cost('bytes', count)
+
+
+def add_pages(count, parsed=None, broker=None):
+    """Count a PDF's pages and how many of them were text-extracted (all by default)"""
+    parsed = count if parsed is None else parsed
+    registry._inc(registry.pdf_pages, (broker or current_broker(),), parsed)
+    _add_cost('pages', count)
+    _add_cost('pages_parsed', parsed)
+
+
+def add_holdings(count, broker=None):
+    registry._inc(registry.holdings, (broker or current_broker(),), count)
+    _add_cost('holdings', count)
+
+
+def add_rejection(reason):
+    """Count a request turned away: queue_full, user_limit, timeout or client_gone"""
+    registry._inc(registry.rejections, (reason,))
+
+
+def add_cache_lookup(hit, broker=None):
+    registry._inc(registry.cache_lookups, (broker or current_broker(), 'hit' if hit else 'miss'))
+
+
+def render():
+    return registry.render()
@@ -0,0 +1,119 @@
+"""
+Outbox relay - publishes rows from the event outbox to Kafka
+
+Snapshots and their Kafka events are written to MongoDB together (see
+Database.save_holdings). This worker claims due outbox rows in batches,
+publishes them, and marks them delivered. Failed rows are retried with
+exponential backoff, so an unavailable broker delays events instead of
+losing them.
+
+Runs as a background thread inside the API, or standalone:
+    python outbox_relay.py
+"""
+import os
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+import database
+import kafka_producer
+
+
+class OutboxRelay:
+    def __init__(self, db=None, producer=None):
+        self.db = db
+        self.producer = producer
+        self.batch_size = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+        self.poll_interval = float(os.environ.get('OUTBOX_POLL_INTERVAL', 1.0))
+        self.lease_seconds = int(os.environ.get('OUTBOX_LEASE_SECONDS', 60))
+        self.max_attempts = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 20))
+        self.retry_backoff = float(os.environ.get('OUTBOX_RETRY_BACKOFF', 2.0))
+        self.max_backoff = float(os.environ.get('OUTBOX_MAX_BACKOFF', 300))
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _get_db(self):
+        return self.db or database.get_db()
+
+    def _get_producer(self):
+        return self.producer or kafka_producer.get_producer()
+
+    def start(self):
+        """Start the relay on a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='outbox-relay', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def run(self):
+        logging.info(f"Outbox relay {self.owner} started")
+        while not self._stop.is_set():
+            try:
+                published = self.run_once()
+            except Exception as e:
+                logging.error(f"Outbox relay error: {e}")
+                published = 0
+
+            # Keep draining while full batches come back
+            if published < self.batch_size:
+                self._stop.wait(self.poll_interval)
+
+    def run_once(self):
+        """
+        Claim one batch, publish it and record the outcome
+
+        Returns:
+            Number of rows claimed
+        """
+        db = self._get_db()
+        rows = db.claim_outbox_batch(self.owner, self.batch_size, self.lease_seconds)
+        if not rows:
+            return 0
+
+        results = self._get_producer().publish_batch(rows)
+
+        delivered = [row['_id'] for row, ok in zip(rows, results) if ok]
+        db.mark_outbox_delivered(delivered)
+
+        for row, ok in zip(rows, results):
+            if ok:
+                continue
+            attempts = row.get('attempts', 0) + 1
+            delay = min(self.retry_backoff * (2 ** (attempts - 1)), self.max_backoff)
+            dead = attempts >= self.max_attempts
+            if dead:
+                logging.error(f"Outbox event {row['key']} failed {attempts} times, giving up")
+            db.mark_outbox_failed(
+                row,
+                error='publish failed',
+                next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+                dead=dead
+            )
+
+        logging.info(f"Outbox relay published {len(delivered)}/{len(rows)} events")
+        return len(rows)
+
+
+# Global instance
+relay_instance = OutboxRelay()
+
+def get_relay():
+    return relay_instance
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+    try:
+        relay_instance.run()
+    except KeyboardInterrupt:
+        print("\nStopping relay.")
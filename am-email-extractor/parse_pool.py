@@ -0,0 +1,41 @@
+"""
+Process pool for statement parsing
+
+Parsing is CPU-bound pure Python (pdfplumber, openpyxl), so threads in one
+process parse one statement at a time. The pool runs PARSE_WORKERS parser
+processes (default: one per core); the batch upload endpoint and the ASGI
+extraction endpoints hand statements to it, so their parsing throughput
+scales with cores.
+
+Workers are spawned, not forked: the parent already runs Mongo, Kafka and
+relay threads, which a forked child would inherit mid-operation. Each
+worker imports the broker extractors once and keeps them warm.
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+WORKERS = int(os.environ.get('PARSE_WORKERS', os.cpu_count() or 2))
+
+
+# Global instance, created on first use
+pool_instance = None
+_instance_lock = threading.Lock()
+
+def get_pool():
+    global pool_instance
+    if pool_instance is None:
+        with _instance_lock:
+            if pool_instance is None:
+                pool_instance = ProcessPoolExecutor(max_workers=WORKERS,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+    return pool_instance
+
+
+def shutdown():
+    global pool_instance
+    with _instance_lock:
+        if pool_instance is not None:
+            pool_instance.shutdown(wait=False, cancel_futures=True)
+            pool_instance = None
@@ -0,0 +1,238 @@
+"""
+Save-and-publish path for extracted holdings
+
+Shared by the API endpoints and background jobs (reparse_statements.py),
+so every snapshot is stored and announced the same way.
+"""
+import os
+import uuid
+from collections import Counter
+import database
+import holding
+import isin_master
+import kafka_producer
+import portfolio_delta
+import snapshot_writer
+
+
+def split_holdings(holdings):
+    """Split holdings into (equities, mutual_funds)"""
+    equities = []
+    mutual_funds = []
+
+    for holding in holdings:
+        # ETFs, SGBs and bonds are exchange traded and count as equities
+        kind = (holding.get('instrument_type')
+                or isin_master.instrument_type(holding.get('isin_code', ''), holding.get('company_name')))
+        if kind in isin_master.FUND_TYPES:
+            mutual_funds.append(holding)
+        else:
+            equities.append(holding)
+
+    return equities, mutual_funds
+
+
+def save_and_publish(user_id, broker, holdings, metadata, wait=True):
+    """
+    Save holdings to MongoDB and publish the portfolio update event
+
+    Holdings are first normalised in place (numbers parsed once into
+    canonical strings, None when missing) and then classified and enriched
+    from the ISIN master (instrument_type, symbol, canonical_name).
+
+    With the outbox enabled the event is stored alongside the snapshot and
+    delivered by the outbox relay; otherwise it is handed to the producer.
+    In delta mode only holdings that changed since the previous snapshot
+    are published, with a full snapshot every KAFKA_FULL_SNAPSHOT_EVERY
+    versions for resync.
+
+    Snapshot versions come from an atomic per-(user, broker) counter
+    (Database.allocate_snapshot_versions), so concurrent extractions never
+    share one. A delta is only published against the version just before
+    it; when another snapshot got in between, the event is a full snapshot.
+
+    wait=False lets bulk callers return as soon as a write-behind snapshot
+    is queued (MONGO_WRITE_BEHIND). Deltas are computed against the last
+    flushed snapshot, so queueing several snapshots for one user and broker
+    without waiting publishes them in full.
+
+    Returns:
+        The inserted document ID
+    """
+    outbox_enabled, event_mode, full_every = event_settings()
+    prepare_holdings(holdings)
+
+    db = database.get_db()
+    producer = kafka_producer.get_producer()
+
+    snapshot_version = None
+    previous = None
+    if event_mode == 'delta':
+        previous = db.get_latest_holdings(user_id, broker, projection={'holdings': 1, 'snapshot_version': 1})
+        snapshot_version = db.allocate_snapshot_versions(user_id, broker, 1, (previous or {}).get('snapshot_version'))
+
+    event_factory = make_event_factory(producer, user_id, broker, holdings, previous, snapshot_version, full_every)
+
+    if outbox_enabled:
+        return db.save_holdings(user_id, broker, holdings, metadata, event_factory=event_factory,
+                                snapshot_version=snapshot_version, wait=wait)
+
+    # Publish only once the snapshot is stored, so consumers can read it
+    try:
+        doc_id = db.save_holdings(user_id, broker, holdings, metadata, snapshot_version=snapshot_version)
+    except snapshot_writer.WriteAckTimeout as e:
+        # Still queued: publish when (and if) the write lands
+        pending_id = e.doc_id
+        e.pending.add_done_callback(
+            lambda error: error is None and _publish(producer, event_factory, pending_id)
+        )
+        raise
+    _publish(producer, event_factory, doc_id)
+    return doc_id
+
+
+def _publish(producer, event_factory, doc_id):
+    record = event_factory(doc_id)
+    if record is not None:
+        producer.publish_record(record)
+
+
+def save_and_publish_batch(user_id, extractions):
+    """
+    Save several extractions of one user with one bulk write, then publish
+    their events (see save_and_publish)
+
+    The snapshots and their outbox rows go through Database.write_batch, in
+    one transaction when available. With the outbox disabled the events are
+    handed to the producer together once the batch is stored.
+
+    Args:
+        extractions: (broker, holdings, metadata) tuples, stored in order;
+            several may share a broker, each becoming the next version
+
+    Returns:
+        The inserted document IDs, in order
+    """
+    outbox_enabled, event_mode, _ = event_settings()
+    db = database.get_db()
+
+    latest = {}
+    versions = {}
+    if event_mode == 'delta':
+        for broker, count in Counter(broker for broker, _, _ in extractions).items():
+            latest[broker] = db.get_latest_holdings(user_id, broker,
+                                                    projection={'holdings': 1, 'snapshot_version': 1})
+            versions[broker] = db.allocate_snapshot_versions(user_id, broker, count,
+                                                             (latest[broker] or {}).get('snapshot_version'))
+
+    items, event_factories = build_batch(db, user_id, extractions, latest, versions)
+    db.write_batch(items)
+    doc_ids = [str(document['_id']) for document, _ in items]
+
+    if not outbox_enabled:
+        producer = kafka_producer.get_producer()
+        for doc_id, event_factory in zip(doc_ids, event_factories):
+            record = event_factory(doc_id)
+            if record is not None:
+                producer.publish_record(record)
+    return doc_ids
+
+
+def build_batch(db, user_id, extractions, latest, versions):
+    """
+    Snapshot items (document, outbox row) and event factories for a batch
+
+    Args:
+        db: Database, for build_snapshot (AsyncDatabase passes its config)
+        latest: Latest stored snapshot per broker in delta mode, else {};
+            updated as the batch is built, so a broker's second statement
+            is diffed against its first
+        versions: First allocated snapshot version per broker in delta
+            mode (one version per statement of that broker), else {}
+
+    Returns:
+        (items for write_batch, event factories), in extraction order
+    """
+    outbox_enabled, event_mode, full_every = event_settings()
+    producer = kafka_producer.get_producer()
+
+    items = []
+    event_factories = []
+    for broker, holdings, metadata in extractions:
+        prepare_holdings(holdings)
+        snapshot_version = None
+        previous = None
+        if event_mode == 'delta':
+            previous = latest.get(broker)
+            snapshot_version = versions[broker]
+            versions[broker] += 1
+
+        event_factory = make_event_factory(producer, user_id, broker, holdings, previous, snapshot_version, full_every)
+        item = db.build_snapshot(user_id, broker, holdings, metadata,
+                                 event_factory if outbox_enabled else None, snapshot_version)
+        if event_mode == 'delta':
+            latest[broker] = {'_id': item[0]['_id'], 'holdings': holdings, 'snapshot_version': snapshot_version}
+        items.append(item)
+        event_factories.append(event_factory)
+    return items, event_factories
+
+
+def event_settings():
+    """(outbox enabled, event mode, full snapshot every N versions)"""
+    # Read per call: importers load .env after importing this module
+    outbox_enabled = os.environ.get('OUTBOX_ENABLED', 'true').lower() == 'true'
+    event_mode = os.environ.get('KAFKA_EVENT_MODE', 'full').lower()  # full | delta
+    full_every = max(1, int(os.environ.get('KAFKA_FULL_SNAPSHOT_EVERY', 20)))
+    return outbox_enabled, event_mode, full_every
+
+
+def prepare_holdings(holdings):
+    """Normalise and enrich extractor holdings in place"""
+    holdings[:] = holding.normalise(holdings)
+    isin_master.enrich(holdings)
+
+
+def make_event_factory(producer, user_id, broker, holdings, previous, snapshot_version, full_every):
+    """
+    Callable building the Kafka record for a new snapshot ID (None when a
+    delta would be empty)
+
+    Args:
+        previous: Latest stored snapshot (holdings, snapshot_version) in
+            delta mode, else None
+    """
+    process_id = str(uuid.uuid4())
+
+    def event_factory(doc_id):
+        # A delta needs the version just before this one as its base
+        full = (
+            previous is None
+            or previous.get('snapshot_version') != snapshot_version - 1
+            or snapshot_version % full_every == 0
+        )
+        if not full:
+            delta = portfolio_delta.diff_holdings(previous['holdings'], holdings)
+            if portfolio_delta.is_empty(delta):
+                return None
+            return producer.build_delta_event(
+                process_id=process_id,
+                user_id=user_id,
+                broker=broker,
+                portfolio_id=doc_id,
+                delta=delta,
+                snapshot_version=snapshot_version,
+                base_snapshot_id=str(previous['_id'])
+            )
+
+        equities, mutual_funds = split_holdings(holdings)
+        return producer.build_update_event(
+            process_id=process_id,
+            user_id=user_id,
+            broker=broker,
+            portfolio_id=doc_id,
+            equities=equities,
+            mutual_funds=mutual_funds,
+            snapshot_version=snapshot_version
+        )
+
+    return event_factory
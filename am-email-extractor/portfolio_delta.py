@@ -0,0 +1,44 @@
+"""
+Holding diffs between consecutive snapshots of the same user and broker
+
+Used to publish delta events (only what changed) instead of the full
+portfolio on every extraction.
+"""
+from event_codec import to_number
+
+# Fields whose change makes a holding "changed"
+COMPARED_FIELDS = ('current_bal', 'rate', 'value')
+
+
+def index_by_isin(holdings):
+    """Map ISIN -> holding; later rows win if a statement repeats an ISIN"""
+    return {h.get('isin_code'): h for h in holdings or [] if h.get('isin_code')}
+
+
+def holding_changed(old, new):
+    for field in COMPARED_FIELDS:
+        if to_number(old.get(field)) != to_number(new.get(field)):
+            return True
+    return old.get('company_name') != new.get('company_name')
+
+
+def diff_holdings(previous, current):
+    """
+    Compare two holdings lists keyed by ISIN
+
+    Returns:
+        Dict with 'added' and 'changed' (lists of current holdings) and
+        'removed' (list of ISINs no longer held)
+    """
+    old = index_by_isin(previous)
+    new = index_by_isin(current)
+
+    added = [h for isin, h in new.items() if isin not in old]
+    changed = [h for isin, h in new.items() if isin in old and holding_changed(old[isin], h)]
+    removed = [isin for isin in old if isin not in new]
+
+    return {'added': added, 'changed': changed, 'removed': removed}
+
+
+def is_empty(delta):
+    return not (delta['added'] or delta['changed'] or delta['removed'])
@@ -0,0 +1,205 @@
+"""
+Consolidated per-user portfolio view across brokers
+
+One document per user in portfolio_views, maintained incrementally on each
+saved snapshot: the broker's previous contribution is subtracted and the
+new one added, per ISIN, with $inc. Only ISINs whose quantity or value
+changed are touched, and reads are a single find_one by user id.
+
+The update only applies while the view still holds the contribution it was
+computed from (matched by its snapshot id). Without a transaction, two
+snapshots for the same broker could otherwise both subtract the same old
+contribution; the one that loses the race re-reads and recomputes.
+
+Document shape:
+    {
+        _id: user_id,
+        positions: {ISIN: {company_name, instrument_type, quantity, value, broker_count}},
+        totals: {value, equity_value, mf_value},
+        brokers: {broker: {snapshot_id, extracted_at, value, holdings_count}},
+        contributions: {broker: {ISIN: [quantity, value, instrument_type]}},
+        updated_at
+    }
+"""
+from datetime import datetime
+from pymongo.errors import DuplicateKeyError
+import isin_master
+from event_codec import to_number
+
+VIEWS_COLLECTION = 'portfolio_views'
+
+# Attempts at folding a snapshot in while concurrent snapshots replace its broker's contribution
+MAX_ATTEMPTS = 5
+
+
+class ViewConflict(Exception):
+    """The broker's contribution kept changing under a snapshot being folded in"""
+
+
+def contribution(holdings):
+    """ISIN -> [quantity, value, instrument_type] for one broker snapshot"""
+    result = {}
+    for holding in holdings:
+        isin = holding.get('isin_code')
+        if not isin:
+            continue
+        quantity = to_number(holding.get('current_bal')) or 0.0
+        value = to_number(holding.get('value')) or 0.0
+        if isin in result:
+            quantity += result[isin][0]
+            value += result[isin][1]
+        kind = holding.get('instrument_type') or isin_master.instrument_type(isin, holding.get('company_name'))
+        result[isin] = [quantity, value, kind]
+    return result
+
+
+def build_update(broker, snapshot, old, new, names):
+    """
+    Mongo update replacing `old` with `new` as this broker's contribution
+
+    Args:
+        broker: Broker name
+        snapshot: Dict with snapshot_id and extracted_at
+        old: Previous contribution (from the view document), may be empty
+        new: Contribution of the new snapshot
+        names: ISIN -> company name for the new snapshot
+    """
+    inc = {}
+    set_fields = {}
+    totals = {'value': 0.0, 'equity_value': 0.0, 'mf_value': 0.0}
+
+    for isin in set(old) | set(new):
+        old_qty, old_value, kind = old.get(isin, (0.0, 0.0, None))
+        new_qty, new_value, new_kind = new.get(isin, (0.0, 0.0, None))
+        kind = new_kind or kind
+
+        if isin in new and isin not in old:
+            inc[f'positions.{isin}.broker_count'] = 1
+        elif isin in old and isin not in new:
+            inc[f'positions.{isin}.broker_count'] = -1
+
+        if new_qty != old_qty:
+            inc[f'positions.{isin}.quantity'] = new_qty - old_qty
+        if new_value != old_value:
+            delta = new_value - old_value
+            inc[f'positions.{isin}.value'] = delta
+            totals['value'] += delta
+            totals['mf_value' if kind in isin_master.FUND_TYPES else 'equity_value'] += delta
+
+        if isin in new and (isin not in old or new_qty != old_qty or new_value != old_value):
+            set_fields[f'positions.{isin}.company_name'] = names.get(isin, '')
+            set_fields[f'positions.{isin}.instrument_type'] = kind
+
+    for name, delta in totals.items():
+        if delta:
+            inc[f'totals.{name}'] = delta
+
+    set_fields[f'contributions.{broker}'] = new
+    set_fields[f'brokers.{broker}'] = {
+        'snapshot_id': snapshot['snapshot_id'],
+        'extracted_at': snapshot['extracted_at'],
+        'value': sum(entry[1] for entry in new.values()),
+        'holdings_count': len(new)
+    }
+    set_fields['updated_at'] = datetime.utcnow()
+
+    update = {'$set': set_fields}
+    if inc:
+        update['$inc'] = inc
+    return update
+
+
+def apply_snapshot(db, document, session=None):
+    """Fold a saved snapshot document into the user's consolidated view"""
+    collection = db[VIEWS_COLLECTION]
+    for _ in range(MAX_ATTEMPTS):
+        existing = collection.find_one({'_id': document['user_id']}, contribution_projection(document),
+                                       session=session)
+        try:
+            result = collection.update_one(contribution_filter(document, existing),
+                                           snapshot_update(document, existing), upsert=existing is None,
+                                           session=session)
+        except DuplicateKeyError:
+            # Another snapshot created the view first. In a transaction the
+            # error aborts it, and with_transaction retries the whole write
+            if session is not None:
+                raise
+            continue
+        if applied(existing, result):
+            return
+    raise conflict(document)
+
+
+def contribution_projection(document):
+    """Projection reading only the snapshot's broker contribution (and its snapshot id) from a view"""
+    broker = document['broker']
+    return {f'contributions.{broker}': 1, f'brokers.{broker}.snapshot_id': 1}
+
+
+def contribution_filter(document, existing):
+    """
+    Filter matching the view only while it holds the contribution read as
+    `existing` (None when the user has no view yet, which is then upserted)
+    """
+    if existing is None:
+        return {'_id': document['user_id']}
+    broker = document['broker']
+    snapshot_id = ((existing.get('brokers') or {}).get(broker) or {}).get('snapshot_id')
+    return {
+        '_id': document['user_id'],
+        f'brokers.{broker}.snapshot_id': snapshot_id if snapshot_id is not None else {'$exists': False}
+    }
+
+
+def applied(existing, result):
+    """Whether an update_one with contribution_filter found the contribution it was computed from"""
+    return existing is None or result.matched_count > 0
+
+
+def conflict(document):
+    return ViewConflict(f"Consolidated view of {document['user_id']} kept changing, "
+                        f"{document['broker']} snapshot {document['_id']} not applied")
+
+
+def snapshot_update(document, existing):
+    """Update folding a snapshot into the view, given the view read with contribution_projection"""
+    broker = document['broker']
+    old = ((existing or {}).get('contributions') or {}).get(broker, {})
+    new = contribution(document['holdings'])
+    names = {h['isin_code']: h.get('company_name', '') for h in document['holdings'] if h.get('isin_code')}
+    return build_update(
+        broker,
+        {'snapshot_id': str(document['_id']), 'extracted_at': document['extracted_at']},
+        old, new, names
+    )
+
+
+def render(view):
+    """Client-facing form of a view document (open positions, rounded)"""
+    positions = []
+    for isin, position in (view.get('positions') or {}).items():
+        if position.get('broker_count', 0) <= 0:
+            continue
+        positions.append({
+            'isin_code': isin,
+            'company_name': position.get('company_name', ''),
+            'instrument_type': position.get('instrument_type'),
+            'quantity': round(position.get('quantity', 0.0), 4),
+            'value': round(position.get('value', 0.0), 2)
+        })
+    positions.sort(key=lambda p: p['value'], reverse=True)
+
+    totals = {name: round(amount, 2) for name, amount in (view.get('totals') or {}).items()}
+    brokers = view.get('brokers') or {}
+    for info in brokers.values():
+        info['value'] = round(info.get('value', 0.0), 2)
+        if isinstance(info.get('extracted_at'), datetime):
+            info['extracted_at'] = info['extracted_at'].isoformat()
+
+    return {
+        'totals': totals,
+        'brokers': brokers,
+        'count': len(positions),
+        'positions': positions,
+        'updated_at': view['updated_at'].isoformat() if view.get('updated_at') else None
+    }
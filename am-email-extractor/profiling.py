@@ -0,0 +1,280 @@
+"""
+On-demand profiling of single extraction requests
+
+An admin can ask for one extraction to run under a profiler, either with
+the X-Profile header or a `profile` claim in their JWT:
+
+    X-Profile: cprofile     deterministic, every call (pstats file)
+    X-Profile: sample       statistical, stack samples every
+                            PROFILE_SAMPLE_INTERVAL_MS (folded stacks,
+                            the input format of flamegraph.pl/speedscope)
+
+Besides the profile, the run records anonymized layout stats for every PDF
+page it reads: object counts (chars, lines, rects, curves, images, fonts),
+page size, extracted text length and extraction time, never the text. That
+is enough to spot pathological pdfminer layouts without copying statements.
+
+Profiles are kept in a bounded store (PROFILE_DIR, at most
+PROFILE_MAX_COUNT, oldest evicted) shared by all workers on the host.
+Only one cProfile run can be active per process, so a request arriving
+while another is profiled runs unprofiled.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import pstats
+import marshal
+import hashlib
+import logging
+import cProfile
+import threading
+import contextvars
+from collections import Counter
+from datetime import datetime
+
+MODES = ('cprofile', 'sample')
+
+_collector = contextvars.ContextVar('profile_collector', default=None)
+
+
+def is_admin(jwt_payload):
+    """Admin JWTs carry role=admin, admin=true or 'admin' in roles"""
+    if not jwt_payload:
+        return False
+    roles = jwt_payload.get('roles') or []
+    return jwt_payload.get('role') == 'admin' or jwt_payload.get('admin') is True \
+        or (isinstance(roles, list) and 'admin' in roles)
+
+
+def requested_mode(headers, jwt_payload):
+    """Profiling mode asked for by an admin request, or None"""
+    value = headers.get('X-Profile') or (jwt_payload or {}).get('profile')
+    if not value or not is_admin(jwt_payload):
+        return None
+    if value is True or str(value).lower() in ('1', 'true'):
+        return 'cprofile'
+    value = str(value).lower()
+    return value if value in MODES else None
+
+
+class PageStats:
+    """Anonymized per-page layout stats for the statement being profiled"""
+
+    def __init__(self):
+        self.pages = []
+
+    def add_page(self, page, seconds, text_length):
+        self.pages.append({
+            'page': len(self.pages) + 1,
+            'width': round(float(page.width), 1),
+            'height': round(float(page.height), 1),
+            'chars': len(page.chars),
+            'lines': len(page.lines),
+            'rects': len(page.rects),
+            'curves': len(page.curves),
+            'images': len(page.images),
+            'fonts': len({char.get('fontname') for char in page.chars}),
+            'text_length': text_length,
+            'extract_ms': round(seconds * 1000, 2)
+        })
+
+    def summary(self):
+        if not self.pages:
+            return {'pages': 0}
+        slowest = max(self.pages, key=lambda p: p['extract_ms'])
+        return {
+            'pages': len(self.pages),
+            'extract_ms': round(sum(p['extract_ms'] for p in self.pages), 2),
+            'chars': sum(p['chars'] for p in self.pages),
+            'curves': sum(p['curves'] for p in self.pages),
+            'rects': sum(p['rects'] for p in self.pages),
+            'slowest_page': slowest['page'],
+            'slowest_page_ms': slowest['extract_ms']
+        }
+
+
+def page_collector():
+    """PageStats of the profiled request in this context, else None"""
+    return _collector.get()
+
+
+class StackSampler:
+    """Samples one thread's stack at a fixed interval into folded stacks"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common()).encode('utf-8')
+
+
+class ProfileStore:
+    def __init__(self, root=None, max_count=None):
+        self.root = root or os.environ.get('PROFILE_DIR', 'profiles')
+        self.max_count = max_count or int(os.environ.get('PROFILE_MAX_COUNT', 50))
+        self._lock = threading.Lock()
+
+    def _path(self, profile_id, suffix):
+        return os.path.join(self.root, f"{profile_id}{suffix}")
+
+    def save(self, meta, data, suffix):
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(self._path(meta['id'], suffix), 'wb') as f:
+                f.write(data)
+            # Metadata last: a profile is listed only once its data is complete
+            with open(self._path(meta['id'], '.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, default=str)
+            self._evict()
+
+    def _evict(self):
+        metas = sorted(self._meta_files(), key=os.path.getmtime)
+        for path in metas[:max(0, len(metas) - self.max_count)]:
+            profile_id = os.path.basename(path)[:-len('.json')]
+            for suffix in ('.json', '.prof', '.folded'):
+                try:
+                    os.remove(self._path(profile_id, suffix))
+                except OSError:
+                    pass
+
+    def _meta_files(self):
+        if not os.path.isdir(self.root):
+            return []
+        return [os.path.join(self.root, name) for name in os.listdir(self.root) if name.endswith('.json')]
+
+    def list(self):
+        """Metadata of stored profiles, newest first"""
+        metas = []
+        for path in self._meta_files():
+            try:
+                with open(path, encoding='utf-8') as f:
+                    metas.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(metas, key=lambda meta: meta['created_at'], reverse=True)
+
+    def get(self, profile_id):
+        """(metadata, data path) for a profile, or None"""
+        if not profile_id.isalnum():
+            return None
+        try:
+            with open(self._path(profile_id, '.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        path = self._path(profile_id, meta['suffix'])
+        return (meta, path) if os.path.exists(path) else None
+
+
+def _top_functions(stats, limit=15):
+    """Slowest functions by cumulative time, for listing without downloading"""
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{
+        'function': f"{os.path.basename(filename)}:{line}({name})",
+        'calls': calls,
+        'total_ms': round(total * 1000, 2),
+        'cumulative_ms': round(cumulative * 1000, 2)
+    } for (filename, line, name), (_, calls, total, cumulative, _) in rows]
+
+
+class Profiler:
+    def __init__(self, store=None):
+        self.enabled = os.environ.get('PROFILING_ENABLED', 'true').lower() == 'true'
+        self.sample_interval = int(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5)) / 1000
+        self.store = store or ProfileStore()
+        # cProfile hooks are per process; one deterministic run at a time
+        self._cprofile_lock = threading.Lock()
+
+    def run(self, mode, func, context):
+        """
+        Call func() under the profiler and store the result
+
+        Returns:
+            (func's return value, profile id or None if it ran unprofiled)
+        """
+        if mode == 'cprofile' and not self._cprofile_lock.acquire(blocking=False):
+            logging.info("Profiler busy, running request unprofiled")
+            return func(), None
+
+        pages = PageStats()
+        token = _collector.set(pages)
+        profile = sampler = None
+        t0 = time.perf_counter()
+        try:
+            if mode == 'cprofile':
+                profile = cProfile.Profile()
+                profile.enable()
+            else:
+                sampler = StackSampler(threading.get_ident(), self.sample_interval)
+                sampler.start()
+            try:
+                result = func()
+            finally:
+                if profile is not None:
+                    profile.disable()
+                else:
+                    sampler.stop()
+        finally:
+            _collector.reset(token)
+            if mode == 'cprofile':
+                self._cprofile_lock.release()
+
+        duration_ms = round((time.perf_counter() - t0) * 1000, 1)
+        profile_id = uuid.uuid4().hex
+        meta = dict(context, id=profile_id, mode=mode, duration_ms=duration_ms,
+                    created_at=datetime.utcnow().isoformat(), page_summary=pages.summary(), pages=pages.pages)
+        try:
+            if profile is not None:
+                stats = pstats.Stats(profile)
+                meta.update(suffix='.prof', top_functions=_top_functions(stats))
+                data = marshal.dumps(stats.stats)
+            else:
+                meta.update(suffix='.folded', samples=sum(sampler.stacks.values()))
+                data = sampler.dump()
+            self.store.save(meta, data, meta['suffix'])
+            logging.info(f"Stored {mode} profile {profile_id} ({duration_ms}ms)")
+        except Exception as e:
+            logging.error(f"Failed to store profile: {e}")
+            return result, None
+        return result, profile_id
+
+
+def anonymize_user(user_id):
+    return hashlib.sha256(str(user_id).encode('utf-8')).hexdigest()[:12]
+
+
+# Global instance, created on first use
+profiler_instance = None
+_instance_lock = threading.Lock()
+
+def get_profiler():
+    global profiler_instance
+    if profiler_instance is None:
+        with _instance_lock:
+            if profiler_instance is None:
+                profiler_instance = Profiler()
+    return profiler_instance
@@ -0,0 +1,135 @@
+"""
+Rebuild data/isin_master.csv from exchange and AMFI reference files
+
+Run offline whenever the reference files are updated; the API only reads
+the generated CSV and never downloads anything. Download the inputs
+separately:
+
+  --nse-equity  NSE securities list (EQUITY_L.csv / sec_list style):
+                columns SYMBOL, NAME OF COMPANY, SERIES, ISIN NUMBER.
+                Series GB -> sgb, RR -> reit, IV -> invit, N*/Y*/Z* -> bond,
+                INF ISINs -> etf, everything else -> equity
+  --nse-etf     NSE ETF list (eq_etfseclist.csv): Symbol, SecurityName, ISINNumber
+  --amfi        AMFI NAVAll.txt (semicolon separated, scheme ISINs)
+  --extra       Hand-maintained rows in the output format
+                (isin, instrument_type, symbol, name); these win
+
+    python refresh_isin_master.py --nse-equity EQUITY_L.csv --nse-etf eq_etfseclist.csv \
+        --amfi NAVAll.txt --extra isin_overrides.csv
+"""
+import os
+import re
+import csv
+import argparse
+import tempfile
+import isin_master
+
+ISIN_RE = re.compile(r'^IN[A-Z0-9]{9}[0-9]$')
+
+SERIES_TYPES = {'GB': 'sgb', 'RR': 'reit', 'IV': 'invit'}
+
+
+def _clean(row):
+    return {(key or '').strip().upper(): (value or '').strip() for key, value in row.items()}
+
+
+def read_nse_equity(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in map(_clean, csv.DictReader(f)):
+            isin = row.get('ISIN NUMBER', '').upper()
+            series = row.get('SERIES', '').upper()
+            if isin.startswith('INF'):
+                kind = 'etf'
+            elif series in SERIES_TYPES:
+                kind = SERIES_TYPES[series]
+            elif series[:1] in ('N', 'Y', 'Z') and series[1:].isdigit():
+                kind = 'bond'
+            else:
+                kind = 'equity'
+            yield isin, kind, row.get('SYMBOL', ''), row.get('NAME OF COMPANY', '')
+
+
+def read_nse_etf(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in map(_clean, csv.DictReader(f)):
+            yield row.get('ISINNUMBER', '').upper(), 'etf', row.get('SYMBOL', ''), row.get('SECURITYNAME', '')
+
+
+def read_amfi(path):
+    """NAVAll.txt: Scheme Code;ISIN Growth/Payout;ISIN Reinvestment;Scheme Name;NAV;Date"""
+    with open(path, encoding='utf-8-sig') as f:
+        for line in f:
+            parts = [part.strip() for part in line.split(';')]
+            if len(parts) < 4:
+                continue
+            for isin in parts[1:3]:
+                if isin.startswith('INF'):
+                    yield isin, 'mutual_fund', '', parts[3]
+
+
+def read_extra(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            yield row['isin'].strip().upper(), row['instrument_type'].strip(), row.get('symbol', '').strip(), row['name'].strip()
+
+
+def build(sources):
+    """Merge (isin, type, symbol, name) rows; later sources override earlier ones"""
+    master = {}
+    for rows in sources:
+        for isin, kind, symbol, name in rows:
+            if not ISIN_RE.match(isin) or kind not in isin_master.INSTRUMENT_TYPES:
+                continue
+            previous = master.get(isin)
+            # A later row without a symbol (e.g. an override) keeps the known one
+            if previous and not symbol and previous[1]:
+                symbol = previous[1]
+            master[isin] = (kind, symbol, name)
+    return master
+
+
+def write(master, path):
+    """Write the master sorted by ISIN, replacing the file atomically"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(isin_master.CSV_FIELDS)
+        for isin in sorted(master):
+            writer.writerow([isin, *master[isin]])
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nse-equity')
+    parser.add_argument('--nse-etf')
+    parser.add_argument('--amfi')
+    parser.add_argument('--extra', action='append', default=[])
+    parser.add_argument('--output', default=isin_master.ISIN_MASTER_PATH)
+    args = parser.parse_args()
+
+    # Order matters: AMFI first so exchange lists supply ETF symbols and types
+    sources = []
+    if args.amfi:
+        sources.append(read_amfi(args.amfi))
+    if args.nse_equity:
+        sources.append(read_nse_equity(args.nse_equity))
+    if args.nse_etf:
+        sources.append(read_nse_etf(args.nse_etf))
+    sources.extend(read_extra(path) for path in args.extra)
+    if not sources:
+        parser.error('Give at least one reference file')
+
+    master = build(sources)
+    write(master, args.output)
+
+    counts = {}
+    for kind, _, _ in master.values():
+        counts[kind] = counts.get(kind, 0) + 1
+    print(f"Wrote {len(master)} ISINs to {args.output}: {counts}")
+
+
+if __name__ == '__main__':
+    main()
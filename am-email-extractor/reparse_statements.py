@@ -0,0 +1,181 @@
+"""
+Re-parse archived statements after a parser upgrade
+
+Finds archived statements (see statement_archive.py) whose parser_version is
+older than the broker extractor's current PARSER_VERSION, re-extracts them
+from the archive in a bounded process pool and writes the corrected
+holdings. No Gmail traffic is needed.
+
+- If the statement produced the user's latest snapshot for that broker, a
+  new snapshot is saved through the normal save-and-publish path, so
+  positions, the consolidated view, history and Kafka consumers all see
+  the correction.
+- Older statements have their stored snapshot corrected in place (in the
+  normalised layout the corrected holdings are written onto the stored
+  snapshot header, since positions only describe the latest state).
+- Statements whose holdings come out unchanged are only marked as parsed
+  by the new version.
+- Statements without a recorded snapshot, or whose snapshot no longer
+  exists, are skipped and left stale.
+
+Re-extracted holdings are normalised and enriched like live extractions
+(pipeline.prepare_holdings) before they are compared or stored.
+
+    python reparse_statements.py --broker groww --concurrency 4
+    python reparse_statements.py --dry-run
+"""
+import os
+import time
+import logging
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from bson import ObjectId
+from dotenv import load_dotenv
+import brokers
+import database
+import holding
+import pipeline
+import portfolio_delta
+import statement_archive
+
+
+def parse_statement(broker, data, extension, password):
+    """
+    Worker: write statement bytes to a temp file and run the extractor
+
+    Returns Holding records, which pickle back to the parent far smaller
+    than the extractor's dicts.
+    """
+    with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as tmp_file:
+        tmp_file.write(data)
+        tmp_path = tmp_file.name
+    try:
+        return holding.from_dicts(brokers.extract_holdings(broker, tmp_path, password))
+    finally:
+        os.unlink(tmp_path)
+
+
+class Reparser:
+    def __init__(self, concurrency=None, dry_run=False, db=None, archive=None):
+        self.concurrency = concurrency or int(os.environ.get('REPARSE_CONCURRENCY', 4))
+        self.dry_run = dry_run
+        self.db = db or database.get_db()
+        self.archive = archive or statement_archive.get_archive()
+        self.stats = {'scanned': 0, 'unchanged': 0, 'new_snapshot': 0, 'corrected': 0, 'skipped': 0, 'failed': 0}
+
+    def run(self, broker_names=None, limit=None):
+        if not self.archive.enabled:
+            raise RuntimeError("Statement archive is disabled (set ARCHIVE_ENCRYPTION_KEY)")
+
+        with ProcessPoolExecutor(max_workers=self.concurrency) as pool:
+            for broker in broker_names or brokers.SUPPORTED_BROKERS:
+                version = brokers.parser_version(broker)
+                records = self.db.find_stale_statements(broker, version, limit)
+                logging.info(f"{broker}: {len(records)} statements parsed before version {version}")
+                self._run_broker(pool, broker, version, records)
+        self.db.flush_writes()
+        return self.stats
+
+    def _run_broker(self, pool, broker, version, records):
+        # Keep at most 2x concurrency statements decrypted in memory
+        pending = {}
+        records = iter(records)
+        while True:
+            while len(pending) < self.concurrency * 2:
+                record = next(records, None)
+                if record is None:
+                    break
+                future = self._submit(pool, broker, record)
+                if future is not None:
+                    pending[future] = record
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = pending.pop(future)
+                try:
+                    self._apply(broker, version, record, holding.to_dicts(future.result()))
+                except Exception as e:
+                    self.stats['failed'] += 1
+                    logging.error(f"Re-parse failed for {broker} statement {record['sha256']}: {e}")
+
+    def _submit(self, pool, broker, record):
+        self.stats['scanned'] += 1
+        try:
+            data = self.archive.get(record['sha256'])
+            password = self.archive.decrypt(record['password']).decode('utf-8') if record.get('password') else None
+        except Exception as e:
+            self.stats['failed'] += 1
+            logging.error(f"Cannot read archived {broker} statement {record['sha256']}: {e}")
+            return None
+        return pool.submit(parse_statement, broker, data, record.get('extension', '.pdf'), password)
+
+    def _apply(self, broker, version, record, holdings):
+        user_id = record['user_id']
+        snapshot_id = record.get('snapshot_id')
+        if not snapshot_id:
+            self.stats['skipped'] += 1
+            logging.warning(f"{broker} statement {record['sha256']} has no snapshot to correct, skipped")
+            return
+
+        pipeline.prepare_holdings(holdings)
+        latest = self.db.get_latest_snapshot_refs(user_id, broker)
+        is_latest = bool(latest) and str(latest[0]['_id']) == snapshot_id
+
+        stored = self.db.get_snapshots([ObjectId(snapshot_id)])
+        if not stored:
+            self.stats['skipped'] += 1
+            logging.warning(f"Snapshot {snapshot_id} of {broker} statement {record['sha256']} not found, skipped")
+            return
+        if portfolio_delta.is_empty(portfolio_delta.diff_holdings(stored[0]['holdings'], holdings)):
+            self.stats['unchanged'] += 1
+            if not self.dry_run:
+                self.db.mark_statement_reparsed(record['_id'], version)
+            return
+
+        if self.dry_run:
+            self.stats['new_snapshot' if is_latest else 'corrected'] += 1
+            logging.info(f"[dry run] {broker} statement {record['sha256']} for {user_id} would change")
+            return
+
+        if is_latest:
+            metadata = {
+                'source': 'reparse',
+                'filename': record.get('filename'),
+                'statement_sha256': record['sha256'],
+                'parser_version': version,
+                'reparsed_from': snapshot_id
+            }
+            new_id = pipeline.save_and_publish(user_id, broker, holdings, metadata, wait=False)
+            self.db.mark_statement_reparsed(record['_id'], version, snapshot_id=new_id)
+            self.stats['new_snapshot'] += 1
+        elif self.db.correct_snapshot(snapshot_id, holdings, version):
+            self.db.mark_statement_reparsed(record['_id'], version)
+            self.stats['corrected'] += 1
+        else:
+            # Left stale, so the next run tries again
+            self.stats['failed'] += 1
+            logging.error(f"Snapshot {snapshot_id} of {broker} statement {record['sha256']} was not corrected")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--broker', action='append', choices=brokers.SUPPORTED_BROKERS,
+                        help='Broker to re-parse (repeatable, default all)')
+    parser.add_argument('--concurrency', type=int, default=None, help='Parser processes (REPARSE_CONCURRENCY)')
+    parser.add_argument('--limit', type=int, default=None, help='Max statements per broker')
+    parser.add_argument('--dry-run', action='store_true', help='Report changes without writing')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+
+    t0 = time.perf_counter()
+    stats = Reparser(concurrency=args.concurrency, dry_run=args.dry_run).run(args.broker, args.limit)
+    logging.info(f"Re-parse finished in {time.perf_counter() - t0:.1f}s: {stats}")
+
+
+if __name__ == '__main__':
+    main()
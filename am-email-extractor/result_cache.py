@@ -0,0 +1,130 @@
+"""
+Extraction result cache keyed by statement content
+
+Parsing is by far the most expensive step of an extraction, and the same
+statement is often extracted again: re-uploads, retries after a timeout,
+the back office importing a file a client already uploaded. Results are
+cached in MongoDB (extraction_results) under (broker, parser version,
+SHA-256 of the statement bytes); bumping a broker's PARSER_VERSION misses
+every older entry, and entries expire after RESULT_CACHE_TTL_DAYS.
+
+A password-protected statement must not be readable from the cache by
+someone who doesn't know its password, so each entry carries an HMAC of
+(digest, password) under RESULT_CACHE_SECRET (default: JWT_SECRET), and a
+lookup only hits with the same password. Holdings are cached as the
+extractor returned them, before normalisation and enrichment.
+
+Lookups and stores are best effort: a cache failure never fails an
+extraction.
+"""
+import os
+import hmac
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+import brokers
+import database
+import metrics
+
+
+class ResultCache:
+    def __init__(self):
+        self.enabled = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+        self.ttl = timedelta(days=float(os.environ.get('RESULT_CACHE_TTL_DAYS', 30)))
+        secret = os.environ.get('RESULT_CACHE_SECRET') or os.environ.get('JWT_SECRET')
+        self.secret = secret.encode('utf-8') if secret else None
+        if self.enabled and not self.secret:
+            logging.warning("Neither RESULT_CACHE_SECRET nor JWT_SECRET set, result cache disabled")
+            self.enabled = False
+
+    def key(self, sha256, broker):
+        return f"{broker}:{brokers.parser_version(broker)}:{sha256}"
+
+    def verifier(self, sha256, password):
+        message = f"{sha256}:{password or ''}".encode('utf-8')
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def entry(self, sha256, broker, password, holdings):
+        """Cache document for an extraction result"""
+        now = datetime.utcnow()
+        return {
+            '_id': self.key(sha256, broker),
+            'broker': broker,
+            'parser_version': brokers.parser_version(broker),
+            'verifier': self.verifier(sha256, password),
+            'holdings': holdings,
+            'created_at': now,
+            'expires_at': now + self.ttl
+        }
+
+    def holdings_from(self, entry, sha256, broker, password):
+        """Cached holdings from a looked-up entry, or None on a miss (counted either way)"""
+        hit = entry is not None and hmac.compare_digest(entry['verifier'], self.verifier(sha256, password))
+        metrics.add_cache_lookup(hit, broker)
+        return entry['holdings'] if hit else None
+
+    def lookup(self, sha256, broker, password):
+        """Holdings previously extracted from this statement, or None"""
+        if not self.enabled:
+            return None
+        try:
+            with metrics.stage('cache_lookup', broker):
+                entry = database.get_db().get_cached_result(self.key(sha256, broker))
+        except Exception as e:
+            logging.warning(f"Result cache lookup failed: {e}")
+            return None
+        return self.holdings_from(entry, sha256, broker, password)
+
+    def store(self, sha256, broker, password, holdings):
+        if not self.enabled:
+            return
+        try:
+            database.get_db().put_cached_result(self.entry(sha256, broker, password, holdings))
+        except Exception as e:
+            logging.warning(f"Result cache store failed: {e}")
+
+    def lookup_many(self, lookups):
+        """
+        lookup() for several statements with one query
+
+        Args:
+            lookups: (sha256, broker, password) tuples
+
+        Returns:
+            Cached holdings or None for each lookup, in order
+        """
+        if not self.enabled:
+            return [None] * len(lookups)
+        try:
+            with metrics.stage('cache_lookup'):
+                entries = database.get_db().get_cached_results(
+                    {self.key(sha256, broker) for sha256, broker, _ in lookups}
+                )
+        except Exception as e:
+            logging.warning(f"Result cache lookup failed: {e}")
+            return [None] * len(lookups)
+        return [self.holdings_from(entries.get(self.key(sha256, broker)), sha256, broker, password)
+                for sha256, broker, password in lookups]
+
+    def store_many(self, results):
+        """store() for several (sha256, broker, password, holdings) results with one bulk write"""
+        if not self.enabled:
+            return
+        try:
+            database.get_db().put_cached_results([self.entry(*result) for result in results])
+        except Exception as e:
+            logging.warning(f"Result cache store failed: {e}")
+
+
+# Global instance, created on first use
+cache_instance = None
+_instance_lock = threading.Lock()
+
+def get_cache():
+    global cache_instance
+    if cache_instance is None:
+        with _instance_lock:
+            if cache_instance is None:
+                cache_instance = ResultCache()
+    return cache_instance
@@ -0,0 +1,206 @@
+"""
+Write-behind batching of snapshot writes
+
+Request threads hand snapshot documents to a bounded queue instead of each
+doing its own round trips to MongoDB. A single writer thread drains the
+queue and flushes batches - up to MONGO_WRITE_BATCH_SIZE documents, or
+whatever arrived within MONGO_WRITE_FLUSH_MS of the first one - through one
+flush call (insert_many inside one transaction, see Database.write_batch).
+
+When the queue is full, submit() blocks for up to MONGO_WRITE_QUEUE_TIMEOUT
+seconds and then raises WriteQueueFull, so a slow database pushes back on
+callers instead of growing memory without bound.
+
+Every submit returns a PendingWrite; interactive callers that must return
+a db_id wait on it (synchronous ack), bulk callers don't. A wait that times
+out raises WriteAckTimeout: the snapshot is still queued and may yet be
+written, so the API answers 202 with its id rather than an error a client
+would retry (creating a duplicate).
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import deque
+
+
+class WriteQueueFull(Exception):
+    """The write-behind queue stayed full for the whole put timeout"""
+
+
+class WriteAckTimeout(TimeoutError):
+    """A queued snapshot was not flushed within the ack timeout; it is still pending"""
+
+    def __init__(self, pending, timeout):
+        super().__init__(f"Snapshot {pending.doc_id} not flushed within {timeout}s")
+        self.pending = pending
+        self.doc_id = pending.doc_id
+
+
+class PendingWrite:
+    """Acknowledgement handle for one queued snapshot"""
+
+    def __init__(self, doc_id):
+        self.doc_id = doc_id
+        self.error = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def set_result(self, error=None):
+        with self._lock:
+            self.error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    def add_done_callback(self, callback):
+        """Call callback(error) once the snapshot is flushed (error None) or failed; now if already done"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run_callback(callback)
+
+    def _run_callback(self, callback):
+        try:
+            callback(self.error)
+        except Exception as e:
+            logging.error(f"Callback for snapshot {self.doc_id} failed: {e}")
+
+    def wait(self, timeout=None):
+        """True once the snapshot's batch has been flushed (or failed)"""
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        """Wait until the snapshot is flushed; re-raises a flush failure"""
+        if not self.wait(timeout):
+            raise WriteAckTimeout(self, timeout)
+        if self.error is not None:
+            raise self.error
+        return self.doc_id
+
+
+class SnapshotWriter:
+    def __init__(self, flush, batch_size=None, flush_interval_ms=None, queue_size=None, put_timeout=None):
+        """
+        Args:
+            flush: Callable taking a list of (document, outbox_row) pairs and
+                writing them; raising fails every write in the batch
+        """
+        self.flush_fn = flush
+        self.batch_size = batch_size or int(os.environ.get('MONGO_WRITE_BATCH_SIZE', 100))
+        self.flush_interval = (flush_interval_ms or float(os.environ.get('MONGO_WRITE_FLUSH_MS', 200))) / 1000
+        self.queue_size = queue_size or int(os.environ.get('MONGO_WRITE_QUEUE_SIZE', 1000))
+        self.put_timeout = put_timeout if put_timeout is not None else float(os.environ.get('MONGO_WRITE_QUEUE_TIMEOUT', 5))
+
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._stop = threading.Event()
+        self._metrics_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._flushes = 0
+        self._written = 0
+        self._failed = 0
+        self._rejected = 0
+        self._last_batch = 0
+        self._last_pending = None
+
+        self._thread = threading.Thread(target=self._run, name='snapshot-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, document, outbox_row=None):
+        """Queue a snapshot for writing; blocks while the queue is full"""
+        pending = PendingWrite(str(document['_id']))
+        try:
+            self._queue.put((document, outbox_row, pending), timeout=self.put_timeout)
+        except queue.Full:
+            with self._metrics_lock:
+                self._rejected += 1
+            raise WriteQueueFull(f"Snapshot write queue full ({self.queue_size}), try again later")
+        self._last_pending = pending
+        return pending
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted so far has been written"""
+        # Batches are flushed in submission order by a single thread
+        pending = self._last_pending
+        if pending is not None and not pending.wait(timeout):
+            raise TimeoutError(f"Snapshot writes not flushed within {timeout}s")
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        t0 = time.perf_counter()
+        error = None
+        try:
+            self.flush_fn([(document, outbox_row) for document, outbox_row, _ in batch])
+        except Exception as e:
+            logging.error(f"Snapshot batch of {len(batch)} failed: {e}")
+            error = e
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+
+        with self._metrics_lock:
+            self._flushes += 1
+            self._latencies.append(elapsed_ms)
+            self._last_batch = len(batch)
+            if error is None:
+                self._written += len(batch)
+            else:
+                self._failed += len(batch)
+        for _, _, pending in batch:
+            pending.set_result(error)
+
+    def metrics(self):
+        with self._metrics_lock:
+            latencies = sorted(self._latencies)
+            return {
+                'queued': self._queue.qsize(),
+                'queue_size': self.queue_size,
+                'flushes': self._flushes,
+                'written': self._written,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'last_batch': self._last_batch,
+                'flush_ms': {
+                    'p50': _percentile(latencies, 50),
+                    'p95': _percentile(latencies, 95),
+                    'p99': _percentile(latencies, 99),
+                    'max': round(latencies[-1], 2) if latencies else None
+                }
+            }
+
+    def close(self, timeout=None):
+        """Flush everything queued and stop the writer thread"""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=timeout or self.put_timeout + 30)
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))], 2)
@@ -0,0 +1,219 @@
+"""
+Raw statement archive
+
+Every processed attachment is kept so holdings can be re-extracted when a
+parser is fixed (reparse_statements.py), without fetching from Gmail again.
+
+Files are content-addressed by the SHA-256 of the original bytes and stored
+under ARCHIVE_DIR as <aa>/<bb>/<sha256>.zst.enc: zstd-compressed, then
+encrypted with Fernet (AES-128-CBC + HMAC-SHA256). The same statement
+uploaded twice is stored once. A statement_archive record in MongoDB links
+each (user, broker, sha256) to the snapshot it produced, the parser version
+that produced it and the statement password (encrypted with the same key).
+
+ARCHIVE_ENCRYPTION_KEY holds one or more comma-separated Fernet keys; the
+first encrypts, all decrypt, so keys can be rotated. Without a key the
+archive is disabled - statements are never written unencrypted.
+
+Extractions archive through archive_in_background(): the statement bytes
+are read before the temp file goes away, and compression, encryption and
+the writes run on ARCHIVE_WORKERS background threads, off the request
+path. At most ARCHIVE_QUEUE_SIZE statements wait; beyond that the caller
+archives inline, so a slow disk slows extractions down instead of
+dropping statements or buffering without bound.
+"""
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import brokers
+import database
+import tracing
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from cryptography.fernet import Fernet, MultiFernet
+except ImportError:
+    Fernet = MultiFernet = None
+
+
+class StatementArchive:
+    def __init__(self, root=None, keys=None, level=None):
+        self.root = root or os.environ.get('ARCHIVE_DIR', 'statement_archive')
+        self.level = level or int(os.environ.get('ARCHIVE_ZSTD_LEVEL', 10))
+        keys = keys if keys is not None else os.environ.get('ARCHIVE_ENCRYPTION_KEY', '')
+        keys = [key.strip() for key in keys.split(',') if key.strip()] if isinstance(keys, str) else keys
+
+        self.enabled = os.environ.get('ARCHIVE_ENABLED', 'true').lower() == 'true'
+        self._fernet = None
+        if self.enabled and not keys:
+            logging.warning("ARCHIVE_ENCRYPTION_KEY not set, statement archive disabled")
+            self.enabled = False
+        elif self.enabled and (zstandard is None or Fernet is None):
+            logging.warning("Statement archive needs the zstandard and cryptography packages, disabled")
+            self.enabled = False
+        elif self.enabled:
+            self._fernet = MultiFernet([Fernet(key) for key in keys])
+
+    def path_for(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], f'{sha256}.zst.enc')
+
+    def encrypt(self, data):
+        return self._fernet.encrypt(data)
+
+    def decrypt(self, token):
+        return self._fernet.decrypt(token)
+
+    def put(self, data):
+        """
+        Store raw statement bytes
+
+        Returns:
+            SHA-256 hex digest of `data`, the archive key
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path_for(sha256)
+        if os.path.exists(path):
+            return sha256
+
+        blob = self.encrypt(zstandard.ZstdCompressor(level=self.level).compress(data))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so a crash never leaves a truncated object
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return sha256
+
+    def get(self, sha256):
+        """Original statement bytes for an archive key"""
+        with open(self.path_for(sha256), 'rb') as f:
+            data = zstandard.ZstdDecompressor().decompress(self.decrypt(f.read()))
+        if hashlib.sha256(data).hexdigest() != sha256:
+            raise ValueError(f"Archived statement {sha256} failed integrity check")
+        return data
+
+    def exists(self, sha256):
+        return os.path.exists(self.path_for(sha256))
+
+
+ARCHIVE_WORKERS = int(os.environ.get('ARCHIVE_WORKERS', 2))
+ARCHIVE_QUEUE_SIZE = int(os.environ.get('ARCHIVE_QUEUE_SIZE', 16))
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(ARCHIVE_QUEUE_SIZE)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS, thread_name_prefix='archive')
+    return _executor
+
+
+def archive_in_background(user_id, broker, file_path, password, filename, source, snapshot_id):
+    """
+    archive_statement() without waiting for it
+
+    Reads the statement now, so the caller may delete the file on return,
+    and archives it on a background thread (inline when the queue is full).
+    """
+    if not get_archive().enabled:
+        return
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        logging.error(f"Failed to archive {broker} statement for snapshot {snapshot_id}: {e}")
+        return
+
+    args = (user_id, broker, data, password, filename or os.path.basename(file_path), source, snapshot_id)
+    if not _slots.acquire(blocking=False):
+        logging.warning("Statement archive queue full, archiving inline")
+        archive_bytes(*args)
+        return
+
+    def run():
+        try:
+            archive_bytes(*args)
+        finally:
+            _slots.release()
+
+    _get_executor().submit(run)
+
+
+def archive_statement(user_id, broker, file_path, password, filename, source, snapshot_id):
+    """
+    Archive a processed statement and record which snapshot it produced
+
+    Best effort: a failure is logged and never fails the extraction.
+
+    Returns:
+        The statement's SHA-256, or None if it was not archived
+    """
+    if not get_archive().enabled:
+        return None
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        logging.error(f"Failed to archive {broker} statement for snapshot {snapshot_id}: {e}")
+        return None
+    return archive_bytes(user_id, broker, data, password, filename or os.path.basename(file_path), source,
+                         snapshot_id)
+
+
+def archive_bytes(user_id, broker, data, password, filename, source, snapshot_id):
+    """archive_statement() for statement bytes already in memory"""
+    archive = get_archive()
+    if not archive.enabled:
+        return None
+    try:
+        with tracing.span('archive.put', broker=broker):
+            sha256 = archive.put(data)
+
+        extension = os.path.splitext(filename)[1].lower() or '.pdf'
+        database.get_db().record_statement({
+            'user_id': user_id,
+            'broker': broker,
+            'sha256': sha256,
+            'filename': filename,
+            'extension': extension,
+            'source': source,
+            'password': archive.encrypt(password.encode('utf-8')) if password else None,
+            'parser_version': brokers.parser_version(broker),
+            'snapshot_id': snapshot_id,
+            'archived_at': datetime.utcnow()
+        })
+        return sha256
+    except Exception as e:
+        logging.error(f"Failed to archive {broker} statement for snapshot {snapshot_id}: {e}")
+        return None
+
+
+# Global instance, created on first use
+archive_instance = None
+_instance_lock = threading.Lock()
+
+def get_archive():
+    global archive_instance
+    if archive_instance is None:
+        with _instance_lock:
+            if archive_instance is None:
+                archive_instance = StatementArchive()
+    return archive_instance
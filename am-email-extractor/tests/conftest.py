@@ -0,0 +1,10 @@
+"""
+Unit tests for the extractor's pure modules
+
+    cd am-email-extractor && python -m pytest tests
+"""
+import os
+import sys
+
+# The service modules are top-level imports, as in the app and benchmarks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
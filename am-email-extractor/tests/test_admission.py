@@ -0,0 +1,160 @@
+import time
+import socket
+import asyncio
+import threading
+import pytest
+import admission
+from admission import Admission, Overloaded
+
+
+def controller(monkeypatch, **limits):
+    monkeypatch.setenv('ADMISSION_ENABLED', 'true')
+    options = {'max_concurrent': 2, 'max_per_user': 2, 'queue_size': 4, 'queue_timeout': 0.05}
+    options.update(limits)
+    return Admission(**options)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out waiting'
+        time.sleep(0.001)
+
+
+def test_admits_up_to_the_concurrency_limit(monkeypatch):
+    gate = controller(monkeypatch)
+    tickets = [gate.acquire('a'), gate.acquire('b')]
+    assert all(ticket.admitted for ticket in tickets)
+    assert gate.state()['active'] == 2
+
+    for ticket in tickets:
+        gate.release(ticket)
+    assert gate.state()['active'] == 0
+
+
+def test_a_full_queue_rejects_at_once(monkeypatch):
+    gate = controller(monkeypatch, max_concurrent=1, queue_size=0)
+    gate.acquire('a')
+    with pytest.raises(Overloaded) as rejected:
+        gate.acquire('b')
+    assert rejected.value.reason == 'queue_full'
+    assert rejected.value.retry_after >= 1
+    assert gate.state()['rejected'] == {'queue_full': 1}
+
+
+def test_a_queued_request_times_out(monkeypatch):
+    gate = controller(monkeypatch, max_concurrent=1)
+    gate.acquire('a')
+    with pytest.raises(Overloaded) as rejected:
+        gate.acquire('b')
+    assert rejected.value.reason == 'timeout'
+    assert gate.state()['queued'] == 0
+
+
+def test_a_user_cannot_queue_beyond_their_limit(monkeypatch):
+    gate = controller(monkeypatch, max_concurrent=4, max_per_user=1, queue_timeout=5)
+    ticket = gate.acquire('a')
+    waiter = threading.Thread(target=lambda: gate.release(gate.acquire('a')))
+    waiter.start()
+    wait_until(lambda: gate.state()['queued'] == 1)
+
+    with pytest.raises(Overloaded) as rejected:
+        gate.acquire('a')
+    assert rejected.value.reason == 'user_limit'
+    # Other users are not held up by a's queued request
+    gate.release(gate.acquire('b'))
+
+    gate.release(ticket)
+    waiter.join(5)
+    assert gate.state()['active'] == 0
+
+
+def test_release_hands_the_slot_to_a_waiter(monkeypatch):
+    gate = controller(monkeypatch, max_concurrent=1, queue_timeout=5)
+    ticket = gate.acquire('a')
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(gate.acquire('b')))
+    waiter.start()
+    wait_until(lambda: gate.state()['queued'] == 1)
+
+    gate.release(ticket)
+    waiter.join(5)
+    assert admitted and admitted[0].admitted and admitted[0].user_id == 'b'
+    assert gate.state()['active'] == 1 and gate.state()['queued'] == 0
+
+
+def test_admit_releases_on_error(monkeypatch):
+    gate = controller(monkeypatch)
+    with pytest.raises(RuntimeError):
+        with gate.admit('a'):
+            raise RuntimeError('extraction failed')
+    assert gate.state()['active'] == 0
+
+
+def test_disabled_admission_admits_everything(monkeypatch):
+    monkeypatch.setenv('ADMISSION_ENABLED', 'false')
+    gate = Admission(max_concurrent=1, max_per_user=1, queue_size=0, queue_timeout=0.05)
+    tickets = [gate.acquire('a') for _ in range(3)]
+    assert all(ticket.admitted for ticket in tickets)
+
+
+def test_acquire_async_waits_for_a_release(monkeypatch):
+    gate = controller(monkeypatch, max_concurrent=1, queue_timeout=5)
+
+    async def scenario():
+        first = await gate.acquire_async('a')
+        second = asyncio.create_task(gate.acquire_async('b'))
+        await asyncio.sleep(0.01)
+        assert not second.done()
+        gate.release(first)
+        ticket = await asyncio.wait_for(second, 5)
+        assert ticket.admitted and ticket.user_id == 'b'
+        gate.release(ticket)
+
+    asyncio.run(scenario())
+    assert gate.state()['active'] == 0
+
+
+def test_acquire_async_cancelled_while_queued_leaves_the_queue(monkeypatch):
+    gate = controller(monkeypatch, max_concurrent=1, queue_timeout=5)
+
+    async def scenario():
+        first = await gate.acquire_async('a')
+        waiting = asyncio.create_task(gate.acquire_async('b'))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert gate.state()['queued'] == 0
+        gate.release(first)
+
+    asyncio.run(scenario())
+    assert gate.state()['active'] == 0
+
+
+@pytest.mark.parametrize('header, claim, priority', [
+    (None, None, 'interactive'),
+    ('backfill', None, 'backfill'),
+    (None, 'refresh', 'refresh'),
+    ('interactive', 'backfill', 'backfill'),
+    ('backfill', 'interactive', 'backfill'),
+    ('urgent', None, 'interactive'),
+])
+def test_request_priority_takes_the_less_urgent(header, claim, priority):
+    headers = {'X-Priority': header} if header else {}
+    assert admission.request_priority(headers, {'priority': claim} if claim else None) == priority
+
+
+def test_client_disconnected():
+    assert not admission.client_disconnected({})
+
+    server, client = socket.socketpair()
+    try:
+        environ = {'werkzeug.socket': server}
+        assert not admission.client_disconnected(environ)
+        client.close()
+        assert admission.client_disconnected(environ)
+        with pytest.raises(admission.ClientDisconnected):
+            admission.check_client(environ)
+    finally:
+        server.close()
@@ -0,0 +1,97 @@
+from datetime import datetime
+import cost_stats
+from cost_stats import bucket_index, percentile, rollup_increments, rollup_updates, summarize
+
+
+def test_bucket_index_uses_upper_bounds_with_an_overflow_bucket():
+    assert bucket_index('parse_ms', 0) == 0
+    assert bucket_index('parse_ms', 5) == 0
+    assert bucket_index('parse_ms', 5.1) == 1
+    assert bucket_index('parse_ms', 60000) == len(cost_stats.BUCKETS['parse_ms']) - 1
+    assert bucket_index('parse_ms', 60001) == len(cost_stats.BUCKETS['parse_ms'])
+
+
+def test_rollup_increments_skip_missing_fields():
+    inc, low, high = rollup_increments({'bytes': 20000, 'parse_ms': 30, 'gmail_ms': None, 'filename': 'x.pdf'})
+    assert inc == {'count': 1, 'sum.bytes': 20000, 'hist.bytes.1': 1, 'sum.parse_ms': 30, 'hist.parse_ms.3': 1}
+    assert low == {'min.bytes': 20000, 'min.parse_ms': 30}
+    assert high == {'max.bytes': 20000, 'max.parse_ms': 30}
+
+
+def test_rollup_updates_group_by_broker_and_day():
+    documents = [
+        {'broker': 'zerodha', 'extracted_at': datetime(2024, 3, 1, 9), 'metadata': {'parse_ms': 30, 'holdings': 4}},
+        {'broker': 'zerodha', 'extracted_at': datetime(2024, 3, 1, 23), 'metadata': {'parse_ms': 70}},
+        {'broker': 'zerodha', 'extracted_at': datetime(2024, 3, 2, 1), 'metadata': {'parse_ms': 10}},
+        {'broker': 'groww', 'extracted_at': datetime(2024, 3, 1, 9), 'metadata': {}},
+    ]
+    updates = dict((tuple(query.values()), update) for query, update in rollup_updates(documents))
+
+    assert updates[('zerodha', '2024-03-01')] == {
+        '$inc': {'count': 2, 'sum.parse_ms': 100, 'hist.parse_ms.3': 1, 'hist.parse_ms.4': 1,
+                 'sum.holdings': 4, 'hist.holdings.1': 1},
+        '$min': {'min.parse_ms': 30, 'min.holdings': 4},
+        '$max': {'max.parse_ms': 70, 'max.holdings': 4},
+    }
+    assert updates[('zerodha', '2024-03-02')]['$inc']['count'] == 1
+    # A document without costs only counts the extraction
+    assert updates[('groww', '2024-03-01')] == {'$inc': {'count': 1}}
+
+
+def test_percentile_interpolates_within_a_bucket():
+    bounds = (10, 20, 30)
+    counts = {0: 10, 1: 10}
+    assert percentile(counts, bounds, 50) == 10.0
+    assert percentile(counts, bounds, 75) == 15.0
+    assert percentile(counts, bounds, 100) == 20.0
+
+
+def test_percentile_is_clamped_to_the_observed_range():
+    bounds = (10, 20, 30)
+    assert percentile({0: 10}, bounds, 50, minimum=2, maximum=6) == 4.0
+    # The overflow bucket is bounded by the maximum
+    assert percentile({3: 4}, bounds, 50, minimum=40, maximum=80) == 60.0
+
+
+def test_percentile_of_nothing():
+    assert percentile({}, (10, 20), 50) is None
+
+
+def test_summarize_merges_rollup_documents():
+    rollups = [
+        {'count': 2, 'sum': {'parse_ms': 40}, 'min': {'parse_ms': 10}, 'max': {'parse_ms': 30},
+         'hist': {'parse_ms': {'1': 1, '3': 1}}},
+        {'count': 2, 'sum': {'parse_ms': 160, 'holdings': 12}, 'min': {'parse_ms': 60, 'holdings': 12},
+         'max': {'parse_ms': 100, 'holdings': 12}, 'hist': {'parse_ms': {'4': 1}, 'holdings': {'3': 1}}},
+    ]
+    summary = summarize(rollups)
+
+    assert summary['count'] == 4
+    assert set(summary['fields']) == {'parse_ms', 'holdings'}
+    parse_ms = summary['fields']['parse_ms']
+    assert parse_ms['count'] == 3
+    assert parse_ms['mean'] == round(200 / 3, 1)
+    assert (parse_ms['min'], parse_ms['max']) == (10, 100)
+    assert parse_ms['min'] <= parse_ms['p50'] <= parse_ms['p90'] <= parse_ms['p99'] <= parse_ms['max']
+    assert summary['fields']['holdings'] == {'count': 1, 'mean': 12.0, 'min': 12, 'max': 12,
+                                             'p50': 12, 'p90': 12, 'p99': 12}
+
+
+def test_rollups_round_trip_through_summarize():
+    # Apply the $inc/$min/$max updates the way MongoDB would, then summarize
+    documents = [{'broker': 'zerodha', 'extracted_at': datetime(2024, 3, 1),
+                  'metadata': {'parse_ms': ms, 'pages': 2}} for ms in (20, 40, 80, 400)]
+    (_, update), = rollup_updates(documents)
+    rollup = {}
+    for operator, merge in (('$inc', lambda old, new: (old or 0) + new), ('$min', min), ('$max', max)):
+        for path, value in update[operator].items():
+            node = rollup
+            *parents, leaf = path.split('.')
+            for part in parents:
+                node = node.setdefault(part, {})
+            node[leaf] = value if leaf not in node else merge(node[leaf], value)
+
+    summary = summarize([rollup])
+    assert summary['count'] == 4
+    assert summary['fields']['parse_ms']['mean'] == 135.0
+    assert summary['fields']['pages'] == {'count': 4, 'mean': 2.0, 'min': 2, 'max': 2, 'p50': 2, 'p90': 2, 'p99': 2}
@@ -0,0 +1,126 @@
+import pytest
+import event_codec
+from holding import Holding
+
+
+def stored(isin, bal='10.00', rate='1,234.50', value='12345.00'):
+    return {'isin_code': isin, 'company_name': f'{isin} LTD', 'current_bal': bal, 'rate': rate, 'value': value}
+
+
+def snapshot_payload():
+    return {
+        'id': 'evt-1',
+        'userId': 'user-1',
+        'brokerType': 'zerodha',
+        'portfolioId': 'snap-1',
+        'timestamp': '2024-01-01T00:00:00Z',
+        'eventType': 'SNAPSHOT',
+        'snapshotVersion': 3,
+        'equities': [stored('INE000A01011'), stored('INE000B01012', value='N/A')],
+        'mutualFunds': [stored('INF000A01011', bal='12.345', rate='45.6789', value='563.90')],
+    }
+
+
+def delta_payload():
+    return {
+        'id': 'evt-2',
+        'userId': 'user-1',
+        'brokerType': 'zerodha',
+        'eventType': 'DELTA',
+        'snapshotVersion': 4,
+        'baseSnapshotId': 'snap-1',
+        'added': [stored('INE000C01013')],
+        'changed': [stored('INE000A01011', bal='11.00')],
+        'removed': ['INE000B01012'],
+    }
+
+
+@pytest.mark.parametrize('value, number', [
+    ('1,234.50', 1234.5), ('30', 30.0), (7, 7.0), (2.5, 2.5),
+    (None, None), ('', None), ('N/A', None), ('-', None), ('nan', None), ('abc', None),
+])
+def test_to_number(value, number):
+    assert event_codec.to_number(value) == number
+
+
+def test_json_round_trip_keeps_the_payload_unchanged():
+    for payload in (snapshot_payload(), delta_payload()):
+        assert event_codec.decode(event_codec.encode(payload)) == payload
+        assert event_codec.decode(event_codec.encode(payload, 'json'), 'application/json') == payload
+
+
+def test_json_encodes_holding_records_in_the_stored_form():
+    payload = snapshot_payload()
+    records = dict(payload, equities=[Holding.from_dict(h) for h in payload['equities']])
+    decoded = event_codec.decode(event_codec.encode(records))
+    assert decoded['equities'] == [Holding.from_dict(h).to_dict() for h in payload['equities']]
+    assert decoded['equities'][0]['rate'] == '1234.50'
+
+
+def test_compact_holdings_are_positional_rows_of_doubles():
+    compact = event_codec.to_compact(snapshot_payload())
+    assert compact['v'] == event_codec.SCHEMA_VERSION
+    assert compact['equities'] == [
+        ['INE000A01011', 'INE000A01011 LTD', 10.0, 1234.5, 12345.0],
+        ['INE000B01012', 'INE000B01012 LTD', 10.0, 1234.5, None],
+    ]
+    assert compact['snapshotVersion'] == 3
+
+
+def test_compact_rows_are_the_same_for_dicts_and_records():
+    payload = snapshot_payload()
+    records = dict(payload, equities=[Holding.from_dict(h) for h in payload['equities']],
+                   mutualFunds=[Holding.from_dict(h) for h in payload['mutualFunds']])
+    assert event_codec.to_compact(records) == event_codec.to_compact(payload)
+
+
+def test_msgpack_round_trip_keeps_fields_and_parses_numbers():
+    pytest.importorskip('msgpack')
+    for payload in (snapshot_payload(), delta_payload()):
+        decoded = event_codec.decode(event_codec.encode(payload, 'msgpack'), event_codec.CONTENT_TYPES['msgpack'])
+        assert 'v' not in decoded
+        assert decoded.keys() == payload.keys()
+        for key, value in payload.items():
+            if key not in event_codec.HOLDING_LISTS:
+                assert decoded[key] == value
+                continue
+            assert decoded[key] == [
+                {name: event_codec.to_number(h[name]) if name in event_codec.NUMERIC_FIELDS else h[name]
+                 for name in event_codec.HOLDING_FIELDS}
+                for h in value
+            ]
+
+
+def test_msgpack_is_smaller_than_json():
+    pytest.importorskip('msgpack')
+    payload = snapshot_payload()
+    payload['equities'] = [stored(f'INE{n:06d}A011') for n in range(200)]
+    assert len(event_codec.encode(payload, 'msgpack')) < len(event_codec.encode(payload, 'json'))
+
+
+def test_missing_and_empty_holding_lists():
+    payload = {'id': 'evt-3', 'eventType': 'DELTA', 'added': None, 'changed': []}
+    compact = event_codec.to_compact(payload)
+    assert compact['added'] == [] and compact['changed'] == []
+    assert 'equities' not in compact
+    assert event_codec.from_compact(compact) == {'id': 'evt-3', 'eventType': 'DELTA', 'added': [], 'changed': []}
+
+
+def test_headers_name_the_encoding():
+    assert dict(event_codec.headers()) == {'contentType': b'application/json', 'schemaVersion': b'0'}
+    assert dict(event_codec.headers('msgpack')) == {
+        'contentType': b'application/x-msgpack',
+        'schemaVersion': str(event_codec.SCHEMA_VERSION).encode('utf-8'),
+    }
+
+
+def test_check_encoding():
+    assert event_codec.check_encoding('json') == 'json'
+    with pytest.raises(ValueError):
+        event_codec.check_encoding('avro')
+
+
+def test_check_encoding_rejects_msgpack_without_the_package(monkeypatch):
+    monkeypatch.setattr(event_codec, 'msgpack', None)
+    with pytest.raises(ValueError):
+        event_codec.check_encoding('msgpack')
@@ -0,0 +1,138 @@
+import pytest
+from fair_scheduler import FairScheduler, parse_priority
+
+SHARES = {'interactive': 1.0, 'refresh': 0.75, 'backfill': 0.5}
+
+
+def anyone(user_id):
+    return True
+
+
+def drain(scheduler, eligible=anyone):
+    served = []
+    while True:
+        picked = scheduler.pop(eligible)
+        if picked is None:
+            return served
+        served.append(picked)
+
+
+@pytest.mark.parametrize('value, priority', [
+    ('refresh', 'refresh'), (' Backfill ', 'backfill'), ('INTERACTIVE', 'interactive'),
+    (None, 'interactive'), ('', 'interactive'), ('urgent', 'interactive'),
+])
+def test_parse_priority(value, priority):
+    assert parse_priority(value) == priority
+
+
+def test_parse_priority_default():
+    assert parse_priority('urgent', None) is None
+
+
+def test_class_limits_follow_shares_and_keep_one_slot():
+    assert FairScheduler(8, SHARES).limits == {'interactive': 8, 'refresh': 6, 'backfill': 4}
+    assert FairScheduler(1, SHARES).limits == {'interactive': 1, 'refresh': 1, 'backfill': 1}
+
+
+def test_users_take_turns_whatever_their_backlog():
+    scheduler = FairScheduler(4, SHARES)
+    for n in range(5):
+        scheduler.push(('a', n), 'a', 'interactive')
+    scheduler.push(('b', 0), 'b', 'interactive')
+    scheduler.push(('c', 0), 'c', 'interactive')
+
+    served = [item for item, _, _ in drain(scheduler)]
+    assert served[:4] == [('a', 0), ('b', 0), ('c', 0), ('a', 1)]
+    assert served[4:] == [('a', 2), ('a', 3), ('a', 4)]
+    assert len(scheduler) == 0
+
+
+def test_each_user_is_served_in_fifo_order():
+    scheduler = FairScheduler(4, SHARES)
+    for n in range(3):
+        scheduler.push(n, 'a', 'backfill')
+    assert [item for item, _, _ in drain(scheduler)] == [0, 1, 2]
+
+
+def test_more_urgent_classes_go_first():
+    scheduler = FairScheduler(4, SHARES)
+    scheduler.push('backfill', 'a', 'backfill')
+    scheduler.push('refresh', 'b', 'refresh')
+    scheduler.push('interactive', 'c', 'interactive')
+    assert [(item, priority) for item, _, priority in drain(scheduler)] == [
+        ('interactive', 'interactive'), ('refresh', 'refresh'), ('backfill', 'backfill')]
+
+
+def test_a_class_at_its_share_is_skipped():
+    scheduler = FairScheduler(4, SHARES)
+    for _ in range(scheduler.limits['backfill']):
+        scheduler.started('backfill')
+    scheduler.push('backfill', 'a', 'backfill')
+    assert not scheduler.has_room('backfill')
+    assert scheduler.pop(anyone) is None
+
+    scheduler.push('refresh', 'b', 'refresh')
+    assert scheduler.pop(anyone) == ('refresh', 'b', 'refresh')
+
+    scheduler.finished('backfill')
+    assert scheduler.pop(anyone) == ('backfill', 'a', 'backfill')
+
+
+def test_ineligible_users_stay_queued():
+    scheduler = FairScheduler(4, SHARES)
+    scheduler.push('a1', 'a', 'interactive')
+    scheduler.push('b1', 'b', 'interactive')
+
+    assert scheduler.pop(lambda user_id: user_id != 'a') == ('b1', 'b', 'interactive')
+    assert scheduler.pop(lambda user_id: user_id != 'a') is None
+    assert scheduler.waiting('interactive') == 1
+    assert scheduler.pop(anyone) == ('a1', 'a', 'interactive')
+
+
+def test_weights_scale_the_turn_rate():
+    scheduler = FairScheduler(4, SHARES)
+    for n in range(6):
+        scheduler.push(n, 'heavy', 'refresh', weight=2.0)
+        scheduler.push(n, 'light', 'refresh')
+    served = [user_id for _, user_id, _ in drain(scheduler)][:6]
+    assert served.count('heavy') == 4
+    assert served.count('light') == 2
+
+
+def test_an_idle_user_does_not_bank_credit():
+    scheduler = FairScheduler(4, SHARES)
+    for n in range(10):
+        scheduler.push(n, 'a', 'interactive')
+    for _ in range(5):
+        scheduler.pop(anyone)
+
+    # b arrives late and joins at the class clock: it alternates with a
+    # instead of catching up on the turns it missed
+    for n in range(5):
+        scheduler.push(n, 'b', 'interactive')
+    served = [user_id for _, user_id, _ in drain(scheduler)][:6]
+    assert served == ['b', 'a', 'b', 'a', 'b', 'a']
+
+
+def test_remove_withdraws_a_queued_item():
+    scheduler = FairScheduler(4, SHARES)
+    scheduler.push('a1', 'a', 'interactive')
+    scheduler.push('a2', 'a', 'interactive')
+    scheduler.remove('a1', 'a', 'interactive')
+    assert len(scheduler) == 1
+    scheduler.remove('a2', 'a', 'interactive')
+    assert len(scheduler) == 0
+    assert scheduler.pop(anyone) is None
+
+
+def test_state():
+    scheduler = FairScheduler(4, SHARES)
+    scheduler.push('a1', 'a', 'interactive')
+    scheduler.push('b1', 'b', 'interactive')
+    scheduler.push('c1', 'c', 'backfill')
+    scheduler.started('refresh')
+    assert scheduler.state() == {
+        'interactive': {'active': 0, 'queued': 2, 'limit': 4, 'users': 2},
+        'refresh': {'active': 1, 'queued': 0, 'limit': 3, 'users': 0},
+        'backfill': {'active': 0, 'queued': 1, 'limit': 2, 'users': 1},
+    }
@@ -0,0 +1,162 @@
+import json
+import pytest
+import holding
+from holding import Holding, SCALE, to_scaled, to_text, to_float
+
+
+@pytest.mark.parametrize('value, scaled', [
+    ('30', 30 * SCALE),
+    ('30.00', 30 * SCALE),
+    ('1,234.50', 12345000),
+    (' 1,234.5678 ', 12345678),
+    ('0.0001', 1),
+    ('.5', 5000),
+    ('+3', 30000),
+    ('-5.5', -55000),
+    ('-0.25', -2500),
+    (7, 7 * SCALE),
+    (0.1, 1000),
+    (1234.5678, 12345678),
+    ('1e3', 1000 * SCALE),
+])
+def test_to_scaled_parses_extractor_numbers_exactly(value, scaled):
+    assert to_scaled(value) == scaled
+
+
+@pytest.mark.parametrize('value', [None, '', '  ', 'N/A', 'na', '-', 'NaN', 'None', 'abc', '1.2.3', 'inf'])
+def test_to_scaled_returns_none_for_missing_or_unparseable(value):
+    assert to_scaled(value) is None
+
+
+def test_to_scaled_rounds_beyond_four_decimals_half_even():
+    assert to_scaled('1.23456') == 12346
+    assert to_scaled('1.00005') == 10000
+    assert to_scaled('1.00015') == 10002
+    assert to_scaled('-1.23456') == -12346
+
+
+def test_to_scaled_does_not_lose_precision_on_large_amounts():
+    assert to_scaled('98,765,432,109,876.5432') == 987654321098765432
+    assert to_scaled('123456789012345678901.25') == 1234567890123456789012500
+
+
+@pytest.mark.parametrize('scaled, text', [
+    (30 * SCALE, '30.00'),
+    (12345000, '1234.50'),
+    (12345670, '1234.567'),
+    (12345678, '1234.5678'),
+    (1, '0.0001'),
+    (0, '0.00'),
+    (-55000, '-5.50'),
+    (None, None),
+])
+def test_to_text_gives_canonical_decimals(scaled, text):
+    assert to_text(scaled) == text
+
+
+def test_to_text_is_exact_beyond_float_precision():
+    assert to_text(987654321098765432) == '98765432109876.5432'
+    assert to_text(1234567890123456789012500) == '123456789012345678901.25'
+    assert to_text(-1234567890123456789012500) == '-123456789012345678901.25'
+
+
+@pytest.mark.parametrize('text', ['0.00', '1.00', '1234.50', '0.0001', '-17.125', '99999999.9999',
+                                  '98765432109876.5432', '123456789012345678901.25'])
+def test_text_round_trips_through_scaled(text):
+    assert to_text(to_scaled(text)) == text
+
+
+def test_to_float():
+    assert to_float(12345000) == 1234.5
+    assert to_float(None) is None
+
+
+def extractor_row(**overrides):
+    row = {'isin_code': 'INE000A01011', 'company_name': 'ACME LTD',
+           'current_bal': '1,000', 'rate': '12.5', 'value': 'N/A'}
+    row.update(overrides)
+    return row
+
+
+def test_from_dict_parses_numbers_and_to_dict_gives_the_stored_form():
+    record = Holding.from_dict(extractor_row())
+    assert (record.current_bal, record.rate, record.value) == (1000 * SCALE, 125000, None)
+    assert record.to_dict() == {'isin_code': 'INE000A01011', 'company_name': 'ACME LTD',
+                                'current_bal': '1000.00', 'rate': '12.50', 'value': None}
+
+
+def test_from_dict_defaults_missing_text_fields():
+    record = Holding.from_dict({'current_bal': '5'})
+    assert record.isin_code == '' and record.company_name == ''
+    assert record.to_dict()['current_bal'] == '5.00'
+
+
+def test_enrichment_fields_are_kept_only_when_set():
+    plain = Holding.from_dict(extractor_row()).to_dict()
+    assert not set(holding.ENRICHMENT_FIELDS) & set(plain)
+
+    enriched = Holding.from_dict(extractor_row(instrument_type='equity', symbol='ACME')).to_dict()
+    assert enriched['instrument_type'] == 'equity'
+    assert enriched['symbol'] == 'ACME'
+    assert 'canonical_name' not in enriched
+
+
+def test_normalise_is_idempotent():
+    once = holding.normalise([extractor_row(), extractor_row(isin_code='INE000B01012', value='12,500.00')])
+    assert holding.normalise(once) == once
+    assert once[1]['value'] == '12500.00'
+
+
+def test_stored_form_round_trips_to_equal_records():
+    record = Holding.from_dict(extractor_row(rate='0.0001', instrument_type='etf'))
+    assert Holding.from_dict(record.to_dict()) == record
+
+
+def test_to_row_gives_compact_schema_doubles():
+    record = Holding.from_dict(extractor_row())
+    assert record.to_row() == ['INE000A01011', 'ACME LTD', 1000.0, 12.5, None]
+
+
+def test_dumps_json_matches_the_stored_form():
+    records = [
+        Holding.from_dict(extractor_row()),
+        Holding.from_dict(extractor_row(company_name='ÉLAN "QUOTED" LTD', symbol='ELAN', value='0.0001')),
+    ]
+    assert json.loads(holding.dumps_json(records)) == holding.to_dicts(records)
+
+
+def test_dumps_json_without_orjson_matches_the_stored_form(monkeypatch):
+    monkeypatch.setattr(holding, 'orjson', None)
+    records = [
+        Holding.from_dict(extractor_row()),
+        Holding.from_dict(extractor_row(company_name='ÉLAN "QUOTED" LTD', symbol='ELAN', value='0.0001')),
+    ]
+    assert json.loads(holding.dumps_json(records)) == holding.to_dicts(records)
+    assert json.loads(holding.dumps_json([])) == []
+
+
+def test_msgpack_rows_round_trip():
+    pytest.importorskip('msgpack')
+    records = [
+        Holding.from_dict(extractor_row()),
+        Holding.from_dict(extractor_row(isin_code='INE000B01012', current_bal='3', rate='1234.5678',
+                                        value='3703.7034')),
+    ]
+    assert holding.unpackb(holding.packb(records)) == records
+
+
+def test_other_extractor_fields_pass_through():
+    partial = extractor_row(numbers=['10', '12.5'], value=None)
+    record = Holding.from_dict(partial)
+    assert record.extra == {'numbers': ['10', '12.5']}
+    assert record.to_dict()['numbers'] == ['10', '12.5']
+    assert holding.normalise([partial])[0]['numbers'] == ['10', '12.5']
+    assert Holding.from_dict(record.to_dict()) == record
+    assert Holding.from_dict(extractor_row()).extra is None
+
+
+def test_dumps_json_keeps_other_extractor_fields(monkeypatch):
+    records = [Holding.from_dict(extractor_row(numbers=['10', '12.5'], note='ÉLAN'))]
+    assert json.loads(holding.dumps_json(records)) == holding.to_dicts(records)
+    monkeypatch.setattr(holding, 'orjson', None)
+    assert json.loads(holding.dumps_json(records)) == holding.to_dicts(records)
@@ -0,0 +1,81 @@
+from portfolio_delta import diff_holdings, holding_changed, index_by_isin, is_empty
+
+
+def row(isin, bal='10', rate='100.00', value='1000.00', name='ACME LTD'):
+    return {'isin_code': isin, 'company_name': name, 'current_bal': bal, 'rate': rate, 'value': value}
+
+
+def test_identical_snapshots_give_an_empty_delta():
+    holdings = [row('INE000A01011'), row('INE000B01012')]
+    delta = diff_holdings(holdings, [dict(h) for h in holdings])
+    assert delta == {'added': [], 'changed': [], 'removed': []}
+    assert is_empty(delta)
+
+
+def test_added_changed_and_removed():
+    previous = [row('INE000A01011'), row('INE000B01012'), row('INE000C01013')]
+    changed = row('INE000B01012', bal='15', value='1500.00')
+    added = row('INE000D01014')
+    delta = diff_holdings(previous, [row('INE000A01011'), changed, added])
+
+    assert delta['added'] == [added]
+    assert delta['changed'] == [changed]
+    assert delta['removed'] == ['INE000C01013']
+    assert not is_empty(delta)
+
+
+def test_first_snapshot_adds_everything():
+    current = [row('INE000A01011'), row('INE000B01012')]
+    delta = diff_holdings(None, current)
+    assert delta == {'added': current, 'changed': [], 'removed': []}
+
+
+def test_empty_snapshot_removes_everything():
+    delta = diff_holdings([row('INE000A01011'), row('INE000B01012')], [])
+    assert delta == {'added': [], 'changed': [], 'removed': ['INE000A01011', 'INE000B01012']}
+
+
+def test_numbers_are_compared_by_value_not_text():
+    # The same holding as formatted by an extractor and as stored canonically
+    old = row('INE000A01011', bal='1,000', rate='12.5', value='12500')
+    new = row('INE000A01011', bal='1000.00', rate='12.50', value='12,500.00')
+    assert not holding_changed(old, new)
+    assert is_empty(diff_holdings([old], [new]))
+
+
+def test_missing_values_compare_equal_whatever_the_spelling():
+    old = row('INE000A01011', rate='N/A', value='-')
+    new = row('INE000A01011', rate=None, value='')
+    assert not holding_changed(old, new)
+
+
+def test_a_value_becoming_missing_is_a_change():
+    assert holding_changed(row('INE000A01011', rate='100.00'), row('INE000A01011', rate='N/A'))
+
+
+def test_each_compared_field_and_the_name_count_as_changes():
+    base = row('INE000A01011')
+    assert holding_changed(base, row('INE000A01011', bal='11'))
+    assert holding_changed(base, row('INE000A01011', rate='100.01'))
+    assert holding_changed(base, row('INE000A01011', value='1000.01'))
+    assert holding_changed(base, row('INE000A01011', name='ACME LIMITED'))
+
+
+def test_other_fields_are_ignored():
+    old = dict(row('INE000A01011'), symbol='ACME')
+    new = dict(row('INE000A01011'), symbol='ACME1', instrument_type='equity')
+    assert not holding_changed(old, new)
+
+
+def test_rows_without_an_isin_are_ignored():
+    delta = diff_holdings([row('')], [row(None), {'company_name': 'NO ISIN'}])
+    assert is_empty(delta)
+
+
+def test_a_repeated_isin_keeps_the_last_row():
+    first = row('INE000A01011', bal='10')
+    last = row('INE000A01011', bal='20')
+    assert index_by_isin([first, last]) == {'INE000A01011': last}
+
+    delta = diff_holdings([row('INE000A01011', bal='10')], [first, last])
+    assert delta['changed'] == [last]
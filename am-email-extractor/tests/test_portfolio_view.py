@@ -0,0 +1,90 @@
+from datetime import datetime
+import pytest
+import portfolio_view
+
+mongomock = pytest.importorskip('mongomock')
+
+
+def snapshot(snapshot_id, broker, holdings, user_id='user-1'):
+    return {'_id': snapshot_id, 'user_id': user_id, 'broker': broker, 'extracted_at': datetime(2024, 3, 1),
+            'holdings': [{'isin_code': isin, 'company_name': f'{isin} LTD', 'current_bal': str(quantity),
+                          'value': str(value), 'instrument_type': 'equity'}
+                         for isin, quantity, value in holdings]}
+
+
+class RacingViews:
+    """portfolio_views whose next find_one lets another snapshot be applied right after the read"""
+
+    def __init__(self, db):
+        self.collection = db[portfolio_view.VIEWS_COLLECTION]
+        self.db = db
+        self.interleave = []
+
+    def __getitem__(self, name):
+        return self
+
+    def find_one(self, *args, **kwargs):
+        found = self.collection.find_one(*args, **kwargs)
+        if self.interleave:
+            portfolio_view.apply_snapshot(self.db, self.interleave.pop())
+        return found
+
+    def update_one(self, *args, **kwargs):
+        return self.collection.update_one(*args, **kwargs)
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def view(db):
+    return db[portfolio_view.VIEWS_COLLECTION].find_one({'_id': 'user-1'})
+
+
+def test_snapshots_replace_their_brokers_contribution(db):
+    portfolio_view.apply_snapshot(db, snapshot('s1', 'zerodha', [('INE000A01011', 10, 1000)]))
+    portfolio_view.apply_snapshot(db, snapshot('s2', 'groww', [('INE000A01011', 5, 500)]))
+    portfolio_view.apply_snapshot(db, snapshot('s3', 'zerodha', [('INE000A01011', 12, 1300)]))
+
+    stored = view(db)
+    assert stored['totals']['value'] == 1800
+    assert stored['positions']['INE000A01011']['quantity'] == 17
+    assert stored['positions']['INE000A01011']['broker_count'] == 2
+    assert stored['brokers']['zerodha']['snapshot_id'] == 's3'
+
+
+def test_a_concurrent_snapshot_for_the_same_broker_is_not_double_counted(db):
+    portfolio_view.apply_snapshot(db, snapshot('s1', 'zerodha', [('INE000A01011', 10, 1000)]))
+
+    # s3 reads the view holding s1's contribution, then s2 lands before s3 writes
+    racing = RacingViews(db)
+    racing.interleave.append(snapshot('s2', 'zerodha', [('INE000A01011', 20, 2000)]))
+    portfolio_view.apply_snapshot(racing, snapshot('s3', 'zerodha', [('INE000A01011', 30, 3000)]))
+
+    stored = view(db)
+    assert stored['totals']['value'] == 3000
+    assert stored['positions']['INE000A01011']['quantity'] == 30
+    assert stored['brokers']['zerodha']['snapshot_id'] == 's3'
+
+
+def test_concurrent_first_snapshots_both_count(db):
+    racing = RacingViews(db)
+    racing.interleave.append(snapshot('s1', 'groww', [('INE000B01012', 1, 100)]))
+    portfolio_view.apply_snapshot(racing, snapshot('s2', 'zerodha', [('INE000A01011', 10, 1000)]))
+
+    stored = view(db)
+    assert stored['totals']['value'] == 1100
+    assert set(stored['brokers']) == {'groww', 'zerodha'}
+
+
+def test_gives_up_when_the_contribution_keeps_changing(db):
+    portfolio_view.apply_snapshot(db, snapshot('s1', 'zerodha', [('INE000A01011', 10, 1000)]))
+    racing = RacingViews(db)
+    racing.interleave = [snapshot(f'r{n}', 'zerodha', [('INE000A01011', n, n * 100)])
+                         for n in range(1, portfolio_view.MAX_ATTEMPTS + 1)]
+
+    with pytest.raises(portfolio_view.ViewConflict):
+        portfolio_view.apply_snapshot(racing, snapshot('s9', 'zerodha', [('INE000A01011', 9, 900)]))
+    # The last snapshot that did apply is counted exactly once
+    assert view(db)['totals']['value'] == 100
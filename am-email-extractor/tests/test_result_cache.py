@@ -0,0 +1,93 @@
+from datetime import timedelta
+import pytest
+import brokers
+import database
+import result_cache
+
+SHA = 'a' * 64
+HOLDINGS = [{'isin_code': 'INE000A01011', 'company_name': 'ACME LTD', 'current_bal': '10',
+             'rate': '100.00', 'value': '1000.00'}]
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setenv('RESULT_CACHE_ENABLED', 'true')
+    monkeypatch.setenv('RESULT_CACHE_SECRET', 'cache-secret')
+    monkeypatch.setenv('RESULT_CACHE_TTL_DAYS', '7')
+    return result_cache.ResultCache()
+
+
+def test_disabled_without_a_secret(monkeypatch):
+    monkeypatch.setenv('RESULT_CACHE_ENABLED', 'true')
+    monkeypatch.delenv('RESULT_CACHE_SECRET', raising=False)
+    monkeypatch.delenv('JWT_SECRET', raising=False)
+    assert not result_cache.ResultCache().enabled
+
+
+def test_falls_back_to_the_jwt_secret(monkeypatch, cache):
+    monkeypatch.delenv('RESULT_CACHE_SECRET')
+    monkeypatch.setenv('JWT_SECRET', 'jwt-secret')
+    fallback = result_cache.ResultCache()
+    assert fallback.enabled
+    assert fallback.verifier(SHA, None) != cache.verifier(SHA, None)
+
+
+def test_key_includes_the_parser_version(cache):
+    assert cache.key(SHA, 'zerodha') == f"zerodha:{brokers.parser_version('zerodha')}:{SHA}"
+    assert cache.key(SHA, 'zerodha') != cache.key(SHA, 'groww')
+
+
+def test_verifier_binds_the_digest_and_password(cache):
+    verifier = cache.verifier(SHA, 'PAN1234')
+    assert verifier == cache.verifier(SHA, 'PAN1234')
+    assert verifier != cache.verifier(SHA, 'PAN1235')
+    assert verifier != cache.verifier('b' * 64, 'PAN1234')
+    assert cache.verifier(SHA, None) == cache.verifier(SHA, '')
+    # Only a keyed hash is stored, never the password
+    assert 'PAN1234' not in verifier
+
+
+def test_entry(cache):
+    entry = cache.entry(SHA, 'zerodha', 'PAN1234', HOLDINGS)
+    assert entry['_id'] == cache.key(SHA, 'zerodha')
+    assert entry['parser_version'] == brokers.parser_version('zerodha')
+    assert entry['holdings'] == HOLDINGS
+    assert entry['expires_at'] - entry['created_at'] == timedelta(days=7)
+    assert 'PAN1234' not in str(entry)
+
+
+def test_a_hit_needs_the_same_password(cache):
+    entry = cache.entry(SHA, 'zerodha', 'PAN1234', HOLDINGS)
+    assert cache.holdings_from(entry, SHA, 'zerodha', 'PAN1234') == HOLDINGS
+    assert cache.holdings_from(entry, SHA, 'zerodha', 'WRONG') is None
+    assert cache.holdings_from(entry, SHA, 'zerodha', None) is None
+
+
+def test_an_unprotected_statement_hits_without_a_password(cache):
+    entry = cache.entry(SHA, 'zerodha', None, HOLDINGS)
+    assert cache.holdings_from(entry, SHA, 'zerodha', None) == HOLDINGS
+    assert cache.holdings_from(entry, SHA, 'zerodha', 'PAN1234') is None
+
+
+def test_no_entry_is_a_miss(cache):
+    assert cache.holdings_from(None, SHA, 'zerodha', None) is None
+
+
+def test_disabled_cache_misses_without_a_query(monkeypatch, cache):
+    cache.enabled = False
+    monkeypatch.setattr(database, 'get_db', lambda: pytest.fail('database queried'))
+    assert cache.lookup(SHA, 'zerodha', None) is None
+    assert cache.lookup_many([(SHA, 'zerodha', None), (SHA, 'groww', None)]) == [None, None]
+    cache.store(SHA, 'zerodha', None, HOLDINGS)
+    cache.store_many([(SHA, 'zerodha', None, HOLDINGS)])
+
+
+def test_a_failing_database_is_a_miss_not_an_error(monkeypatch, cache):
+    def unavailable():
+        raise ConnectionError('MongoDB unavailable')
+
+    monkeypatch.setattr(database, 'get_db', unavailable)
+    assert cache.lookup(SHA, 'zerodha', None) is None
+    assert cache.lookup_many([(SHA, 'zerodha', None), (SHA, 'groww', None)]) == [None, None]
+    cache.store(SHA, 'zerodha', None, HOLDINGS)
+    cache.store_many([(SHA, 'zerodha', None, HOLDINGS)])
@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import pytest
+import upload_stream
+from upload_stream import UploadRejected, UploadSink, declared_kind, sniff
+
+PDF = b'%PDF-1.7\n' + b'x' * 3000
+XLSX = b'PK\x03\x04' + b'\x00' * 3000
+
+
+def stream(sink, data, chunk=100):
+    for start in range(0, len(data), chunk):
+        sink.write(data[start:start + chunk])
+    return sink.finish()
+
+
+@pytest.mark.parametrize('filename, kind', [
+    ('statement.pdf', 'pdf'), ('HOLDINGS.XLSX', 'xlsx'), ('a.b.pdf', 'pdf'),
+    ('statement.xls', None), ('statement', None), ('', None), (None, None),
+])
+def test_declared_kind(filename, kind):
+    assert declared_kind(filename) == kind
+
+
+def test_sniff():
+    assert sniff(PDF) == 'pdf'
+    assert sniff(b'\r\n  junk' + PDF) == 'pdf'
+    assert sniff(b'x' * 1024 + PDF) is None
+    assert sniff(XLSX) == 'xlsx'
+    assert sniff(b'<html>') is None
+    assert sniff(b'') is None
+
+
+@pytest.mark.parametrize('filename, data', [('statement.pdf', PDF), ('holdings.xlsx', XLSX)])
+def test_a_valid_upload_is_hashed_and_stored(filename, data):
+    sink = stream(UploadSink(filename, 1 << 20), data)
+    try:
+        assert sink.kind == declared_kind(filename)
+        assert sink.size == len(data)
+        assert sink.sha256 == hashlib.sha256(data).hexdigest()
+        with open(sink.path, 'rb') as f:
+            assert f.read() == data
+    finally:
+        sink.close()
+    assert sink.closed
+
+
+def test_a_pdf_header_split_across_chunks_and_after_junk_is_accepted():
+    data = b'\n\n' + PDF
+    sink = stream(UploadSink('statement.pdf', 1 << 20), data, chunk=3)
+    assert sink.kind == 'pdf'
+    sink.close()
+
+
+def test_a_short_file_is_sniffed_when_finished():
+    sink = UploadSink('statement.pdf', 1 << 20)
+    sink.write(b'%PDF')
+    assert sink.kind is None
+    with pytest.raises(UploadRejected) as rejected:
+        sink.finish()
+    assert rejected.value.status == 415
+
+
+@pytest.mark.parametrize('filename', ['', None])
+def test_no_filename_is_rejected(filename):
+    with pytest.raises(UploadRejected) as rejected:
+        UploadSink(filename, 1 << 20)
+    assert rejected.value.status == 400
+
+
+def test_other_extensions_are_rejected_before_any_data():
+    with pytest.raises(UploadRejected, match='Only PDF and Excel'):
+        UploadSink('statement.csv', 1 << 20)
+
+
+def test_mismatched_content_is_rejected_from_the_first_chunk():
+    sink = UploadSink('statement.pdf', 1 << 20)
+    with pytest.raises(UploadRejected) as rejected:
+        sink.write(XLSX[:100])
+    assert rejected.value.status == 415
+    assert sink.closed
+
+
+def test_content_without_a_header_is_rejected_once_the_window_fills():
+    sink = UploadSink('statement.pdf', 1 << 20)
+    sink.write(b'<html>' + b' ' * 500)
+    with pytest.raises(UploadRejected) as rejected:
+        sink.write(b' ' * 600)
+    assert rejected.value.status == 415
+
+
+def test_an_oversized_upload_is_rejected_while_streaming():
+    sink = UploadSink('statement.pdf', 2048)
+    with pytest.raises(UploadRejected) as rejected:
+        stream(sink, PDF)
+    assert rejected.value.status == 413
+    assert sink.size <= 2048 + 100
+    assert sink.closed
+
+
+def test_an_upload_at_the_limit_is_accepted():
+    sink = stream(UploadSink('statement.pdf', len(PDF)), PDF)
+    assert sink.size == len(PDF)
+    sink.close()
+
+
+def test_an_empty_upload_is_rejected():
+    with pytest.raises(UploadRejected, match='empty'):
+        UploadSink('statement.pdf', 1 << 20).finish()
+
+
+def test_a_lenient_sink_defers_the_rejection_to_finish():
+    sink = UploadSink('statement.pdf', 2048, strict=False)
+    for start in range(0, len(PDF), 100):
+        assert sink.write(PDF[start:start + 100]) == len(PDF[start:start + 100])
+    assert sink.error is not None and sink.error.status == 413
+    assert sink.closed
+    with pytest.raises(UploadRejected) as rejected:
+        sink.finish()
+    assert rejected.value is sink.error
+
+
+def test_a_lenient_sink_records_a_bad_filename():
+    sink = UploadSink('statement.txt', 1 << 20, strict=False)
+    assert sink.write(PDF) == len(PDF)
+    with pytest.raises(UploadRejected, match='Only PDF and Excel'):
+        sink.finish()
+
+
+def multipart_body(boundary, parts):
+    body = b''
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else '')
+        body += f'--{boundary}\r\nContent-Disposition: {disposition}\r\n\r\n'.encode('utf-8') + data + b'\r\n'
+    return body + f'--{boundary}--\r\n'.encode('utf-8')
+
+
+async def chunked(data, size=512):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def parse(body, content_type, **kwargs):
+    return asyncio.run(upload_stream.parse_multipart(
+        chunked(body), content_type, lambda filename: UploadSink(filename, 1 << 20), **kwargs))
+
+
+def test_parse_multipart_streams_files_into_sinks():
+    pytest.importorskip('multipart')
+    body = multipart_body('xyz', [('broker', None, b'zerodha'), ('file', 'statement.pdf', PDF)])
+    fields, files = parse(body, 'multipart/form-data; boundary=xyz')
+
+    assert fields == {'broker': 'zerodha'}
+    sink = files['file'].finish()
+    assert sink.filename == 'statement.pdf'
+    assert sink.sha256 == hashlib.sha256(PDF).hexdigest()
+    sink.close()
+
+
+def test_parse_multipart_rejects_a_bad_file_and_closes_its_sinks():
+    pytest.importorskip('multipart')
+    sinks = []
+
+    def factory(filename):
+        sinks.append(UploadSink(filename, 1 << 20))
+        return sinks[-1]
+
+    body = multipart_body('xyz', [('file_1', 'a.pdf', PDF), ('file_2', 'b.pdf', XLSX)])
+    with pytest.raises(UploadRejected) as rejected:
+        asyncio.run(upload_stream.parse_multipart(chunked(body), 'multipart/form-data; boundary=xyz', factory))
+    assert rejected.value.status == 415
+    assert all(sink.closed for sink in sinks)
+
+
+def test_parse_multipart_limits_form_fields():
+    pytest.importorskip('multipart')
+    body = multipart_body('xyz', [('broker', None, b'z' * 200)])
+    with pytest.raises(UploadRejected) as rejected:
+        parse(body, 'multipart/form-data; boundary=xyz', max_field_bytes=100)
+    assert rejected.value.status == 413
+
+
+def test_parse_multipart_requires_a_boundary():
+    pytest.importorskip('multipart')
+    with pytest.raises(UploadRejected, match='multipart/form-data'):
+        parse(b'', 'application/json')
+
+
+def test_parse_multipart_limits_the_whole_body_while_streaming():
+    pytest.importorskip('multipart')
+    body = multipart_body('xyz', [(f'file_{n}', f'{n}.pdf', PDF) for n in range(5)])
+    with pytest.raises(UploadRejected) as rejected:
+        parse(body, 'multipart/form-data; boundary=xyz', max_bytes=2 * len(PDF))
+    assert rejected.value.status == 413
+
+
+def test_parse_multipart_limits_the_number_of_files():
+    pytest.importorskip('multipart')
+    sinks = []
+
+    def factory(filename):
+        sinks.append(UploadSink(filename, 1 << 20, strict=False))
+        return sinks[-1]
+
+    body = multipart_body('xyz', [(f'file_{n}', f'{n}.pdf', PDF) for n in range(3)])
+    with pytest.raises(UploadRejected) as rejected:
+        asyncio.run(upload_stream.parse_multipart(chunked(body), 'multipart/form-data; boundary=xyz', factory,
+                                                  max_files=2))
+    assert rejected.value.status == 413
+    assert len(sinks) == 2 and all(sink.closed for sink in sinks)
+
+    fields, files = parse(body, 'multipart/form-data; boundary=xyz', max_files=3)
+    assert len(files) == 3
+    for sink in files.values():
+        sink.close()
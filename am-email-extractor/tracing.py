@@ -0,0 +1,242 @@
+"""
+Lightweight request tracing
+
+Each API request gets a request id (the X-Request-ID header, or a new one)
+that is attached to every log line through RequestIdFilter and returned in
+the response. Sampled requests also record a tree of timed spans around
+Gmail, extractor, database and producer calls:
+
+    with tracing.span('gmail.search', broker=broker):
+        ...
+
+Spans are buffered per trace and exported once the root span ends, either
+as one JSON log line per span on the 'trace' logger (TRACE_EXPORTER=log)
+or as OTLP/JSON lines appended to TRACE_FILE (TRACE_EXPORTER=otlp_file),
+the format read by the OpenTelemetry collector's otlpjsonfile receiver.
+
+With TRACING_ENABLED=false (the default), or for requests that weren't
+sampled, span() returns a shared no-op context manager after one flag
+check, so instrumented code costs nothing measurable.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+import contextvars
+from contextlib import nullcontext
+
+SERVICE_NAME = 'am-email-extractor'
+
+# Incoming X-Request-ID values end up in every log line; anything else is replaced
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+_NOOP = nullcontext()
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+_current = contextvars.ContextVar('current_span', default=None)
+
+logger = logging.getLogger('trace')
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'attributes', 'start_ns', 'end_ns', 'error', '_token')
+
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        self.finish(exc)
+        return False
+
+    def finish(self, error=None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace.spans.append(self)
+        if self.parent_id is None:
+            get_tracer().export(self.trace)
+
+
+class Trace:
+    __slots__ = ('trace_id', 'request_id', 'spans')
+
+    def __init__(self, request_id):
+        self.trace_id = uuid.uuid4().hex
+        self.request_id = request_id
+        self.spans = []
+
+
+class JsonLogExporter:
+    """One JSON log line per span on the 'trace' logger"""
+
+    def export(self, trace):
+        for span in trace.spans:
+            logger.info(json.dumps({
+                'trace_id': trace.trace_id,
+                'request_id': trace.request_id,
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'name': span.name,
+                'start': span.start_ns / 1e9,
+                'duration_ms': round((span.end_ns - span.start_ns) / 1e6, 3),
+                'error': span.error,
+                'attributes': span.attributes
+            }, default=str))
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OtlpFileExporter:
+    """One OTLP/JSON ExportTraceServiceRequest per trace, appended to a file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def export(self, trace):
+        spans = []
+        for span in trace.spans:
+            attributes = dict(span.attributes, request_id=trace.request_id)
+            otlp_span = {
+                'traceId': trace.trace_id,
+                'spanId': span.span_id,
+                'name': span.name,
+                'kind': 2 if span.parent_id is None else 1,  # SERVER / INTERNAL
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns),
+                'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in attributes.items()],
+                'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+            }
+            if span.parent_id:
+                otlp_span['parentSpanId'] = span.parent_id
+            spans.append(otlp_span)
+        line = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': spans}]
+        }]}, default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+        self.sample_rate = float(os.environ.get('TRACE_SAMPLE_RATE', 1.0))
+        exporter = os.environ.get('TRACE_EXPORTER', 'log').lower()  # log | otlp_file
+        if exporter == 'otlp_file':
+            self.exporter = OtlpFileExporter(os.environ.get('TRACE_FILE', 'logs/traces.otlp.jsonl'))
+        else:
+            self.exporter = JsonLogExporter()
+
+    def start_trace(self, name, request_id, **attributes):
+        """Root span for a request, or None when tracing is off or not sampled"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        root = Span(Trace(request_id), name, None, attributes)
+        root._token = _current.set(root)
+        return root
+
+    def export(self, trace):
+        try:
+            self.exporter.export(trace)
+        except Exception as e:
+            logging.warning(f"Failed to export trace {trace.trace_id}: {e}")
+
+
+# Global instance, created on first use
+tracer_instance = None
+_instance_lock = threading.Lock()
+
+def get_tracer():
+    global tracer_instance
+    if tracer_instance is None:
+        with _instance_lock:
+            if tracer_instance is None:
+                tracer_instance = Tracer()
+    return tracer_instance
+
+
+def span(name, **attributes):
+    """Child span of the current span; a no-op unless the request is sampled"""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+def current_span():
+    return _current.get()
+
+
+def begin_request(name, request_id=None, **attributes):
+    """
+    Bind a request id (generated if not given or malformed) and start a
+    sampled root span
+
+    Returns:
+        The root span to pass to end_request, or None
+    """
+    if not request_id or not REQUEST_ID_PATTERN.fullmatch(request_id):
+        request_id = uuid.uuid4().hex
+    _request_id.set(request_id)
+    _current.set(None)
+    return get_tracer().start_trace(name, _request_id.get(), **attributes)
+
+
+def end_request(root, error=None, **attributes):
+    if root is None:
+        return
+    _current.set(None)
+    root.attributes.update(attributes)
+    root.finish(error)
+
+
+def request_id():
+    return _request_id.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """Add request_id to log records, for a %(request_id)s format field"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get() or '-'
+        return True
+
+
+def configure_logging():
+    """Log at LOG_LEVEL with the request id on every line"""
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'))
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'), handlers=[handler])
@@ -0,0 +1,236 @@
+"""
+Streaming statement uploads
+
+An uploaded statement is written chunk by chunk, as the multipart body is
+parsed, into an UploadSink: a temp file that computes the SHA-256 and
+checks the file type on the fly. Nothing holds the whole upload in memory,
+and a bad upload is rejected from its first chunks:
+
+  - the filename must be .pdf or .xlsx
+  - the first bytes must match it (%PDF- for PDF, a ZIP header for xlsx)
+  - the size must stay within the upload limit
+
+The digest is ready the moment the last chunk arrives, so the result cache
+(result_cache.py) is checked before any parsing.
+
+Flask streams file parts through ExtractorRequest._get_file_stream; the
+ASGI app feeds parse_multipart() from request.stream().
+"""
+import os
+import hashlib
+import tempfile
+
+try:
+    import multipart
+    from multipart.multipart import parse_options_header
+except ImportError:
+    multipart = None
+
+# The PDF header may follow a little leading junk, which readers tolerate
+PDF_MAGIC = b'%PDF-'
+PDF_HEADER_WINDOW = 1024
+ZIP_MAGIC = b'PK\x03\x04'
+
+EXTENSIONS = {'.pdf': 'pdf', '.xlsx': 'xlsx'}
+
+
+class UploadRejected(Exception):
+    """The upload was refused while streaming; `status` is the HTTP status to return"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def declared_kind(filename):
+    """'pdf' or 'xlsx' from the filename's extension, else None"""
+    return EXTENSIONS.get(os.path.splitext(filename or '')[1].lower())
+
+
+def sniff(head):
+    """File type from its first bytes: 'pdf', 'xlsx' (any ZIP) or None"""
+    if head.startswith(ZIP_MAGIC):
+        return 'xlsx'
+    if PDF_MAGIC in head[:PDF_HEADER_WINDOW]:
+        return 'pdf'
+    return None
+
+
+class UploadSink:
+    """
+    Writable temp file for one uploaded statement; deleted when closed
+
+    A strict sink raises UploadRejected from write(), aborting the request.
+    A lenient one (batch uploads) records the rejection, discards the rest
+    of its file and raises from finish(), so other files carry on.
+    """
+
+    def __init__(self, filename, max_bytes, strict=True):
+        self.filename = filename
+        self.expected = declared_kind(filename)
+        self.max_bytes = max_bytes
+        self.strict = strict
+        self.error = None
+        self.size = 0
+        self.kind = None
+        self._head = b''
+        self._hash = hashlib.sha256()
+        self.file = self.path = None
+        if not filename:
+            self._reject('No file selected')
+        elif self.expected is None:
+            self._reject('Only PDF and Excel files are allowed')
+        else:
+            self.file = tempfile.NamedTemporaryFile(suffix=f'.{self.expected}')
+            self.path = self.file.name
+
+    def write(self, data):
+        if self.error is not None:
+            return len(data)
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self._reject('File too large', 413)
+        if self.kind is None:
+            self._head += data[:PDF_HEADER_WINDOW - len(self._head)]
+            if len(self._head) >= PDF_HEADER_WINDOW or sniff(self._head):
+                self._check_kind()
+        if self.error is not None:
+            return len(data)
+        self._hash.update(data)
+        self.file.write(data)
+        return len(data)
+
+    def finish(self):
+        """Validate a complete upload (short files are sniffed here) and flush it for reading by path"""
+        if self.error is not None:
+            raise self.error
+        if self.size == 0:
+            self._reject('Uploaded file is empty')
+        elif self.kind is None:
+            self._check_kind()
+        if self.error is not None:
+            raise self.error
+        self.file.flush()
+        return self
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def _check_kind(self):
+        self.kind = sniff(self._head)
+        if self.kind != self.expected:
+            self._reject(f'File content is not a valid {self.expected.upper()} statement', 415)
+
+    def _reject(self, message, status=400):
+        self.close()
+        self.error = UploadRejected(message, status)
+        if self.strict:
+            raise self.error
+
+    # File protocol used by the multipart parsers and FileStorage
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    @property
+    def closed(self):
+        return self.file is None or self.file.closed
+
+
+async def parse_multipart(chunks, content_type, sink_factory, max_field_bytes=64 * 1024, max_bytes=None,
+                          max_files=None):
+    """
+    Stream a multipart/form-data body, writing file parts into sinks
+
+    Args:
+        chunks: Async iterator of body chunks (Starlette request.stream())
+        sink_factory: filename -> UploadSink for each file part
+        max_bytes: Limit on the whole body, enforced as it streams (a
+            chunked request has no Content-Length to check up front)
+        max_files: Limit on the number of file parts
+
+    Returns:
+        (form fields {name: str}, files {name: UploadSink}); on an error the
+        sinks created so far are closed
+    """
+    _, params = parse_options_header(content_type)
+    boundary = params.get(b'boundary')
+    if not boundary:
+        raise UploadRejected('Expected multipart/form-data')
+
+    fields, files = {}, {}
+    part = {}
+    header = {'field': b'', 'value': b''}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, data=[], size=0, sink=None)
+
+    def on_header_field(data, start, end):
+        header['field'] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header['value'] += data[start:end]
+
+    def on_header_end():
+        part['headers'][header['field'].lower()] = header['value']
+        header['field'] = header['value'] = b''
+
+    def on_headers_finished():
+        _, options = parse_options_header(part['headers'].get(b'content-disposition', b''))
+        part['name'] = options.get(b'name', b'').decode('utf-8')
+        if b'filename' in options:
+            if max_files is not None and len(files) >= max_files:
+                raise UploadRejected(f'At most {max_files} files per request', 413)
+            sink = sink_factory(options[b'filename'].decode('utf-8'))
+            files[part['name']] = part['sink'] = sink
+
+    def on_part_data(data, start, end):
+        if part['sink'] is not None:
+            part['sink'].write(data[start:end])
+            return
+        part['size'] += end - start
+        if part['size'] > max_field_bytes:
+            raise UploadRejected('Form field too large', 413)
+        part['data'].append(data[start:end])
+
+    def on_part_end():
+        if part['sink'] is None:
+            fields[part['name']] = b''.join(part['data']).decode('utf-8')
+
+    parser = multipart.MultipartParser(boundary, {
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+    })
+    received = 0
+    try:
+        async for chunk in chunks:
+            if chunk:
+                received += len(chunk)
+                if max_bytes is not None and received > max_bytes:
+                    raise UploadRejected('Request too large', 413)
+                parser.write(chunk)
+        parser.finalize()
+    except BaseException:
+        for sink in files.values():
+            sink.close()
+        raise
+    return fields, files